@@ -1,25 +1,114 @@
 import streamlit as st
-import os, json
-from core.loaders import load_text_files
-from core.preprocess import character_filter, chunk_text
+import io, os, json, time
+from core.loaders import iter_text
+from core.preprocess import iter_sentences, iter_token_chunks
+from core.mentions import filter_chunks, save_mentions
+from core import storage
 from core.index import build_faiss
-from core.retrieval import ensemble_retrieve
+from core.encoders import warmup, token_counter, max_tokens
+from core.embedding import embedding_stats
+from core.retrieval import ensemble_retrieve, character_query
+from core.theory import ensure_theory_index, knowledge_signature, THEORY_QUERIES
+from core.utils import file_digest, fingerprint
 from core.prompts import build_prompt
-from core.generation import template_fallback, hf_infer, extract_json_then_md
+from core.generation import template_fallback, hf_infer_stream, cached_profile, parse_response
+from core.jsonstream import ProfileStream
+from core.mapreduce import map_reduce_profile
+from core.llmcache import cache_stats as llm_cache_stats, clear as clear_llm_cache
+from core import metrics
 
 st.set_page_config(page_title="Psyche AI – Psychological Profiling", page_icon="🧠", layout="centered")
 st.title("🧠 Psyche AI – Psychological Profiling")
 st.caption("Generic RAG + optional HF API (multi-lingual) | Bring your own texts")
 
+# Spans of this rerun, shown in the Performance expander at the bottom
+run_trace = metrics.start_trace("rerun")
+if os.getenv("PSYCHE_METRICS_PORT"):
+    metrics.serve_metrics(int(os.getenv("PSYCHE_METRICS_PORT")))
+
 DEFAULT_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct"
 EMB_MODEL = "intfloat/multilingual-e5-base"
+CHUNK_OVERLAP_TOKENS = 32
+
+# Every widget interaction reruns this script, so each pipeline stage is memoized on
+# its inputs: the corpus is reduced to a content fingerprint, its index lives in a
+# namespace shared by every session (core.storage), and only a changed input
+# recomputes the stages after it.
+
+
+def source_digest(name, f):
+    # Uploaded files keep their id across reruns, so each is hashed once per session
+    fid = getattr(f, "file_id", None)
+    if fid is None:
+        return file_digest(f)
+    memo = st.session_state.setdefault("digests", {})
+    if fid not in memo:
+        memo[fid] = file_digest(f)
+    return memo[fid]
+
+
+@st.cache_resource(show_spinner="Preparing psychology theory index...")
+def prepare_theory(emb_model, psych_dir, signature):
+    # Rebuilt only when knowledge/psychology/ changes (signature: names, sizes, mtimes)
+    ensure_theory_index(emb_model, psych_dir)
+    return signature
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def retrieve(index_name, theory_signature, char_query, theory_query, k_char, k_psych, hybrid):
+    # index_name embeds the corpus key, so cached hits never outlive their corpus
+    return ensemble_retrieve(char_query, theory_query, EMB_MODEL, k_char, k_psych, hybrid=hybrid,
+                             index_name=index_name)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def make_prompt(character, char_hits, psych_hits, language, user_context, budget, model):
+    packing = {}
+    prompt = build_prompt(character, char_hits, psych_hits, language=language, user_context=user_context,
+                          budget_tokens=budget, model=model, report=packing)
+    return prompt, packing
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def template_profile(character, char_hits, psych_hits, language):
+    return template_fallback(character, char_hits, psych_hits, language=language)
+
+
+def clear_pipeline_caches():
+    for fn in (retrieve, make_prompt, template_profile, prepare_theory):
+        fn.clear()
+    storage.clear()
+    st.session_state.pop("digests", None)
+
+# Load the embedding model once per process (shared across sessions and reruns)
+with st.spinner("Loading embedding model..."):
+    warmup([EMB_MODEL])
 
 st.sidebar.header("Settings")
 language = st.sidebar.selectbox("Output language", ["pt", "en"], index=0)
 use_hf = st.sidebar.toggle("Use Hugging Face API (if HF_API_TOKEN is set)", value=False)
 hf_model = st.sidebar.text_input("HF Model", DEFAULT_MODEL, disabled=not use_hf)
+use_cache = st.sidebar.toggle("Reuse cached LLM answers", value=True, disabled=not use_hf)
+if use_hf:
+    if st.sidebar.button("Clear LLM cache"):
+        clear_llm_cache()
+    _cs = llm_cache_stats()
+    st.sidebar.caption(f"LLM cache: {_cs['entries']} answers, {_cs['hits']} hits / {_cs['misses']} misses")
 k_char = st.sidebar.slider("Top-k evidence", 4, 20, 10)
 k_psych = st.sidebar.slider("Top-k psychology theory", 3, 15, 6)
+budget = st.sidebar.slider("Context budget (tokens)", 500, 8000, 3000, step=250,
+                           help="Evidence + theory tokens in the prompt; overlapping chunks are merged")
+hybrid = st.sidebar.toggle("Hybrid retrieval (BM25 + dense)", value=True)
+map_reduce = st.sidebar.toggle("Map-reduce over all evidence", value=False,
+                               help="Profile each part of the corpus separately and merge the partial profiles: "
+                                    "nothing is left out, at one LLM call per partition")
+partition_by = st.sidebar.selectbox("Partition by", ["section", "time"], disabled=not map_reduce,
+                                    help="section: per source file; time: consecutive windows over the corpus")
+if st.sidebar.button("Clear pipeline caches", help="Drop memoized retrieval/prompts and the stored corpus indices"):
+    clear_pipeline_caches()
+_ss = storage.storage_stats()
+st.sidebar.caption(f"Corpus indices: {_ss['namespaces']} stored, {_ss['bytes'] / 2 ** 20:.1f} MB "
+                   f"(keeps {_ss['max_indexes']} / {_ss['quota_mb']:.0f} MB)")
 
 st.markdown("### 1) Upload your corpus (.txt or .md) – OR paste text directly")
 
@@ -41,7 +130,8 @@ psych_dir = os.path.join(BASE_DIR, "knowledge", "psychology")
 os.makedirs(psych_dir, exist_ok=True)
 
 # Bootstrap minimal psych theory if empty
-if not os.listdir(psych_dir):
+theory_signature = knowledge_signature(psych_dir)
+if theory_signature == "{}":
     with open(os.path.join(psych_dir, "big_five.md"), "w", encoding="utf-8") as f:
         f.write("# Big Five (OCEAN)\n- Openness\n- Conscientiousness\n- Extraversion\n- Agreeableness\n- Neuroticism\n")
     with open(os.path.join(psych_dir, "attachment.md"), "w", encoding="utf-8") as f:
@@ -50,24 +140,21 @@ if not os.listdir(psych_dir):
         f.write("# Coping Strategies\n- Problem-focused\n- Emotion-focused\n- Maladaptive\n")
     with open(os.path.join(psych_dir, "defenses.md"), "w", encoding="utf-8") as f:
         f.write("# Defense Mechanisms\n- Denial, Projection, Rationalization, Displacement, Sublimation, Humor, Intellectualization.\n")
+    theory_signature = knowledge_signature(psych_dir)
 
-docs = []
+prepare_theory(EMB_MODEL, psych_dir, theory_signature)
+
+# (name, binary file object) pairs; contents are streamed when indexing, never decoded whole
+sources = []
 
 # From uploaded files
 if uploaded:
     for f in uploaded:
-        text = f.read().decode("utf-8", errors="ignore")
-        docs.append({"source": f.name, "text": text})
+        sources.append((f.name, f))
 
 # From pasted text
 if pasted_text and pasted_text.strip():
-    docs.append({"source": "pasted_text", "text": pasted_text.strip()})
-
-psych_docs = []
-for name in os.listdir(psych_dir):
-    if name.endswith(".md"):
-        with open(os.path.join(psych_dir, name), "r", encoding="utf-8") as f:
-            psych_docs.append({"source": name, "text": f.read()})
+    sources.append(("pasted_text", io.BytesIO(pasted_text.strip().encode("utf-8"))))
 
 st.markdown("### 2) Define entity/character to profile")
 character = st.text_input("Entity name (character/person/etc.)", "Entity X")
@@ -79,39 +166,100 @@ user_context = st.text_area(
     height=100
 )
 
+# Same files/text, chunking, entity and embedding model -> same index name, in any session
+corpus_key = fingerprint([(name, source_digest(name, f)) for name, f in sources],
+                         overlap=CHUNK_OVERLAP_TOKENS) if sources else None
+index_name = storage.namespace(corpus_key, character, EMB_MODEL) if corpus_key else None
+indexed = index_name is not None and storage.lookup(index_name)
+
 build_btn = st.button("Build indices (RAG)")
 
 if build_btn:
-    if not docs:
+    if not sources:
         st.warning("No documents uploaded or pasted. Please add text to analyze.")
+    elif indexed:
+        st.success("Indices already built for this corpus and entity. You can now generate a profile.")
     else:
         with st.spinner("Building indices..."):
-            char_docs = character_filter(docs, character)
-            if not char_docs:
-                st.info("No direct mentions found; indexing all provided text for search anyway.")
-                char_docs = docs
-            char_chunks = []
-            for d in char_docs:
-                char_chunks.extend(chunk_text(d, chunk_size=900, overlap=200))
-            psych_chunks = []
-            for d in psych_docs:
-                psych_chunks.extend(chunk_text(d, chunk_size=900, overlap=200))
-            for i, c in enumerate(char_chunks):
-                if "id" not in c: c["id"] = f"char_{i:04d}"
-            for i, c in enumerate(psych_chunks):
-                if "id" not in c: c["id"] = f"psy_{i:04d}"
-            build_faiss(char_chunks, "character", EMB_MODEL)
-            build_faiss(psych_chunks, "psych", EMB_MODEL)
-        st.success("Indices built. You can now generate a profile.")
+            # Stream decode -> normalize -> token-bounded chunks -> mention filter -> embed -> append,
+            # with progress by bytes read. Only chunks that mention the entity are indexed.
+            total_bytes = sum(f.getbuffer().nbytes for _, f in sources) or 1
+            bar = st.progress(0.0, text="Indexing corpus...")
+            done = {"bytes": 0, "chunks": 0}
+
+            def on_bytes(offset):
+                return lambda n: bar.progress(min((offset + n) / total_bytes, 1.0),
+                                              text=f"Indexing corpus... {done['chunks']} chunks")
+
+            count, limit = token_counter(EMB_MODEL), max_tokens(EMB_MODEL)
+
+            def stream_chunks():
+                done["bytes"] = 0
+                for name, f in sources:
+                    blocks = iter_text(f, progress=on_bytes(done["bytes"]))
+                    yield from iter_token_chunks(name, iter_sentences(blocks), count,
+                                                 max_tokens=limit, overlap_tokens=CHUNK_OVERLAP_TOKENS)
+                    done["bytes"] += f.getbuffer().nbytes
+
+            def build():
+                mentions = {}
+                build_faiss(filter_chunks(stream_chunks(), character, mentions), index_name, EMB_MODEL,
+                            progress=lambda n: done.update(chunks=n))
+                if not mentions:
+                    st.info("No direct mentions found; indexing all provided text for search anyway.")
+                    build_faiss(stream_chunks(), index_name, EMB_MODEL,
+                                progress=lambda n: done.update(chunks=n))
+                save_mentions(index_name, {character: mentions})
+
+            emb_before = embedding_stats()
+            # Waits instead if another session is building the same namespace, then reuses it
+            built = storage.ensure(index_name, build)
+            bar.empty()
+            storage.enforce_quota(keep=[index_name])
+            indexed = True
+            emb = embedding_stats()
+            n_emb, secs = emb["texts"] - emb_before["texts"], emb["seconds"] - emb_before["seconds"]
+        st.success("Indices built. You can now generate a profile." if built else
+                   "Another session built this corpus meanwhile; reusing its indices.")
+        if n_emb:
+            st.caption(f"Embedded {n_emb} chunks at {n_emb / max(secs, 1e-9):.1f} chunks/s ({emb['workers']} worker(s))")
 
 st.markdown("### 3) Generate profile")
 gen_btn = st.button("Generate")
 
+if gen_btn and not indexed:
+    st.warning("Build the indices for this corpus and entity first (the text, entity or settings changed).")
+    gen_btn = False
+
+if gen_btn and map_reduce:
+    # Whole-corpus mode (core.mapreduce): finished partitions are checkpointed, so
+    # generating again after a failure only redoes the partitions that failed
+    _, psych_hits = retrieve(index_name, theory_signature, character_query(character), THEORY_QUERIES["default"],
+                             k_char, k_psych, hybrid)
+    bar = st.progress(0.0, text="Profiling partitions...")
+    out = map_reduce_profile(character, index_name, psych_hits, model=hf_model if use_hf else None,
+                             language=language, user_context=user_context, budget_tokens=budget,
+                             partition_by=partition_by, use_cache=use_cache,
+                             progress=lambda d, n: bar.progress(d / n, text=f"Profiling partitions... {d}/{n}"))
+    bar.empty()
+    if out["failed"]:
+        st.warning(f"{len(out['failed'])} of {len(out['partitions'])} partitions failed and were left out; "
+                   "generate again to retry only those.")
+    with st.expander(f"Partitions ({len(out['partitions'])})"):
+        st.table([{"partition": p["label"], "chunks": p["chunks"], "tokens": p["weight"], "mode": p["mode"],
+                   "checkpoint": bool(p.get("cached")), "error": p["error"] or ""} for p in out["partitions"]])
+    st.subheader("JSON (profile)")
+    st.code(json.dumps(out["json"], ensure_ascii=False, indent=2), language="json")
+    st.subheader("Markdown report")
+    st.markdown(out["markdown"])
+    gen_btn = False
+
 if gen_btn:
-    char_query = f"{character} behaviour emotions relationships motivations internal conflict key scenes quotes descriptions"
-    theory_query = "big five traits attachment styles coping mechanisms defense mechanisms psychological profiling glossary examples"
+    char_query = character_query(character)
+    theory_query = THEORY_QUERIES["default"]
 
-    char_hits, psych_hits = ensemble_retrieve(char_query, theory_query, EMB_MODEL, k_char, k_psych)
+    char_hits, psych_hits = retrieve(index_name, theory_signature, char_query, theory_query,
+                                     k_char, k_psych, hybrid)
 
     with st.expander("RAG Context – Evidence"):
         for i, c in enumerate(char_hits, 1):
@@ -123,18 +271,48 @@ if gen_btn:
             st.markdown(f"**{i}. {c['id']}** (score={c['score']:.3f})")
             st.code(c["text"][:800] + (("..." if len(c["text"])>800 else "")), language="markdown")
 
-    prompt = build_prompt(character, char_hits, psych_hits, language=language, user_context=user_context)
+    prompt, packing = make_prompt(character, char_hits, psych_hits, language, user_context, budget,
+                                  hf_model if use_hf else None)
+    st.caption(f"Context: {packing['tokens']} tokens ({packing['counter']}), "
+               f"{packing['evidence']['merged'] + packing['theory']['merged']} overlapping chunks merged, "
+               f"{packing['tokens_saved']} tokens saved vs. unbudgeted")
 
     if use_hf:
         try:
-            with st.spinner("Calling LLM API..."):
-                txt = hf_infer(prompt, model=hf_model)
-            
-            # Debug: show raw response
-            with st.expander("🔍 Debug: Raw LLM response"):
-                st.code(txt[:2000] if len(txt) > 2000 else txt, language="text")
-            
-            parsed = extract_json_then_md(txt)
+            # Same prompt, model and settings as an earlier run: skip inference and parsing
+            parsed = cached_profile(prompt, hf_model) if use_cache else None
+            if parsed is not None:
+                st.caption("⚡ Cached LLM answer (same prompt, model and settings)")
+            else:
+                # Stream the answer: each JSON field is shown once complete, then the Markdown
+                live = st.empty()
+                ps, shown = ProfileStream(), 0.0
+                with st.spinner("Calling LLM API..."):
+                    for delta in hf_infer_stream(prompt, model=hf_model, use_cache=use_cache):
+                        new_fields = ps.feed(delta)
+                        if not new_fields and time.perf_counter() - shown < 0.1:
+                            continue
+                        shown = time.perf_counter()
+                        with live.container():
+                            st.subheader("JSON (profile)")
+                            st.code(json.dumps(ps.fields, ensure_ascii=False, indent=2), language="json")
+                            if ps.markdown:
+                                st.subheader("Markdown report")
+                                st.markdown(ps.markdown)
+                live.empty()
+                txt = ps.text
+
+                # Debug: show raw response
+                with st.expander("🔍 Debug: Raw LLM response"):
+                    st.code(txt[:2000] if len(txt) > 2000 else txt, language="text")
+
+                with st.spinner("Validating profile..."):
+                    parsed = parse_response(txt, prompt, hf_model, character=character, language=language,
+                                            use_cache=use_cache)
+            if parsed.get("repaired"):
+                st.info(f"🔧 Re-requested invalid/missing fields: {', '.join(parsed['repaired'])}")
+            if parsed.get("invalid"):
+                st.caption(f"Fields left at defaults: {', '.join(parsed['invalid'])}")
             
             # Check if valid JSON
             if not parsed["json"] or len(parsed["json"]) == 0:
@@ -192,10 +370,20 @@ if gen_btn:
             use_hf = False
 
     if not use_hf:
-        out = template_fallback(character, char_hits, psych_hits, language=language)
+        out = template_profile(character, char_hits, psych_hits, language)
         st.subheader("JSON (profile)")
         st.code(json.dumps(out["json"], ensure_ascii=False, indent=2), language="json")
         st.subheader("Markdown report")
         st.markdown(out["markdown"])
 
     st.download_button("⬇️ Download prompt", prompt, file_name="prompt.txt")
+
+run_trace.stop()
+if run_trace.spans:
+    with st.expander("⏱️ Performance"):
+        st.caption(f"This run: {run_trace.seconds * 1000:.0f} ms, "
+                   f"peak RSS {run_trace.rss_max / 2 ** 20:.0f} MB (memoized stages don't appear)")
+        st.table([{"stage": r["span"], "calls": r["calls"], "ms": r["ms"], "share": f"{r['share']:.1%}",
+                   "RSS MB": r["rss_max_mb"]} for r in run_trace.breakdown()])
+        if run_trace.counters:
+            st.json(run_trace.counters)
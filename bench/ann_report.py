@@ -0,0 +1,98 @@
+"""
+Recall-vs-latency report for the ANN backends in core.ann against the flat baseline.
+
+    python -m bench.ann_report                       # synthetic clustered vectors
+    python -m bench.ann_report --n 200000 --dim 768
+    python -m bench.ann_report --corpus example_input/*.txt --model intfloat/multilingual-e5-base
+
+Writes a table to stdout and, with --out, the same numbers as JSON.
+"""
+import argparse, glob, json, os, sys, time
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.ann import build_index, search_params, choose_kind  # noqa: E402
+
+
+def synthetic(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    # Gaussian clusters on the unit sphere: closer to real embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(n // 500, 8), dim)).astype(np.float32)
+    x = centers[rng.integers(0, len(centers), n)] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+    faiss.normalize_L2(x)
+    return x
+
+
+def corpus_vectors(patterns, model_name: str) -> np.ndarray:
+    from core.loaders import load_text_files
+    from core.preprocess import chunk_text
+    from core.embcache import encode_cached
+    paths = [p for pat in patterns for p in glob.glob(pat)]
+    chunks = [c for d in load_text_files(paths) for c in chunk_text(d)]
+    return encode_cached(model_name, [c["text"] for c in chunks])
+
+
+def measure(index, queries: np.ndarray, k: int, truth: np.ndarray, **knobs):
+    params = search_params(index, **knobs)
+    t0 = time.perf_counter()
+    _, ids = index.search(queries, k, params=params)
+    dt = time.perf_counter() - t0
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, truth)])
+    return {"recall@k": round(float(recall), 4), "ms_per_query": round(1000 * dt / len(queries), 4)}
+
+
+def index_bytes(index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--n", type=int, default=50_000)
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--corpus", nargs="*")
+    ap.add_argument("--model", default="intfloat/multilingual-e5-base")
+    ap.add_argument("--out")
+    args = ap.parse_args(argv)
+
+    x = corpus_vectors(args.corpus, args.model) if args.corpus else synthetic(args.n, args.dim)
+    rng = np.random.default_rng(1)
+    q = x[rng.choice(len(x), min(args.queries, len(x)), replace=False)].copy()
+    q += 0.05 * rng.standard_normal(q.shape).astype(np.float32)
+    faiss.normalize_L2(q)
+    ids = np.arange(len(x), dtype=np.int64)
+    k = min(args.k, len(x))
+
+    rows = []
+    flat = build_index(x, kind="flat")
+    flat.add_with_ids(x, ids)
+    _, truth = flat.search(q, k)
+    rows.append({"kind": "flat", "knob": "-", **measure(flat, q, k, truth), "bytes": index_bytes(flat)})
+
+    sweeps = {"hnsw": ("ef_search", [16, 32, 64, 128, 256]), "ivf": ("nprobe", [1, 4, 16, 64]),
+              "ivfpq": ("nprobe", [1, 4, 16, 64])}
+    for kind, (knob, values) in sweeps.items():
+        if kind != "hnsw" and len(x) < 256 * 39:
+            continue  # not enough vectors to train IVF/PQ meaningfully
+        t0 = time.perf_counter()
+        index = build_index(x, kind=kind)
+        index.add_with_ids(x, ids)
+        build_s = round(time.perf_counter() - t0, 2)
+        size = index_bytes(index)
+        for v in values:
+            rows.append({"kind": kind, "knob": f"{knob}={v}", **measure(index, q, k, truth, **{knob: v}),
+                         "bytes": size, "build_s": build_s})
+
+    print(f"n={len(x)} dim={x.shape[1]} queries={len(q)} k={k} auto-policy -> {choose_kind(*x.shape)}")
+    print(f"{'kind':<7}{'knob':<15}{'recall@k':>10}{'ms/query':>10}{'MB':>10}")
+    for r in rows:
+        print(f"{r['kind']:<7}{r['knob']:<15}{r['recall@k']:>10.4f}{r['ms_per_query']:>10.4f}{r['bytes'] / 2**20:>10.1f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"n": len(x), "dim": int(x.shape[1]), "k": k, "rows": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Word-window chunk_text(900/200) vs token-aware chunk_tokens() on a corpus.
+
+    python -m bench.chunk_report                                  # example_input/
+    python -m bench.chunk_report --corpus my_book.txt --overlap 64
+
+Counts chunks (= embeddings to compute) and tokens: how many are tokenized, how
+many actually reach the encoder (it truncates at its max sequence length) and how
+many are wasted. Uses the encoder's tokenizer when `transformers` can load it,
+otherwise a regex word/punctuation approximation (reported in the output).
+"""
+import argparse, glob, json, os, re, sys
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from core.loaders import load_text_files  # noqa: E402
+from core.preprocess import chunk_text, chunk_tokens  # noqa: E402
+
+
+def load_counter(model: str):
+    try:
+        from transformers import AutoTokenizer
+        tok = AutoTokenizer.from_pretrained(model)
+        limit = min(int(tok.model_max_length), 512) - 2
+
+        def count(texts):
+            ids = tok(list(texts), add_special_tokens=False)["input_ids"]
+            return np.fromiter(map(len, ids), dtype=np.int64, count=len(ids))
+        return count, limit, f"tokenizer:{model}"
+    except Exception:
+        def count(texts):
+            return np.array([len(re.findall(r"\w+|[^\w\s]", t)) for t in texts], dtype=np.int64)
+        return count, 510, "approx(words+punctuation)"
+
+
+def stats(chunks, count, limit):
+    n = count([c["text"] for c in chunks]) if chunks else np.zeros(0, np.int64)
+    embedded = np.minimum(n, limit)
+    return {"chunks": len(chunks), "tokens_tokenized": int(n.sum()), "tokens_embedded": int(embedded.sum()),
+            "tokens_wasted": int((n - embedded).sum()), "truncated_chunks": int((n > limit).sum())}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", nargs="*", default=[os.path.join(ROOT, "example_input", "*.txt")])
+    ap.add_argument("--model", default="intfloat/multilingual-e5-base")
+    ap.add_argument("--overlap", type=int, default=32)
+    ap.add_argument("--out")
+    args = ap.parse_args(argv)
+
+    docs = load_text_files([p for pat in args.corpus for p in glob.glob(pat)])
+    count, limit, counter = load_counter(args.model)
+    words = [c for d in docs for c in chunk_text(d, chunk_size=900, overlap=200)]
+    tokens = [c for d in docs for c in chunk_tokens(d, count, max_tokens=limit, overlap_tokens=args.overlap)]
+    report = {"counter": counter, "max_tokens": limit, "docs": len(docs),
+              "word_900_200": stats(words, count, limit),
+              f"token_{limit}_{args.overlap}": stats(tokens, count, limit)}
+    a, b = report["word_900_200"], report[f"token_{limit}_{args.overlap}"]
+    report["saved"] = {"tokens_tokenized": a["tokens_tokenized"] - b["tokens_tokenized"],
+                       "tokens_wasted": a["tokens_wasted"] - b["tokens_wasted"]}
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Embedding throughput (chunks/sec) by worker count and batch token budget.
+
+    python -m bench.embed_report                                   # example_input/
+    python -m bench.embed_report --corpus my_book.txt --workers 1 2 4 --batch-tokens 8192 16384
+
+Chunks the corpus as indexing does, then embeds every chunk (bypassing the
+embedding cache) once per setting, after a warm-up pass that loads the model in
+every worker. Also reports the old single encode() call with the default batch
+size as the baseline, and the batch fill (share of each padded batch that is text).
+"""
+import argparse, glob, json, os, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from core import embedding  # noqa: E402
+from core.batch import iter_corpus_chunks  # noqa: E402
+from core.encoders import get_encoder  # noqa: E402
+
+
+def run(model: str, texts, n_workers: int, batch_tokens: int) -> dict:
+    embedding.embed(model, texts[:embedding.POOL_MIN_TEXTS * n_workers], batch_tokens, n_workers)  # warm-up
+    before = embedding.embedding_stats()
+    t0 = time.perf_counter()
+    embedding.embed(model, texts, batch_tokens, n_workers)
+    dt = time.perf_counter() - t0
+    after = embedding.embedding_stats()
+    batches = after["batches"] - before["batches"]
+    return {"workers": n_workers, "batch_tokens": batch_tokens, "seconds": round(dt, 3),
+            "chunks_per_sec": round(len(texts) / dt, 1), "batches": batches,
+            "threads_per_worker": embedding.threads_per_worker(n_workers),
+            "fill": round(sum(map(len, texts)) / max(after["padded_chars"] - before["padded_chars"], 1), 3)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", nargs="*", default=[os.path.join(ROOT, "example_input", "*.txt")])
+    ap.add_argument("--model", default="intfloat/multilingual-e5-base")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--batch-tokens", type=int, nargs="+", default=[embedding.BATCH_TOKENS])
+    ap.add_argument("--limit", type=int, default=0, help="embed at most this many chunks")
+    ap.add_argument("--out")
+    args = ap.parse_args(argv)
+
+    paths = [p for pat in args.corpus for p in glob.glob(pat)]
+    texts = [c["text"] for c in iter_corpus_chunks(paths, args.model)]
+    if args.limit:
+        texts = texts[:args.limit]
+    if not texts:
+        sys.exit("no chunks in corpus")
+
+    model = get_encoder(args.model)
+    t0 = time.perf_counter()
+    model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    base = time.perf_counter() - t0
+    report = {"model": args.model, "chunks": len(texts), "cpus": os.cpu_count(),
+              "baseline": {"seconds": round(base, 3), "chunks_per_sec": round(len(texts) / base, 1)}, "runs": []}
+    print(f"{len(texts)} chunks, {os.cpu_count()} CPUs; single encode(): {report['baseline']['chunks_per_sec']} chunks/s")
+    for w in args.workers:
+        for bt in args.batch_tokens:
+            r = run(args.model, texts, w, bt)
+            report["runs"].append(r)
+            print(f"workers={w} x {r['threads_per_worker']} threads, batch_tokens={bt}: "
+                  f"{r['chunks_per_sec']} chunks/s ({r['batches']} batches, fill {r['fill']:.0%})")
+    embedding.shutdown()
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Import-time budget check for the core modules.
+
+    python -m bench.import_budget                 # exits 1 if a budget is exceeded
+    python -m bench.import_budget --scale 2 --out import_times.json
+
+Each module is imported in a fresh interpreter (best of --runs); the check fails
+if it takes longer than its budget, pulls in a heavy dependency it should only
+load lazily, or creates directories at import time.
+"""
+import argparse, json, os, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("torch", "sentence_transformers", "transformers", "faiss", "numpy", "huggingface_hub", "requests")
+
+# module -> (budget in ms, heavy modules it may load)
+BUDGETS = {
+    "core.__main__": (30, ()),
+    "core.jsonrepair": (15, ()),
+    "core.jsonstream": (15, ()),
+    "core.metrics": (15, ()),
+    "core.prompts": (25, ()),
+    "core.llm": (25, ()),
+    "core.llmcache": (25, ()),
+    "core.generation": (400, ()),           # pydantic model construction dominates
+    "core.index": (400, ("numpy",)),
+    "core.retrieval": (400, ("numpy",)),
+}
+
+_PROBE = r"""
+import json, os, sys, time
+made = []
+_makedirs = os.makedirs
+os.makedirs = lambda p, *a, **k: (made.append(str(p)), _makedirs(p, *a, **k))[1]
+t0 = time.perf_counter()
+import importlib; importlib.import_module(sys.argv[1])
+ms = (time.perf_counter() - t0) * 1000
+print(json.dumps({"ms": ms, "loaded": [m for m in json.loads(sys.argv[2]) if m in sys.modules], "makedirs": made}))
+"""
+
+
+def probe(module: str) -> dict:
+    out = subprocess.run([sys.executable, "-c", _PROBE, module, json.dumps(HEAVY)], cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--scale", type=float, default=1.0, help="multiply every budget (slow machines)")
+    ap.add_argument("--out")
+    args = ap.parse_args(argv)
+
+    report, failed = {}, False
+    for module, (budget, allowed) in BUDGETS.items():
+        runs = [probe(module) for _ in range(max(args.runs, 1))]
+        best = min(runs, key=lambda r: r["ms"])
+        extra = sorted(set(best["loaded"]) - set(allowed))
+        limit = budget * args.scale
+        ok = best["ms"] <= limit and not extra and not best["makedirs"]
+        failed |= not ok
+        report[module] = {"ms": round(best["ms"], 1), "budget_ms": limit, "heavy": extra,
+                          "makedirs": best["makedirs"], "ok": ok}
+        print(f"{'ok  ' if ok else 'FAIL'} {module:<18} {best['ms']:7.1f} ms / {limit:.0f}"
+              + (f"  heavy: {', '.join(extra)}" if extra else "")
+              + (f"  makedirs: {', '.join(best['makedirs'])}" if best["makedirs"] else ""))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Throughput and failure handling of core.llm against the local stub server.
+
+    python -m bench.llm_report                                  # 32 requests, 0.2 s each
+    python -m bench.llm_report --n 64 --concurrency 1 4 16 --fail-rate 0.2 --server-max 8
+
+For each concurrency level, dispatches --n prompts with LLMClient.complete_many()
+and reports wall time, requests/second, retries and failures, next to the
+sequential baseline (one request at a time, as the old per-call hf_infer did).
+"""
+import argparse, json, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.llm import HTTPBackend, LLMClient  # noqa: E402
+from bench.llm_stub import serve  # noqa: E402
+
+
+def run(url: str, n: int, concurrency: int, rps: float, retries: int) -> dict:
+    client = LLMClient(HTTPBackend("stub", url, pool_size=concurrency), max_concurrency=concurrency,
+                       rate_per_sec=rps, max_retries=retries, backoff_base=0.05, backoff_max=1.0)
+    prompts = [f"Entity to analyze: entity-{i}" for i in range(n)]
+    t0 = time.perf_counter()
+    out = client.complete_many(prompts, return_exceptions=True)
+    dt = time.perf_counter() - t0
+    ok = sum(1 for r in out if isinstance(r, str))
+    return {"concurrency": concurrency, "seconds": round(dt, 3), "req_per_s": round(n / dt, 2),
+            "ok": ok, "errors": n - ok, **{k: client.stats[k] for k in ("requests", "retries", "failures")}}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--n", type=int, default=32)
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    ap.add_argument("--latency", type=float, default=0.2)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--server-max", type=int, default=0, help="stub answers 429 above this many in flight")
+    ap.add_argument("--rps", type=float, default=0.0, help="client-side rate limit (0 = none)")
+    ap.add_argument("--retries", type=int, default=4)
+    ap.add_argument("--out")
+    args = ap.parse_args(argv)
+
+    rows = []
+    for c in args.concurrency:
+        srv = serve(latency=args.latency, fail_rate=args.fail_rate, max_concurrent=args.server_max, seed=0)
+        try:
+            rows.append(dict(run(srv.url, args.n, c, args.rps, args.retries), server=dict(srv.stats)))
+        finally:
+            srv.shutdown()
+            srv.server_close()
+
+    print(f"{'conc':>5} {'seconds':>8} {'req/s':>7} {'ok':>4} {'err':>4} {'retries':>7}")
+    for r in rows:
+        print(f"{r['concurrency']:>5} {r['seconds']:>8.2f} {r['req_per_s']:>7.2f} {r['ok']:>4} {r['errors']:>4} {r['retries']:>7}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
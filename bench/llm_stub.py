@@ -0,0 +1,155 @@
+"""
+Local stand-in for an OpenAI-compatible chat endpoint, for testing core.llm offline.
+
+    python -m bench.llm_stub --port 8089 --latency 0.5 --fail-rate 0.1 --max-concurrent 8
+    PSYCHE_LLM_BACKEND=http PSYCHE_LLM_BASE_URL=http://127.0.0.1:8089 streamlit run app.py
+
+POST /v1/chat/completions answers with a canned profile (JSON, ---, Markdown) for the
+entity named in the prompt, after `latency` seconds (+/- `jitter`); with "stream": true
+the answer is sent as server-sent events, spread evenly over that latency. A `fail-rate`
+fraction of requests get a 503, and requests beyond `max-concurrent` in flight get a
+429, so retries and rate limiting can be exercised. GET /stats returns the counters.
+"""
+import argparse, json, random, re, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_ENTITY = re.compile(r"(?:Entidade a analisar|Entity to analyze):\s*(.+)")
+
+
+def canned(prompt: str) -> str:
+    m = _ENTITY.search(prompt)
+    name = m.group(1).strip() if m else "Unknown"
+    ids = re.findall(r"^\[([^\]]+)\]", prompt, re.MULTILINE)[:2]
+    profile = {
+        "character": name,
+        "big_five": {"O": 0.7, "C": 0.5, "E": 0.4, "A": 0.6, "N": 0.5},
+        "attachment_style": "secure",
+        "core_traits": ["curious", "reflective"],
+        "coping_strategies": ["problem-solving"],
+        "emotional_arc": "from naivety to understanding",
+        "clinical_patterns": [],
+        "supporting_quotes": [{"text": "...", "source": "corpus", "chunk_id": i} for i in ids],
+        "limitations": ["stub response"],
+        "confidence": 0.5,
+    }
+    return json.dumps(profile, ensure_ascii=False, indent=2) + f"\n---\n# {name}\n\nStub profile.\n"
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, latency=0.2, jitter=0.0, fail_rate=0.0, max_concurrent=0, seed=None):
+        super().__init__(addr, Handler)
+        self.latency, self.jitter, self.fail_rate, self.max_concurrent = latency, jitter, fail_rate, max_concurrent
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "ok": 0, "failed_503": 0, "throttled_429": 0, "peak_in_flight": 0}
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] += 1
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, so client connection pooling is visible
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, text: str, seconds: float) -> None:
+        pieces = re.findall(r"\s*\S+|\s+$", text)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for p in pieces:
+            time.sleep(seconds / max(len(pieces), 1))
+            chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": p}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.server.lock:
+                return self._send(200, dict(self.server.stats))
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        srv = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path != "/v1/chat/completions":
+            return self._send(404, {"error": "not found"})
+        srv.count("requests")
+        with srv.lock:
+            if srv.max_concurrent and srv.in_flight >= srv.max_concurrent:
+                srv.stats["throttled_429"] += 1
+                throttled = True
+            else:
+                srv.in_flight += 1
+                srv.stats["peak_in_flight"] = max(srv.stats["peak_in_flight"], srv.in_flight)
+                throttled = False
+            fail = srv.rng.random() < srv.fail_rate
+            delay = max(0.0, srv.latency + srv.rng.uniform(-srv.jitter, srv.jitter))
+        if throttled:
+            return self._send(429, {"error": "too many requests"})
+        try:
+            if fail or not body.get("stream"):
+                time.sleep(delay)
+            if fail:
+                srv.count("failed_503")
+                return self._send(503, {"error": "service unavailable"})
+            prompt = next((m["content"] for m in reversed(body.get("messages", [])) if m.get("role") == "user"), "")
+            srv.count("ok")
+            if body.get("stream"):
+                return self._stream(canned(prompt), delay)
+            self._send(200, {"object": "chat.completion", "model": body.get("model", "stub"),
+                             "choices": [{"index": 0, "finish_reason": "stop",
+                                          "message": {"role": "assistant", "content": canned(prompt)}}]})
+        finally:
+            with srv.lock:
+                srv.in_flight -= 1
+
+
+def serve(port: int = 0, host: str = "127.0.0.1", **opts) -> StubServer:
+    """Start a stub server on a background thread (port 0 = any free port)."""
+    srv = StubServer((host, port), **opts)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", type=float, default=0.2, help="seconds per completion")
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    ap.add_argument("--max-concurrent", type=int, default=0, help="429 above this many in flight (0 = unlimited)")
+    ap.add_argument("--seed", type=int)
+    args = ap.parse_args(argv)
+    srv = StubServer((args.host, args.port), latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate,
+                     max_concurrent=args.max_concurrent, seed=args.seed)
+    print(f"stub LLM at {srv.url}/v1/chat/completions", file=sys.stderr)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
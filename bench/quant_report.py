@@ -0,0 +1,108 @@
+"""
+Memory saved and recall@k of the compressed index kinds against the flat float32 index.
+
+    python -m bench.quant_report                                    # example corpus, e5-base
+    python -m bench.quant_report --model hashing-768                # offline (built-in hashing encoder)
+    python -m bench.quant_report --scale 40 --kinds flat sq8 fp16 ivfpq --out quant.json
+
+Indexes the example corpus (reshuffled copies of it with --scale, as in bench.suite)
+once per kind through core.index.build_faiss, in a temporary directory, then runs
+the same queries through core.index.search_rows_batch with re-scoring off (the codes'
+own scores) and at each --rescore factor. Queries are corpus chunks with a little
+noise added. Recall counts a hit as correct when its exact score is at least the
+flat index's k-th best, so duplicate chunks can't be held against a kind. "index MB" is
+what a search keeps in memory; "vectors MB" is the float32 file beside a compressed
+index, of which a search reads only its candidates' rows. IVF-PQ needs about 10k chunks
+to train (--scale 40).
+"""
+import argparse, glob, json, os, shutil, sys, tempfile, time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from core import embcache, embedding, index as _index  # noqa: E402
+from core.ann import COMPRESSED_KINDS, IVF_MIN_TRAIN  # noqa: E402
+from core.embcache import encode_cached  # noqa: E402
+from core.encoders import token_counter  # noqa: E402
+from core.index import build_faiss, close_index, open_index, search_rows_batch  # noqa: E402
+from core.loaders import load_text_files  # noqa: E402
+from core.preprocess import chunk_tokens  # noqa: E402
+from bench.suite import synthetic_corpus  # noqa: E402
+
+
+def _mb(path: str) -> float:
+    return round(os.path.getsize(path) / 2 ** 20, 3) if os.path.exists(path) else 0.0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", default="intfloat/multilingual-e5-base")
+    ap.add_argument("--scale", type=int, default=1, help="copies of the example corpus")
+    ap.add_argument("--chunk-tokens", type=int, default=64, help="smaller chunks -> more vectors")
+    ap.add_argument("--kinds", nargs="+", default=["flat", "sq8", "fp16", "ivfpq"])
+    ap.add_argument("--rescore", type=int, nargs="+", default=[2, 4, 8], help="over-fetch factors to try")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("-k", type=int, default=10)
+    ap.add_argument("--out")
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="psyche-quant-")
+    storage, cache_dir = _index.STORAGE, embcache.CACHE_DIR
+    _index.STORAGE, embcache.CACHE_DIR = os.path.join(tmp, "storage"), os.path.join(tmp, "embcache")
+    rows = []
+    try:
+        path = synthetic_corpus(args.scale, tmp)
+        count = token_counter(args.model)
+        chunks = [c for d in load_text_files([path]) for c in chunk_tokens(d, count, max_tokens=args.chunk_tokens)]
+        k = min(args.k, len(chunks))
+        vecs = encode_cached(args.model, [c["text"] for c in chunks])
+        rng = np.random.default_rng(1)
+        Q = vecs[rng.choice(len(vecs), min(args.queries, len(vecs)), replace=False)].copy()
+        Q += 0.05 * rng.standard_normal(Q.shape).astype(np.float32)
+        Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+
+        truth = None
+        for kind in ["flat"] + [kd for kd in args.kinds if kd != "flat"]:
+            if kind == "ivfpq" and len(chunks) < 256 * IVF_MIN_TRAIN:
+                print(f"skipping ivfpq: {len(chunks)} chunks, needs {256 * IVF_MIN_TRAIN} (raise --scale)")
+                continue
+            t0 = time.perf_counter()
+            build_faiss(chunks, kind, args.model, index_kind=kind)
+            build_s = round(time.perf_counter() - t0, 2)
+            index_mb, vectors_mb = _mb(_index._paths(kind)[0]), _mb(_index._vectors_path(kind))
+            h = open_index(kind)
+            for factor in ([0] + args.rescore if kind in COMPRESSED_KINDS else [0]):
+                t0 = time.perf_counter()
+                found = search_rows_batch(Q, kind, k, rescore=factor)
+                ms = 1000 * (time.perf_counter() - t0) / len(Q)
+                if truth is None:
+                    truth = [r[-1][1] for r in found]   # k-th best exact score per query
+                recall = np.mean([sum(1 for row, _ in r if float(vecs[row - 1] @ q) >= t - 1e-5) / k
+                                  for r, q, t in zip(found, Q, truth)])
+                rows.append({"kind": kind, "rescore": factor if kind in COMPRESSED_KINDS else "-",
+                             "recall@k": round(float(recall), 4), "ms_per_query": round(ms, 4),
+                             "index_mb": index_mb, "vectors_mb": vectors_mb, "build_s": build_s,
+                             "rescoring": h["vectors"] is not None and factor > 1})
+            close_index(kind)
+    finally:
+        close_index()
+        embedding.shutdown()
+        _index.STORAGE, embcache.CACHE_DIR = storage, cache_dir
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    flat_mb = next(r["index_mb"] for r in rows if r["kind"] == "flat")
+    print(f"n={len(chunks)} dim={vecs.shape[1]} queries={len(Q)} k={k} model={args.model}")
+    print(f"{'kind':<7}{'rescore':>8}{'recall@k':>10}{'ms/query':>10}{'index MB':>10}{'saved':>8}{'vectors MB':>12}")
+    for r in rows:
+        saved = 1 - r["index_mb"] / flat_mb if flat_mb else 0.0
+        r["saved"] = round(saved, 4)
+        print(f"{r['kind']:<7}{r['rescore']!s:>8}{r['recall@k']:>10.4f}{r['ms_per_query']:>10.4f}"
+              f"{r['index_mb']:>10.3f}{saved:>8.0%}{r['vectors_mb']:>12.3f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"n": len(chunks), "dim": int(vecs.shape[1]), "k": k, "model": args.model, "rows": rows},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
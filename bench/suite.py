@@ -0,0 +1,272 @@
+"""
+Reproducible benchmarks for the ingest, indexing, retrieval and parsing hot paths.
+
+    python -m bench.suite                                # bundled book at 1x, 10x, 100x
+    python -m bench.suite --scales 1 10 100 1000 --repeat 5
+    python -m bench.suite --save-baseline                # record bench/baseline.json
+    python -m bench.suite --out results.json             # compare with it; exit 1 on regression
+    python -m bench.suite --model hashing-768            # another encoder (compared only with its own baseline)
+
+Runs offline and leaves nothing behind. Embeddings come from the built-in hashing
+encoder (core.encoders.HashingEncoder, hashing-256 unless --model), and index and
+embedding-cache files go to a temporary directory. The synthetic corpora are the
+bundled book's paragraphs, reshuffled per copy with a fixed seed, so every scale has
+the same text distribution and every run sees the same bytes. The parsing cases replay
+the recorded LLM answers in bench/fixtures/llm_outputs/. Untimed, it also streams the
+book with repeated chunk ids into new and existing indices and checks that BM25 and
+the vector index hold exactly the live chunks (exit 1 otherwise).
+
+Each case reports the median and minimum of --repeat runs. Baselines are compared
+on the minimum, which is the least sensitive to other load on the machine: a case
+regresses when its best run is more than its threshold slower than the baseline's
+(and by at least --min-ms). Baseline times are first scaled by how fast a fixed
+calibration loop ran in both runs, so a throttled or busier machine doesn't show as
+a regression across the board. Noisier cases (cold reads, disk I/O) get wider thresholds.
+"""
+import argparse, gc, glob, hashlib, json, os, platform, random, shutil, statistics, subprocess, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from core import bm25, embcache, embedding, index as _index  # noqa: E402
+from core.encoders import max_tokens, token_counter  # noqa: E402
+from core.generation import extract_json_then_md  # noqa: E402
+from core.index import add_stream, build_faiss, close_index, open_index, search  # noqa: E402
+from core.loaders import load_text_files  # noqa: E402
+from core.mentions import filter_chunks  # noqa: E402
+from core.preprocess import character_filter, chunk_text, chunk_tokens  # noqa: E402
+from core.prompts import build_prompt  # noqa: E402
+from core.retrieval import character_query, hybrid_search  # noqa: E402
+
+BOOK = glob.glob(os.path.join(ROOT, "example_input", "*.txt"))[0]
+FIXTURES = os.path.join(ROOT, "bench", "fixtures", "llm_outputs")
+BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+ENCODER = "hashing-256"
+
+# Allowed slowdown of the best run vs. the baseline, by case name (before "@" / "[")
+THRESHOLD = 0.25
+THRESHOLDS = {"load_text_files": 0.5, "search_cold": 0.5, "build_faiss": 0.4}
+
+
+def synthetic_corpus(scale: int, out_dir: str) -> str:
+    """The book itself at 1x; otherwise `scale` copies of its paragraphs, each copy shuffled (seeded)."""
+    if scale <= 1:
+        return BOOK
+    with open(BOOK, "r", encoding="utf-8") as f:
+        paragraphs = [p for p in f.read().split("\n\n") if p.strip()]
+    rng = random.Random(scale)
+    path = os.path.join(out_dir, f"book_{scale}x.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(scale):
+            copy = paragraphs[:]
+            rng.shuffle(copy)
+            f.write("\n\n".join(copy) + "\n\n")
+    return path
+
+
+def measure(fn, repeat: int, setup=None, inner: int = 1, warmup: bool = True) -> tuple:
+    """(last result, timing) over `repeat` runs of `inner` calls; `setup` runs untimed before each."""
+    if warmup:
+        if setup:
+            setup()
+        fn()
+    times, out = [], None
+    for _ in range(max(repeat, 1)):
+        if setup:
+            setup()
+        gc.collect()
+        t0 = time.perf_counter()
+        for _ in range(inner):
+            out = fn()
+        times.append((time.perf_counter() - t0) / inner * 1000)
+    return out, {"median_ms": round(statistics.median(times), 4), "min_ms": round(min(times), 4), "runs": len(times)}
+
+
+def calibrate(repeat: int = 5) -> float:
+    """Best time (ms) of a fixed pure-Python + numpy workload: the machine's speed right now."""
+    import numpy as np
+    a = np.random.default_rng(0).random((256, 256), dtype=np.float32)
+
+    def work():
+        words = {}
+        for i in range(60000):
+            w = str(i % 997)
+            words[w] = words.get(w, 0) + 1
+        return float((a @ a).sum()) + len(words)
+    return measure(work, repeat)[1]["min_ms"]
+
+
+def run_scale(scale: int, args, tmp: str, results: dict) -> None:
+    path = synthetic_corpus(scale, tmp)
+    tag = f"@{scale}x"
+    docs, results["load_text_files" + tag] = measure(lambda: load_text_files([path]), args.repeat)
+    words, results["chunk_text" + tag] = measure(lambda: [c for d in docs for c in chunk_text(d)], args.repeat)
+    count, limit = token_counter(args.model), max_tokens(args.model)
+    chunks, results["chunk_tokens" + tag] = measure(
+        lambda: [c for d in docs for c in chunk_tokens(d, count, max_tokens=limit)], args.repeat)
+    _, results["character_filter" + tag] = measure(lambda: character_filter(words, args.entity), args.repeat)
+    _, results["filter_chunks" + tag] = measure(lambda: list(filter_chunks(chunks, args.entity)), args.repeat)
+
+    name = f"bench{scale}"
+    n_cache = iter(range(10 ** 6))
+
+    def fresh_cache():
+        # Every build starts from an empty embedding cache, so encoding is included
+        embcache.CACHE_DIR = os.path.join(tmp, f"embcache{next(n_cache)}")
+    _, results["build_faiss" + tag] = measure(lambda: build_faiss(chunks, name, args.model), args.repeat,
+                                              setup=fresh_cache, warmup=False)
+    results["build_faiss" + tag]["chunks"] = len(chunks)
+
+    query = character_query(args.entity)
+
+    def cold():
+        close_index(name)
+        bm25.close(name)
+    _, results["search_cold" + tag] = measure(lambda: search(query, name, args.model, top_k=args.k), args.repeat,
+                                              setup=cold, warmup=False)
+    hits, results["search_warm" + tag] = measure(lambda: search(query, name, args.model, top_k=args.k),
+                                                 args.repeat, inner=20)
+    _, results["hybrid_warm" + tag] = measure(lambda: hybrid_search(query, name, args.model, top_k=args.k),
+                                              args.repeat, inner=20)
+    _, results["build_prompt" + tag] = measure(
+        lambda: build_prompt(args.entity, hits, hits[:4], budget_tokens=3000), args.repeat, inner=5)
+
+
+def run_parsing(args, results: dict) -> None:
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        case = f"extract_json_then_md[{os.path.splitext(os.path.basename(path))[0]}]"
+        out, results[case] = measure(lambda: extract_json_then_md(text), args.repeat, inner=200)
+        results[case]["fields"] = len(out["json"])
+
+
+def check_consistency(args) -> list:
+    """
+    Problems (untimed) in indices built from a stream that repeats chunk ids, as when
+    the same file is uploaded twice: the BM25 postings must cover exactly the live rows.
+    """
+    import numpy as np
+    count, limit = token_counter(args.model), max_tokens(args.model)
+    chunks = [c for d in load_text_files([BOOK]) for c in chunk_tokens(d, count, max_tokens=limit)]
+    problems = []
+    for name, streams in (("dup_new", [chunks + chunks]), ("dup_upsert", [chunks, chunks[:50] + chunks])):
+        for docs in streams:
+            add_stream(iter(docs), name, args.model, batch_size=64)
+        h = open_index(name)
+        live = {r for (r,) in h["db"].execute("SELECT row FROM chunks")}
+        bm25.close(name)
+        with np.load(bm25.bm25_path(name)) as data:
+            docs_rows = data["rows"].tolist()
+        if len(docs_rows) != len(live) or set(docs_rows) != live:
+            problems.append(f"{name}: BM25 holds {len(docs_rows)} docs for {len(live)} live chunks")
+        if h["index"].ntotal != len(live):
+            problems.append(f"{name}: vector index holds {h['index'].ntotal} vectors for {len(live)} live chunks")
+        close_index(name)
+    return problems
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_ms: float, calibration: float) -> tuple:
+    comparison, regressions = {}, []
+    # > 1 when this machine/run is slower than the baseline's
+    speed = calibration / baseline["meta"]["calibration_ms"] if baseline.get("meta", {}).get("calibration_ms") else 1.0
+    for case, r in results.items():
+        b = baseline.get("cases", {}).get(case)
+        if not b:
+            continue
+        allowed = THRESHOLDS.get(case.split("@")[0].split("[")[0], threshold)
+        expected = b["min_ms"] * speed
+        ratio = r["min_ms"] / expected if expected else 1.0
+        regressed = ratio > 1 + allowed and r["min_ms"] - expected > min_ms
+        comparison[case] = {"baseline_ms": round(expected, 4), "min_ms": r["min_ms"], "ratio": round(ratio, 3),
+                            "threshold": allowed, "regressed": regressed}
+        if regressed:
+            regressions.append(case)
+    return comparison, regressions
+
+
+def _meta(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    with open(BOOK, "rb") as f:
+        book = hashlib.sha256(f.read()).hexdigest()[:16]
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "commit": commit, "encoder": args.model, "book_sha256": book, "scales": args.scales,
+            "repeat": args.repeat, "entity": args.entity, "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--entity", default="raposa")
+    ap.add_argument("-k", type=int, default=10)
+    ap.add_argument("--model", default=ENCODER, help="embedding model (the baseline was recorded with %(default)s)")
+    ap.add_argument("--only", nargs="*", default=[], help="report/compare only cases whose name starts with one of these")
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    ap.add_argument("--threshold", type=float, default=THRESHOLD, help="default allowed slowdown (0.25 = +25%%)")
+    ap.add_argument("--min-ms", type=float, default=0.05, help="ignore slowdowns smaller than this")
+    ap.add_argument("--out")
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="psyche-bench-")
+    storage, cache_dir, workers = _index.STORAGE, embcache.CACHE_DIR, embedding.WORKERS
+    _index.STORAGE, embcache.CACHE_DIR = os.path.join(tmp, "storage"), os.path.join(tmp, "embcache")
+    embedding.WORKERS = 1
+    results: dict = {}
+    calibration = calibrate()
+    try:
+        for scale in args.scales:
+            run_scale(scale, args, tmp, results)
+            close_index()
+        run_parsing(args, results)
+        problems = check_consistency(args)
+    finally:
+        close_index()
+        _index.STORAGE, embcache.CACHE_DIR, embedding.WORKERS = storage, cache_dir, workers
+        shutil.rmtree(tmp, ignore_errors=True)
+    calibration = (calibration + calibrate()) / 2   # before and after: drift during the run
+    if args.only:
+        results = {k: v for k, v in results.items() if k.startswith(tuple(args.only))}
+
+    report = {"meta": dict(_meta(args), calibration_ms=round(calibration, 3)), "cases": results}
+    baseline, other_encoder = {}, False
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("encoder", ENCODER) != args.model:
+            print(f"{os.path.relpath(args.baseline, ROOT)} was recorded with {baseline['meta']['encoder']}, "
+                  f"not {args.model}: not comparing")
+            baseline, other_encoder = {}, True
+    report["comparison"], report["regressions"] = compare(results, baseline, args.threshold, args.min_ms,
+                                                             calibration)
+    report["problems"] = problems
+
+    for case, r in results.items():
+        c = report["comparison"].get(case)
+        vs = f"  x{c['ratio']:.2f} vs baseline" + ("  REGRESSION" if c["regressed"] else "") if c else ""
+        print(f"{case:<48} {r['median_ms']:>11.3f} ms (min {r['min_ms']:.3f}){vs}")
+    if baseline:
+        print(f"{len(report['regressions'])} regression(s) vs {os.path.relpath(args.baseline, ROOT)} "
+              f"({baseline.get('meta', {}).get('commit', '?')}; calibration {calibration:.1f} ms vs "
+              f"{baseline.get('meta', {}).get('calibration_ms', float('nan')):.1f} ms)")
+    elif not args.save_baseline and not other_encoder:
+        print(f"no baseline at {args.baseline}; record one with --save-baseline")
+    for p in problems:
+        print(f"INCONSISTENT {p}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"meta": report["meta"], "cases": results}, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report["regressions"] or problems else 0)
+
+
+if __name__ == "__main__":
+    main()
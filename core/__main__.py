@@ -0,0 +1,194 @@
+"""
+Headless entry point for the profiling pipeline.
+
+    python -m core ingest book.txt --entity Raposa --out chunks.jsonl
+    python -m core index book.txt --entity Raposa Rosa            # or: index chunks.jsonl
+    python -m core query "a raposa e o principezinho" --hybrid -k 5
+    python -m core profile Raposa Rosa --out profiles/ --hf-model meta-llama/Meta-Llama-3-8B-Instruct
+    python -m core profile Raposa --map-reduce --partition-by time          # all evidence, merged
+    python -m core batch --corpus book.txt --entities Raposa Rosa --out profiles/
+    python -m core parse answer.txt --character Raposa
+
+Each command imports only what it needs, so lightweight ones (parse, --help) start
+without loading numpy, faiss or the embedding model.
+"""
+import argparse, json, os, sys
+
+EMB_MODEL = "intfloat/multilingual-e5-base"
+
+
+def _read_chunks(paths, emb_model):
+    # .jsonl files hold chunks written by `ingest`; anything else is chunked as text
+    text = [p for p in paths if not p.endswith(".jsonl")]
+    for p in paths:
+        if p.endswith(".jsonl"):
+            with open(p, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+    if text:
+        from .batch import iter_corpus_chunks
+        yield from iter_corpus_chunks(text, emb_model)
+
+
+def cmd_ingest(args):
+    chunks = _read_chunks(args.paths, args.emb_model)
+    if args.entity:
+        from .mentions import filter_entities
+        chunks = filter_entities(chunks, args.entity)
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        n = 0
+        for c in chunks:
+            out.write(json.dumps(c, ensure_ascii=False) + "\n")
+            n += 1
+    finally:
+        if args.out:
+            out.close()
+    print(f"{n} chunks", file=sys.stderr)
+
+
+def cmd_index(args):
+    from . import embedding
+    from .index import build_faiss
+    if args.emb_workers is not None:
+        embedding.WORKERS = args.emb_workers
+    chunks = _read_chunks(args.paths, args.emb_model)
+    if args.entity:
+        from .mentions import filter_entities, save_mentions
+        mentions = {}
+        chunks = filter_entities(chunks, args.entity, mentions)
+    n = {"chunks": 0}
+    build_faiss(chunks, args.name, args.emb_model, index_kind=args.kind,
+                progress=lambda done: n.update(chunks=done))
+    if args.entity:
+        save_mentions(args.name, mentions)
+    s = embedding.embedding_stats()
+    print(f"{args.name}: {n['chunks']} chunks indexed; embedded {s['texts']} at {s['chunks_per_sec']} chunks/s "
+          f"({s['workers']} worker(s), batch fill {s['fill']:.0%})", file=sys.stderr)
+
+
+def cmd_query(args):
+    if args.hybrid:
+        from .retrieval import hybrid_search
+        hits = hybrid_search(args.text, args.index, args.emb_model, top_k=args.k)
+    else:
+        from .index import search
+        hits = search(args.text, args.index, args.emb_model, top_k=args.k)
+    json.dump(hits, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+def cmd_profile(args):
+    from .batch import profile_batch, write_profiles
+    from .mentions import load_mentions
+    from .theory import ensure_theory_index
+    ensure_theory_index(args.emb_model)
+    profiles = profile_batch(args.entities, args.emb_model, hf_model=args.hf_model, language=args.language,
+                             k_char=args.k_char, k_psych=args.k_psych, user_context=args.context,
+                             workers=args.workers, index_name=args.index, mentions=load_mentions(args.index),
+                             use_cache=not args.no_cache, budget_tokens=args.budget, map_reduce=args.map_reduce,
+                             partition_by=args.partition_by, partition_tokens=args.partition_tokens)
+    write_profiles(profiles, args.out)
+    for e, p in profiles.items():
+        print(f"{e}: {p['mode']}" + (f" ({p['error']})" if p.get("error") else "")
+              + (f" ({len(p['partitions'])} partitions, {len(p['failed'])} failed)" if "partitions" in p else ""),
+              file=sys.stderr)
+
+
+def cmd_batch(args):
+    from .batch import main
+    main(args.args)
+
+
+def cmd_parse(args):
+    from .generation import extract_json_then_md, validate_profile
+    with open(args.path, "r", encoding="utf-8") if args.path != "-" else sys.stdin as f:
+        parsed = extract_json_then_md(f.read())
+    if not parsed["json"]:
+        print("no JSON object found", file=sys.stderr)
+        sys.exit(1)
+    profile, bad = validate_profile(parsed["json"], args.character)
+    json.dump({"json": profile, "markdown": parsed["markdown"], "invalid": bad}, sys.stdout,
+              ensure_ascii=False, indent=2)
+    print()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m core", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--timings", action="store_true", help="print a per-stage time breakdown to stderr")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest", help="chunk .txt/.md files into JSONL (optionally only chunks mentioning entities)")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--entity", nargs="*", default=[])
+    p.add_argument("--emb-model", default=EMB_MODEL)
+    p.add_argument("--out", help="output .jsonl (default: stdout)")
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser("index", help="build a named index from .txt/.md files or ingested .jsonl chunks")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--name", default="character")
+    p.add_argument("--entity", nargs="*", default=[], help="keep only chunks mentioning these (saves mentions)")
+    p.add_argument("--emb-model", default=EMB_MODEL)
+    p.add_argument("--kind", choices=["auto", "flat", "hnsw", "ivf", "ivfpq", "sq8", "fp16"])
+    p.add_argument("--emb-workers", type=int, help="embedding processes (default: PSYCHE_EMB_WORKERS; 0 = auto)")
+    p.set_defaults(func=cmd_index)
+
+    p = sub.add_parser("query", help="search an index; prints hits as JSON")
+    p.add_argument("text")
+    p.add_argument("--index", default="character")
+    p.add_argument("-k", type=int, default=5)
+    p.add_argument("--hybrid", action="store_true", help="BM25 + dense (RRF)")
+    p.add_argument("--emb-model", default=EMB_MODEL)
+    p.set_defaults(func=cmd_query)
+
+    p = sub.add_parser("profile", help="profile entities from an existing index; writes JSON + Markdown")
+    p.add_argument("entities", nargs="+")
+    p.add_argument("--index", default="character")
+    p.add_argument("--out", default="profiles")
+    p.add_argument("--language", default="pt", choices=["pt", "en"])
+    p.add_argument("--hf-model", help="HF model for generation (needs HF_API_TOKEN); template mode if omitted")
+    p.add_argument("--emb-model", default=EMB_MODEL)
+    p.add_argument("--context", default="", help="additional instructions for the analysis")
+    p.add_argument("--k-char", type=int, default=8)
+    p.add_argument("--k-psych", type=int, default=6)
+    p.add_argument("--budget", type=int, default=3000, help="prompt context tokens (0 = no packing)")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--no-cache", action="store_true")
+    p.add_argument("--map-reduce", action="store_true",
+                   help="profile from all evidence: one LLM call per partition, then merged (core.mapreduce)")
+    p.add_argument("--partition-by", default="section", choices=["section", "time"],
+                   help="section: partitions stay within one source file; time: windows over the whole corpus")
+    p.add_argument("--partition-tokens", type=int, help="evidence tokens per partition (default: from --budget)")
+    p.set_defaults(func=cmd_profile)
+
+    p = sub.add_parser("batch", add_help=False, help="corpus -> index -> profiles in one go (see core.batch)")
+    p.add_argument("args", nargs=argparse.REMAINDER)
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser("parse", help="parse and validate a saved LLM answer (no model needed)")
+    p.add_argument("path", help="answer text file, or - for stdin")
+    p.add_argument("--character", default="")
+    p.set_defaults(func=cmd_parse)
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ["batch"]:
+        # Passed through untouched, so `batch --help` shows core.batch's own options
+        return cmd_batch(argparse.Namespace(args=argv[1:]))
+    args = ap.parse_args(argv)
+    if not args.timings:
+        return args.func(args)
+    from .metrics import trace
+    with trace(args.command) as t:
+        args.func(args)
+    print(f"{args.command}: {t.seconds * 1000:.0f} ms, peak RSS {t.rss_max / 2 ** 20:.0f} MB", file=sys.stderr)
+    for r in t.breakdown():
+        print(f"  {r['span']:<32} {r['calls']:>5} x {r['ms']:>10.1f} ms  {r['share']:>6.1%}", file=sys.stderr)
+    if t.counters:
+        print("  " + json.dumps(t.counters), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
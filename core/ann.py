@@ -0,0 +1,131 @@
+import logging, math, os
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Vector index backends. Every index is wrapped in IndexIDMap2 by core.index, so
+# the choice here only affects how the vectors are stored and searched. faiss is
+# imported inside the functions that need it.
+INDEX_KINDS = ("flat", "hnsw", "ivf", "ivfpq", "sq8", "fp16")
+# Kinds that keep lossy codes instead of the float32 vectors (1/4, 1/2 and ~1/32 of
+# the size): core.index keeps the exact vectors on disk beside them and re-scores
+# the over-fetched candidates with those
+COMPRESSED_KINDS = ("sq8", "fp16", "ivfpq")
+DEFAULT_KIND = os.getenv("PSYCHE_INDEX_KIND", "auto")
+# Memory budget for the vectors of one index; beyond it vectors get compressed (PQ)
+MEM_BUDGET_MB = float(os.getenv("PSYCHE_INDEX_MEM_MB", "1024"))
+
+FLAT_MAX = 20_000        # exact search is fast enough below this many vectors
+HNSW_MAX = 200_000       # graph index above that, until IVF's cheaper build wins
+HNSW_M = 32
+IVF_MIN_TRAIN = 39       # faiss wants >= 39 training points per centroid
+PQ_NBITS, PQ_MIN_NBITS = 8, 4   # bits per PQ code; fewer training vectors -> fewer bits, down to 4
+
+
+def choose_kind(n: int, dim: int, mem_budget_mb: float = None) -> str:
+    """Pick a backend from the vector count and the memory budget."""
+    budget = (mem_budget_mb or MEM_BUDGET_MB) * 2**20
+    raw = n * dim * 4
+    if n <= FLAT_MAX:
+        return "flat"
+    if raw > budget:
+        # Too few vectors to train PQ: 8-bit scalar codes still take a quarter of the space
+        return "ivfpq" if n >= 256 * IVF_MIN_TRAIN else "sq8"
+    if n <= HNSW_MAX and raw + n * HNSW_M * 8 <= budget:
+        return "hnsw"
+    return "ivf"
+
+
+def _nlist(n: int, n_train: int = None) -> int:
+    # ~4 sqrt(n) lists, but no more than the training sample can fill with IVF_MIN_TRAIN points each
+    return max(1, min(int(4 * math.sqrt(n)), min(n, n_train or n) // IVF_MIN_TRAIN or 1))
+
+
+def _pq_nbits(n_train: int) -> int:
+    # Each sub-quantizer trains 2**nbits centroids, IVF_MIN_TRAIN points apiece
+    return min(PQ_NBITS, int(math.log2(max(n_train // IVF_MIN_TRAIN, 1))))
+
+
+def _pq_m(dim: int) -> int:
+    # Largest number of sub-quantizers <= dim/8 that divides dim (8-dim sub-vectors for e5-base)
+    for m in range(max(dim // 8, 1), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def make_index(kind: str, dim: int, n: int, n_train: int = None):
+    """An empty, untrained inner index of the given kind (inner-product metric), trained later on `n_train` vectors."""
+    import faiss
+    ip = faiss.METRIC_INNER_PRODUCT
+    if kind == "flat":
+        return faiss.IndexFlatIP(dim)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, ip)
+        index.hnsw.efConstruction = 80
+        return index
+    if kind == "ivf":
+        return faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, _nlist(n, n_train), ip)
+    if kind == "ivfpq":
+        nbits = _pq_nbits(n_train or n)
+        if nbits < PQ_MIN_NBITS:
+            raise ValueError(f"ivfpq needs at least {IVF_MIN_TRAIN << PQ_MIN_NBITS} training vectors, got {n_train or n}")
+        return faiss.IndexIVFPQ(faiss.IndexFlatIP(dim), dim, _nlist(n, n_train), _pq_m(dim), nbits, ip)
+    if kind == "sq8":
+        # Per-dimension min/max, trained on the sample; values outside it are clipped
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, ip)
+    if kind == "fp16":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, ip)
+    raise ValueError(f"Unknown index kind: {kind} (expected one of {INDEX_KINDS} or 'auto')")
+
+
+def build_index(vectors: np.ndarray, kind: str = None, mem_budget_mb: float = None, n: int = None):
+    """
+    Create (and train, for IVF/PQ/SQ kinds) an empty ID-mapped index for `n` vectors
+    (default: len(vectors)); `vectors` is the training sample.
+    """
+    import faiss
+    n = len(vectors) if n is None else n
+    dim = vectors.shape[1]
+    kind = kind or DEFAULT_KIND
+    if kind == "auto":
+        kind = choose_kind(n, dim, mem_budget_mb)
+    if kind == "ivfpq" and _pq_nbits(len(vectors)) < PQ_MIN_NBITS:
+        # Too few vectors to train PQ codebooks: 8-bit scalar codes need no minimum
+        log.warning("ivfpq needs >= %d training vectors, got %d; building sq8 instead",
+                    IVF_MIN_TRAIN << PQ_MIN_NBITS, len(vectors))
+        kind = "sq8"
+    inner = make_index(kind, dim, n, len(vectors))
+    if not inner.is_trained:
+        inner.train(vectors)
+    # Saved search-time defaults; override per call via search_params()
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = min(inner.nlist, 16)
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = 64
+    return faiss.IndexIDMap2(inner)
+
+
+def index_kind(index) -> str:
+    import faiss
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return "fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"
+
+
+def search_params(index, nprobe: int = None, ef_search: int = None):
+    """Per-call search parameters (the shared cached index is never mutated)."""
+    import faiss
+    kind = index_kind(index)
+    if kind in ("ivf", "ivfpq") and nprobe:
+        return faiss.SearchParametersIVF(nprobe=int(nprobe))
+    if kind == "hnsw" and ef_search:
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    return None
@@ -0,0 +1,172 @@
+"""
+Profile many entities against one shared corpus index.
+
+All character queries are encoded in a single encode() batch and answered by one
+multi-query index search; theory evidence is retrieved once and shared, and the
+per-entity generation calls run concurrently.
+
+    python -m core.batch --corpus book.txt --entities "Principezinho" "Raposa" "Rosa" --out profiles/
+"""
+import argparse, json, os, re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+from . import embedding as _embedding
+from .embedding import embedding_stats
+from .encoders import max_tokens, token_counter
+from .index import build_faiss, encode_queries, hits_for_rows, search, search_rows_batch, search_vector
+from .loaders import iter_text
+from .mentions import filter_entities, save_mentions
+from .preprocess import iter_sentences, iter_token_chunks
+from .retrieval import character_query
+from .theory import THEORY_INDEX, THEORY_QUERIES, ensure_theory_index, theory_query_vector
+from .prompts import build_prompt
+from .generation import generate_profile
+
+EMB_MODEL = "intfloat/multilingual-e5-base"
+
+
+def theory_hits(emb_model: str, k_psych: int = 6, nprobe: int = None, ef_search: int = None) -> list:
+    """Theory passages for the default theory query (shared by every entity and partition)."""
+    q = theory_query_vector(THEORY_QUERIES["default"])
+    if q is not None:
+        return search_vector(q, THEORY_INDEX, top_k=k_psych, nprobe=nprobe, ef_search=ef_search)
+    return search(THEORY_QUERIES["default"], THEORY_INDEX, emb_model, top_k=k_psych, nprobe=nprobe,
+                  ef_search=ef_search)
+
+
+def retrieve_many(entities: List[str], emb_model: str, k_char: int = 8, k_psych: int = 6,
+                  index_name: str = "character", mentions: Dict = None,
+                  nprobe: int = None, ef_search: int = None) -> Dict[str, Tuple[list, list]]:
+    """
+    entity -> (char_hits, psych_hits). With a mention index (entity -> chunk id -> spans),
+    each entity's evidence is restricted to chunks that actually mention it.
+    """
+    knobs = {"nprobe": nprobe, "ef_search": ef_search}
+    Q = encode_queries([character_query(e) for e in entities], emb_model)
+    depth = k_char * 4 if mentions else k_char
+    ranked = search_rows_batch(Q, index_name, depth, **knobs)
+
+    psych_hits = theory_hits(emb_model, k_psych, **knobs)
+
+    out = {}
+    for e, rows in zip(entities, ranked):
+        hits = hits_for_rows(index_name, rows)
+        allowed = (mentions or {}).get(e)
+        if allowed:
+            hits = [h for h in hits if h["id"] in allowed] or hits
+        out[e] = (hits[:k_char], psych_hits)
+    return out
+
+
+def profile_batch(entities: List[str], emb_model: str = EMB_MODEL, hf_model: str = None, language: str = "pt",
+                  k_char: int = 8, k_psych: int = 6, user_context: str = "", workers: int = 4,
+                  index_name: str = "character", mentions: Dict = None, use_cache: bool = True,
+                  budget_tokens: int = 3000, map_reduce: bool = False, partition_by: str = "section",
+                  partition_tokens: int = None) -> Dict[str, Dict]:
+    """
+    entity -> {"json", "markdown", "mode", "prompt", "packing"}; generation runs on `workers`
+    threads. Prompt context is packed into `budget_tokens` (None/0 = old per-chunk cut).
+    With `map_reduce`, each entity is profiled from all of its evidence instead of the top
+    k_char hits (core.mapreduce; no "prompt"/"packing", but "partitions" and "failed").
+    """
+    if map_reduce:
+        from .mapreduce import map_reduce_profile
+        psych_hits = theory_hits(emb_model, k_psych)
+        return {e: map_reduce_profile(e, index_name, psych_hits, model=hf_model, language=language,
+                                      user_context=user_context, budget_tokens=budget_tokens or 3000,
+                                      partition_by=partition_by, partition_tokens=partition_tokens,
+                                      mentions=mentions, workers=workers, use_cache=use_cache)
+                for e in entities}
+
+    retrieved = retrieve_many(entities, emb_model, k_char, k_psych, index_name=index_name, mentions=mentions)
+
+    def one(e):
+        char_hits, psych_hits = retrieved[e]
+        packing = {}
+        prompt = build_prompt(e, char_hits, psych_hits, language=language, user_context=user_context,
+                              budget_tokens=budget_tokens, model=hf_model, report=packing)
+        out = generate_profile(prompt, e, char_hits, psych_hits, model=hf_model, language=language,
+                               use_cache=use_cache)
+        return dict(out, prompt=prompt, packing=packing)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        futures = {e: ex.submit(one, e) for e in entities}
+        return {e: f.result() for e, f in futures.items()}
+
+
+def iter_corpus_chunks(paths: List[str], emb_model: str = EMB_MODEL) -> Iterator[Dict]:
+    """Token chunks (sized for `emb_model`) of the given .txt/.md files, streamed."""
+    count, limit = token_counter(emb_model), max_tokens(emb_model)
+    for p in paths:
+        yield from iter_token_chunks(os.path.basename(p), iter_sentences(iter_text(p)), count, max_tokens=limit)
+
+
+def index_corpus(paths: List[str], entities: List[str], emb_model: str = EMB_MODEL,
+                 index_name: str = "character") -> Dict:
+    """Stream the corpus into one shared index of the chunks mentioning any entity; returns the mention index."""
+    mentions: Dict = {}
+    build_faiss(filter_entities(iter_corpus_chunks(paths, emb_model), entities, mentions), index_name, emb_model)
+    if not mentions:
+        build_faiss(iter_corpus_chunks(paths, emb_model), index_name, emb_model)
+    save_mentions(index_name, mentions)
+    return mentions
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", name).strip("_") or "entity"
+
+
+def write_profiles(profiles: Dict[str, Dict], out_dir: str) -> None:
+    os.makedirs(out_dir, exist_ok=True)
+    for e, p in profiles.items():
+        with open(os.path.join(out_dir, f"{_slug(e)}.json"), "w", encoding="utf-8") as f:
+            json.dump(p["json"], f, ensure_ascii=False, indent=2)
+        with open(os.path.join(out_dir, f"{_slug(e)}.md"), "w", encoding="utf-8") as f:
+            f.write(p["markdown"])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus", nargs="+", required=True, help=".txt/.md files")
+    ap.add_argument("--entities", nargs="*", default=[])
+    ap.add_argument("--entities-file", help="one entity per line")
+    ap.add_argument("--out", default="profiles")
+    ap.add_argument("--language", default="pt", choices=["pt", "en"])
+    ap.add_argument("--hf-model", help="HF model for generation (needs HF_API_TOKEN); template mode if omitted")
+    ap.add_argument("--emb-model", default=EMB_MODEL)
+    ap.add_argument("--k-char", type=int, default=8)
+    ap.add_argument("--k-psych", type=int, default=6)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--emb-workers", type=int, help="embedding processes (default: PSYCHE_EMB_WORKERS; 0 = auto)")
+    ap.add_argument("--budget", type=int, default=3000, help="prompt context tokens (0 = no packing)")
+    ap.add_argument("--no-cache", action="store_true", help="ignore cached LLM answers (still stores new ones)")
+    ap.add_argument("--map-reduce", action="store_true", help="profile from all evidence, one LLM call per partition")
+    ap.add_argument("--partition-by", default="section", choices=["section", "time"])
+    ap.add_argument("--partition-tokens", type=int, help="evidence tokens per partition (default: from --budget)")
+    args = ap.parse_args(argv)
+
+    entities = list(args.entities)
+    if args.entities_file:
+        with open(args.entities_file, "r", encoding="utf-8") as f:
+            entities += [line.strip() for line in f if line.strip()]
+    if not entities:
+        ap.error("no entities given")
+
+    if args.emb_workers is not None:
+        _embedding.WORKERS = args.emb_workers
+    ensure_theory_index(args.emb_model)
+    mentions = index_corpus(args.corpus, entities, args.emb_model)
+    s = embedding_stats()
+    print(f"embedded {s['texts']} chunks at {s['chunks_per_sec']} chunks/s ({s['workers']} worker(s))")
+    profiles = profile_batch(entities, args.emb_model, hf_model=args.hf_model, language=args.language,
+                             k_char=args.k_char, k_psych=args.k_psych, workers=args.workers, mentions=mentions,
+                             use_cache=not args.no_cache, budget_tokens=args.budget, map_reduce=args.map_reduce,
+                             partition_by=args.partition_by, partition_tokens=args.partition_tokens)
+    write_profiles(profiles, args.out)
+    for e, p in profiles.items():
+        print(f"{e}: {p['mode']}" + (f" ({p['error']})" if p.get("error") else "")
+              + (f" ({len(p['partitions'])} partitions, {len(p['failed'])} failed)" if "partitions" in p else ""))
+
+
+if __name__ == "__main__":
+    main()
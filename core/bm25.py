@@ -0,0 +1,176 @@
+import os, re, threading, unicodedata
+import numpy as np
+from typing import Dict, Iterable, List, Tuple
+from . import index as _index
+from .metrics import timed
+
+# In-process BM25 next to each FAISS index. Postings are CSR arrays (term -> slice
+# of doc positions and term frequencies) and a query is scored with one bincount
+# over the concatenated postings of its terms.
+K1, B = 1.2, 0.75
+
+_handles: Dict[str, Dict] = {}
+_lock = threading.Lock()
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    # Case/accent-insensitive, like entity matching in core.mentions
+    folded = "".join(c for c in unicodedata.normalize("NFKD", text.casefold()) if not unicodedata.combining(c))
+    return _TOKEN.findall(folded)
+
+
+def bm25_path(index_name: str) -> str:
+    return os.path.join(_index.STORAGE, f"{index_name}.bm25.npz")
+
+
+class Postings:
+    """(faiss row, text) documents tokenized into postings, added batch by batch."""
+
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self.rows, self.doc_len, self.term_ids, self.doc_ids, self.tfs = [], [], [], [], []
+
+    def add(self, docs: Iterable[Tuple[int, str]]) -> "Postings":
+        vocab = self.vocab
+        for row, text in docs:
+            counts: Dict[int, int] = {}
+            toks = tokenize(text)
+            for t in toks:
+                tid = vocab.setdefault(t, len(vocab))
+                counts[tid] = counts.get(tid, 0) + 1
+            self.term_ids.extend(counts.keys())
+            self.doc_ids.extend([len(self.rows)] * len(counts))
+            self.tfs.extend(counts.values())
+            self.rows.append(row)
+            self.doc_len.append(len(toks))
+        return self
+
+    def without(self, rows: Iterable[int]) -> "Postings":
+        """These postings minus the documents of `rows` (e.g. rows replaced later in the same stream)."""
+        drop = set(rows).intersection(self.rows)
+        if not drop:
+            return self
+        keep = [r not in drop for r in self.rows]
+        pos = np.cumsum(keep) - 1                        # old doc position -> new one
+        out = Postings()
+        out.vocab = self.vocab                           # terms left without postings are dropped on save
+        out.rows = [r for r, k in zip(self.rows, keep) if k]
+        out.doc_len = [n for n, k in zip(self.doc_len, keep) if k]
+        for t, d, tf in zip(self.term_ids, self.doc_ids, self.tfs):
+            if keep[d]:
+                out.term_ids.append(t)
+                out.doc_ids.append(int(pos[d]))
+                out.tfs.append(tf)
+        return out
+
+
+def _save(index_name: str, vocab: Dict[str, int], term_ids, doc_ids, tfs, doc_len, rows) -> None:
+    # CSR by term, doc positions ascending within each term; terms left without postings are dropped
+    term_ids = np.asarray(term_ids, dtype=np.int64)
+    counts = np.bincount(term_ids, minlength=len(vocab))
+    alive = counts > 0
+    terms = np.array(sorted(vocab, key=vocab.get))[alive] if vocab else np.array([], dtype="<U1")
+    term_ids = (np.cumsum(alive) - 1)[term_ids]
+    order = np.argsort(term_ids, kind="stable")
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(counts[alive], out=indptr[1:])
+    tmp = bm25_path(index_name) + ".tmp.npz"
+    np.savez(tmp, terms=terms, indptr=indptr,
+             docs=np.asarray(doc_ids, dtype=np.int32)[order], tf=np.asarray(tfs, dtype=np.float32)[order],
+             doc_len=np.asarray(doc_len, dtype=np.float32), rows=np.asarray(rows, dtype=np.int64))
+    os.replace(tmp, bm25_path(index_name))
+
+
+@timed()
+def build_bm25(docs, index_name: str) -> None:
+    """Build and save the BM25 index for (faiss row, text) pairs (or a filled Postings)."""
+    p = docs if isinstance(docs, Postings) else Postings().add(docs)
+    _save(index_name, p.vocab, p.term_ids, p.doc_ids, p.tfs, p.doc_len, p.rows)
+
+
+def rebuild_bm25(index_name: str) -> None:
+    """Rebuild the BM25 index from the chunk texts in `index_name`'s metadata store."""
+    build_bm25(((c["row"], c["text"]) for c in _index.iter_chunks(index_name)), index_name)
+
+
+@timed()
+def update_bm25(index_name: str, added: Postings, removed: Iterable[int] = ()) -> None:
+    """
+    Apply an upsert/delete to the saved BM25 index: the postings of `removed` rows are
+    dropped and `added` is merged in, without reading or re-tokenizing the rest of the
+    corpus. Rebuilds from the metadata store if there is no saved index yet.
+    """
+    removed = np.fromiter(removed, dtype=np.int64)
+    if not added.rows and not len(removed):
+        return
+    path = bm25_path(index_name)
+    if not os.path.exists(path):
+        rebuild_bm25(index_name)
+        return
+    with np.load(path) as data:
+        old = {k: data[k] for k in data.files}
+    vocab = {t: i for i, t in enumerate(old["terms"].tolist())}
+    remap = np.array([vocab.setdefault(t, len(vocab)) for t in sorted(added.vocab, key=added.vocab.get)],
+                     dtype=np.int64)
+
+    keep = ~np.isin(old["rows"], np.concatenate([removed, np.asarray(added.rows, dtype=np.int64)]))
+    pos = np.cumsum(keep) - 1                                 # old doc position -> new one
+    old_terms = np.repeat(np.arange(len(old["indptr"]) - 1), np.diff(old["indptr"]))
+    live = keep[old["docs"]]
+    n_kept = int(keep.sum())
+    _save(index_name, vocab,
+          np.concatenate([old_terms[live], remap[np.asarray(added.term_ids, dtype=np.int64)]]),
+          np.concatenate([pos[old["docs"][live]], np.asarray(added.doc_ids, dtype=np.int64) + n_kept]),
+          np.concatenate([old["tf"][live], np.asarray(added.tfs, dtype=np.float32)]),
+          np.concatenate([old["doc_len"][keep], np.asarray(added.doc_len, dtype=np.float32)]),
+          np.concatenate([old["rows"][keep], np.asarray(added.rows, dtype=np.int64)]))
+
+
+def _open(index_name: str):
+    path = bm25_path(index_name)
+    try:
+        sig = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _lock:
+        h = _handles.get(index_name)
+        if h is None or h["sig"] != sig:
+            with np.load(path) as data:
+                h = {k: data[k] for k in data.files}
+            h["vocab"] = {t: i for i, t in enumerate(h.pop("terms").tolist())}
+            n = len(h["doc_len"])
+            h["avgdl"] = float(h["doc_len"].mean()) if n else 0.0
+            df = np.diff(h["indptr"]).astype(np.float32)
+            h["idf"] = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            h["sig"] = sig
+            _handles[index_name] = h
+        return h
+
+
+def close(index_name: str) -> None:
+    with _lock:
+        _handles.pop(index_name, None)
+
+
+@timed()
+def bm25_search(query: str, index_name: str, top_k: int = 10) -> List[Tuple[int, float]]:
+    """(faiss row, BM25 score) for the top-k chunks; [] if there is no BM25 index."""
+    h = _open(index_name)
+    if h is None or not len(h["doc_len"]):
+        return []
+    tids = [h["vocab"][t] for t in set(tokenize(query)) if t in h["vocab"]]
+    if not tids:
+        return []
+    ptr = h["indptr"]
+    sl = np.concatenate([np.arange(ptr[t], ptr[t + 1]) for t in tids])
+    idf = np.repeat(h["idf"][tids], [ptr[t + 1] - ptr[t] for t in tids])
+    docs, tf = h["docs"][sl], h["tf"][sl]
+    norm = K1 * (1 - B + B * h["doc_len"][docs] / (h["avgdl"] or 1.0))
+    scores = np.bincount(docs, weights=idf * tf * (K1 + 1) / (tf + norm), minlength=len(h["doc_len"]))
+    k = min(top_k, int((scores > 0).sum()))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(h["rows"][i]), float(scores[i])) for i in top]
@@ -0,0 +1,178 @@
+import os, json, hashlib, re, threading, time
+import numpy as np
+from typing import Dict, List
+from .embedding import embed
+from .metrics import count, timed
+from .utils import file_lock
+
+# Persistent, content-addressed store of normalized embeddings: one directory per
+# model holding a raw float32 matrix (memory-mapped for reads, appended for writes)
+# plus an append-only key log ("dim <d>", then "<sha1(text)> <row> <last_used>" lines,
+# the last line for a key winning). Each process keeps the key index in memory and
+# only reads the log's new tail (other processes' appends); writes append the new
+# keys under the directory's file lock. Encoding itself runs outside every lock.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage", "embcache")
+MAX_ROWS = int(os.getenv("PSYCHE_EMB_CACHE_MAX", "200000"))
+TOUCH_EVERY = 3600       # seconds before a hit re-logs its last-used time (for eviction)
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_keys: Dict[str, Dict] = {}     # model dir -> {"dim", "rows": {key: [row, last_used]}, "ino", "offset"}
+
+
+def _model_dir(model_name: str) -> str:
+    return os.path.join(CACHE_DIR, re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name))
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _log_path(d: str) -> str:
+    return os.path.join(d, "keys.log")
+
+
+def _write_log(d: str, keys: Dict) -> None:
+    tmp = _log_path(d) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(f"dim {keys['dim']}\n")
+        f.writelines(f"{k} {r} {int(ts)}\n" for k, (r, ts) in keys["rows"].items())
+    os.replace(tmp, _log_path(d))
+
+
+def _sync(d: str) -> Dict:
+    # The in-memory key index for `d`, caught up with the log: only its new tail is
+    # read, unless the log was rewritten (eviction) or removed (cache cleared).
+    keys = _keys.get(d)
+    path = _log_path(d)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        keys = {"dim": 0, "rows": {}, "ino": None, "offset": 0}
+        legacy = os.path.join(d, "keys.json")    # older caches: convert once
+        if os.path.exists(legacy):
+            try:
+                with open(legacy, "r", encoding="utf-8") as f:
+                    keys.update(json.load(f))
+            except ValueError:
+                pass
+            if keys["dim"]:
+                _write_log(d, keys)
+                os.remove(legacy)
+                return _sync(d)
+        _keys[d] = keys
+        return keys
+    if keys is None or keys["ino"] != st.st_ino or st.st_size < keys["offset"]:
+        keys = _keys[d] = {"dim": 0, "rows": {}, "ino": st.st_ino, "offset": 0}
+    if st.st_size > keys["offset"]:
+        with open(path, "rb") as f:
+            f.seek(keys["offset"])
+            tail = f.read()
+        tail = tail[:tail.rfind(b"\n") + 1]      # a line being appended right now waits for next time
+        rows = keys["rows"]
+        for line in tail.decode("utf-8").splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[0] == "dim":
+                keys["dim"] = int(parts[1])
+            elif len(parts) == 3:
+                rows[parts[0]] = [int(parts[1]), float(parts[2])]
+        keys["offset"] += len(tail)
+    return keys
+
+
+def _append(d: str, keys: Dict, lines: List[str]) -> None:
+    # Caller holds the file lock and has just synced, so the log ends where we left it
+    if not lines:
+        return
+    with open(_log_path(d), "a", encoding="utf-8") as f:
+        f.writelines(lines)
+        keys["offset"] = f.tell()
+    keys["ino"] = os.stat(_log_path(d)).st_ino
+
+
+def _n_rows(d: str, keys: Dict) -> int:
+    # Row count comes from the file itself, so a crash between appending vectors and
+    # logging their keys only leaves unreferenced rows behind.
+    path = os.path.join(d, "vectors.f32")
+    if not keys["dim"] or not os.path.exists(path):
+        return 0
+    return os.path.getsize(path) // (4 * keys["dim"])
+
+
+def _vectors(d: str, keys: Dict):
+    n = _n_rows(d, keys)
+    if not n:
+        return None
+    return np.memmap(os.path.join(d, "vectors.f32"), dtype=np.float32, mode="r", shape=(n, keys["dim"]))
+
+
+def _evict(d: str, keys: Dict) -> None:
+    # Keep the most recently used rows and rewrite the matrix compacted.
+    keep = sorted(keys["rows"].items(), key=lambda kv: kv[1][1], reverse=True)[:int(MAX_ROWS * 0.8)]
+    vecs = _vectors(d, keys)
+    rows = np.array([r for _, (r, _) in keep], dtype=np.int64)
+    data = np.ascontiguousarray(vecs[rows]) if len(rows) else np.zeros((0, keys["dim"]), np.float32)
+    del vecs
+    tmp = os.path.join(d, "vectors.f32.tmp")
+    data.tofile(tmp)
+    os.replace(tmp, os.path.join(d, "vectors.f32"))
+    _stats["evictions"] += len(keys["rows"]) - len(keep)
+    keys["rows"] = {k: [i, ts] for i, (k, (_, ts)) in enumerate(keep)}
+    _write_log(d, keys)
+    st = os.stat(_log_path(d))
+    keys["ino"], keys["offset"] = st.st_ino, st.st_size
+
+
+@timed()
+def encode_cached(model_name: str, texts: List[str]) -> np.ndarray:
+    """Normalized float32 embeddings for `texts`, encoding only the ones not seen before."""
+    d = _model_dir(model_name)
+    hashes = [text_key(t) for t in texts]
+    with _lock:
+        os.makedirs(d, exist_ok=True)
+        rows = _sync(d)["rows"]
+        miss = sorted({h: i for i, h in enumerate(hashes) if h not in rows}.values())
+        _stats["hits"] += len(texts) - len(miss)
+        _stats["misses"] += len(miss)
+    count("emb_cache_hits", len(texts) - len(miss))
+    count("emb_cache_misses", len(miss))
+    # Another thread or process may encode the same texts meanwhile; whoever appends
+    # second finds them logged and drops its copies
+    new = embed(model_name, [texts[i] for i in miss]) if miss else None
+
+    with _lock, file_lock(os.path.join(d, ".lock")):
+        keys = _sync(d)
+        rows, lines = keys["rows"], []
+        if new is not None:
+            if not keys["dim"]:
+                keys["dim"] = int(new.shape[1])
+                lines.append(f"dim {keys['dim']}\n")
+            fresh = [j for j, i in enumerate(miss) if hashes[i] not in rows]
+            start = _n_rows(d, keys)
+            if fresh:
+                with open(os.path.join(d, "vectors.f32"), "ab") as f:
+                    f.write(np.ascontiguousarray(new[fresh]).tobytes())
+            now = time.time()
+            for r, j in enumerate(fresh):
+                rows[hashes[miss[j]]] = [start + r, now]
+                lines.append(f"{hashes[miss[j]]} {start + r} {int(now)}\n")
+
+        now = time.time()
+        for h in dict.fromkeys(hashes):
+            if now - rows[h][1] > TOUCH_EVERY:
+                rows[h][1] = now
+                lines.append(f"{h} {rows[h][0]} {int(now)}\n")
+        vecs = _vectors(d, keys)
+        out = np.array(vecs[[rows[h][0] for h in hashes]], dtype=np.float32) if hashes else \
+            np.zeros((0, keys["dim"]), np.float32)
+        del vecs
+        _append(d, keys, lines)
+        if len(rows) > MAX_ROWS:
+            _evict(d, keys)
+    return out
+
+
+def cache_stats() -> Dict:
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return dict(_stats, hit_rate=round(_stats["hits"] / total, 4) if total else 0.0)
@@ -0,0 +1,142 @@
+import atexit, os, threading, time
+import numpy as np
+from typing import Dict, Iterator, List, Tuple
+from .encoders import get_encoder
+from .metrics import count, timed
+
+# Embedding engine for CPU-only hosts. Texts are sorted by length and cut into
+# batches of similar length, so each batch pads to its own longest text rather than
+# to the longest in the corpus, and the batch size follows a token budget (short
+# texts -> large batches, long texts -> small ones). With WORKERS > 1, batches are
+# fanned out to a process pool: each worker loads its own copy of the model and runs
+# THREADS torch threads, so the workers share the cores instead of oversubscribing.
+WORKERS = int(os.getenv("PSYCHE_EMB_WORKERS", "1"))            # 0 = one per 4 cores
+THREADS = int(os.getenv("PSYCHE_EMB_THREADS", "0"))            # per worker; 0 = cores / workers
+BATCH_TOKENS = int(os.getenv("PSYCHE_EMB_BATCH_TOKENS", "16384"))
+MIN_BATCH, MAX_BATCH = 8, 256
+POOL_MIN_TEXTS = 64        # fewer texts are encoded in-process: a pool round-trip costs more
+CHARS_PER_TOKEN = 4        # length estimate for bucketing, so texts aren't tokenized twice
+MAX_SEQ_TOKENS = 512
+
+_lock = threading.Lock()
+_pools: Dict[Tuple[str, int], object] = {}
+_stats = {"calls": 0, "texts": 0, "batches": 0, "seconds": 0.0, "pooled_texts": 0,
+          "padded_chars": 0, "chars": 0}
+
+
+def workers() -> int:
+    if WORKERS > 0:
+        return WORKERS
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+def threads_per_worker(n_workers: int) -> int:
+    return THREADS if THREADS > 0 else max(1, (os.cpu_count() or 1) // max(n_workers, 1))
+
+
+def length_batches(texts: List[str], batch_tokens: int = BATCH_TOKENS) -> List[List[int]]:
+    """Indices of `texts` grouped into batches of similar length, longest first, sized by token budget."""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    out, i = [], 0
+    while i < len(order):
+        longest = min(len(texts[order[i]]) // CHARS_PER_TOKEN + 2, MAX_SEQ_TOKENS)
+        size = min(max(batch_tokens // max(longest, 1), MIN_BATCH), MAX_BATCH)
+        out.append(order[i:i + size])
+        i += size
+    return out
+
+
+def _encode(model, texts: List[str]) -> np.ndarray:
+    # One call per length batch: the whole batch goes through the model at once
+    return model.encode(texts, batch_size=len(texts), convert_to_numpy=True,
+                        normalize_embeddings=True, show_progress_bar=False).astype(np.float32)
+
+
+def _init_worker(threads: int) -> None:
+    # Runs in each pool process before torch is imported there
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    import torch
+    torch.set_num_threads(threads)
+
+
+def _work(model_name: str, texts: List[str]) -> np.ndarray:
+    return _encode(get_encoder(model_name), texts)
+
+
+def _pool(model_name: str, n_workers: int):
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing as mp
+    with _lock:
+        pool = _pools.get((model_name, n_workers))
+        if pool is None:
+            # spawn: forking a process that already holds torch threads can deadlock
+            pool = ProcessPoolExecutor(n_workers, mp_context=mp.get_context("spawn"), initializer=_init_worker,
+                                       initargs=(threads_per_worker(n_workers),))
+            _pools[(model_name, n_workers)] = pool
+        return pool
+
+
+def shutdown() -> None:
+    """Stop the worker processes (they are restarted on the next pooled call)."""
+    with _lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _pools.clear()
+
+
+atexit.register(shutdown)
+
+
+def iter_embed(model_name: str, texts: List[str], batch_tokens: int = BATCH_TOKENS,
+               n_workers: int = None) -> Iterator[Tuple[List[int], np.ndarray]]:
+    """(indices into `texts`, normalized float32 vectors) per length batch, as each batch finishes."""
+    n_workers = workers() if n_workers is None else max(n_workers, 1)
+    batches = length_batches(texts, batch_tokens)
+    if n_workers > 1 and len(texts) >= POOL_MIN_TEXTS:
+        from concurrent.futures import as_completed
+        pool = _pool(model_name, n_workers)
+        futures = {pool.submit(_work, model_name, [texts[i] for i in b]): b for b in batches}
+        for fut in as_completed(futures):
+            yield futures[fut], fut.result()
+    else:
+        model = get_encoder(model_name)
+        for b in batches:
+            yield b, _encode(model, [texts[i] for i in b])
+
+
+@timed()
+def embed(model_name: str, texts: List[str], batch_tokens: int = BATCH_TOKENS, n_workers: int = None) -> np.ndarray:
+    """Normalized float32 embeddings of `texts`, in input order (see iter_embed)."""
+    n_workers = workers() if n_workers is None else max(n_workers, 1)
+    t0 = time.perf_counter()
+    out, n_batches, padded = None, 0, 0
+    for idx, vecs in iter_embed(model_name, texts, batch_tokens, n_workers):
+        if out is None:
+            out = np.empty((len(texts), vecs.shape[1]), dtype=np.float32)
+        out[idx] = vecs
+        n_batches += 1
+        padded += len(idx) * max(len(texts[i]) for i in idx)
+    dt = time.perf_counter() - t0
+    count("embedded_texts", len(texts))
+    with _lock:
+        _stats["calls"] += 1
+        _stats["texts"] += len(texts)
+        _stats["batches"] += n_batches
+        _stats["seconds"] += dt
+        _stats["chars"] += sum(map(len, texts))
+        _stats["padded_chars"] += padded
+        if n_workers > 1 and len(texts) >= POOL_MIN_TEXTS:
+            _stats["pooled_texts"] += len(texts)
+    return out if out is not None else np.zeros((0, 0), dtype=np.float32)
+
+
+def embedding_stats() -> Dict:
+    """Totals since start-up; chunks_per_sec is the encoder throughput (cache hits excluded)."""
+    with _lock:
+        s = dict(_stats, seconds=round(_stats["seconds"], 3), workers=workers())
+        s["chunks_per_sec"] = round(s["texts"] / _stats["seconds"], 1) if _stats["seconds"] else 0.0
+    # Share of the padded batch that is real text (1.0 = no padding), estimated from lengths
+    s["fill"] = round(s.pop("chars") / s["padded_chars"], 3) if s["padded_chars"] else 1.0
+    return s
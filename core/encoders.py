@@ -0,0 +1,139 @@
+import os, re, threading, time, zlib
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable
+
+# Process-wide registry of embedding models: each encoder is loaded once and shared
+# by every build/search call (and every Streamlit session) in this process.
+MAX_ENCODERS = int(os.getenv("PSYCHE_MAX_ENCODERS", "2"))
+
+_encoders: "OrderedDict[str, object]" = OrderedDict()
+_loading: Dict[str, threading.Lock] = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0, "load_seconds": 0.0, "load_times": {}}
+
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+class _RegexTokenizer:
+    def __call__(self, texts, add_special_tokens: bool = False):
+        return {"input_ids": [_TOKEN.findall(t) for t in texts]}
+
+
+class HashingEncoder:
+    """
+    Offline stand-in for a SentenceTransformer: signed feature hashing of lower-cased
+    word/punctuation tokens into `dim` dimensions. Deterministic and model-free, with
+    the encode()/tokenizer/max_seq_length surface the pipeline uses, so benchmarks
+    and smoke runs work without downloads. Load it as "hashing" or "hashing-<dim>".
+    """
+    max_seq_length = 512
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.tokenizer = _RegexTokenizer()
+
+    def encode(self, texts, batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, show_progress_bar: bool = False, **kwargs):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for tok in _TOKEN.findall(t.lower())[:self.max_seq_length - 2]:
+                h = zlib.crc32(tok.encode("utf-8"))
+                out[i, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+
+# name -> zero-argument factory, consulted before sentence-transformers
+_factories: Dict[str, Callable[[], object]] = {}
+
+
+def register_encoder(name: str, factory: Callable[[], object]) -> None:
+    """Make `name` load from `factory()` (an object with encode(), tokenizer and max_seq_length)."""
+    with _lock:
+        _factories[name] = factory
+        _encoders.pop(name, None)
+
+
+def _load(name: str):
+    if name in _factories:
+        return _factories[name]()
+    # Built-in, so embedding worker processes (core.embedding) resolve it too
+    if name == "hashing" or name.startswith("hashing-"):
+        return HashingEncoder(int(name.split("-", 1)[1]) if "-" in name else 256)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name)
+
+
+def get_encoder(name: str):
+    """Return the shared encoder for `name`, loading it on first use (LRU-capped)."""
+    with _lock:
+        model = _encoders.get(name)
+        if model is not None:
+            _encoders.move_to_end(name)
+            _stats["hits"] += 1
+            return model
+        _stats["misses"] += 1
+        name_lock = _loading.setdefault(name, threading.Lock())
+
+    # Load outside the registry lock so other models stay available; concurrent
+    # requests for the same model wait on its per-name lock and load it only once.
+    with name_lock:
+        with _lock:
+            model = _encoders.get(name)
+            if model is not None:
+                _encoders.move_to_end(name)
+                return model
+        t0 = time.perf_counter()
+        model = _load(name)
+        dt = time.perf_counter() - t0
+        with _lock:
+            _encoders[name] = model
+            _stats["loads"] += 1
+            _stats["load_seconds"] += dt
+            _stats["load_times"][name] = round(dt, 3)
+            while len(_encoders) > max(MAX_ENCODERS, 1):
+                _encoders.popitem(last=False)
+                _stats["evictions"] += 1
+        return model
+
+
+def token_counter(name: str):
+    """texts -> token counts (no special tokens) using the encoder's own tokenizer, one batched call."""
+    tokenizer = get_encoder(name).tokenizer
+
+    def count(texts):
+        if not texts:
+            return np.zeros(0, dtype=np.int64)
+        ids = tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+        return np.fromiter(map(len, ids), dtype=np.int64, count=len(ids))
+    return count
+
+
+def max_tokens(name: str) -> int:
+    """Content tokens the encoder actually embeds (max sequence length minus [CLS]/[SEP])."""
+    return int(get_encoder(name).max_seq_length) - 2
+
+
+def warmup(names: Iterable[str]) -> None:
+    """Preload encoders (e.g. at app startup) so the first request doesn't pay the load."""
+    for name in names:
+        get_encoder(name)
+
+
+def evict(name: str = None) -> None:
+    """Drop one encoder (or all of them) from the registry."""
+    with _lock:
+        if name is None:
+            _encoders.clear()
+        else:
+            _encoders.pop(name, None)
+
+
+def encoder_stats() -> Dict:
+    with _lock:
+        out = dict(_stats, load_times=dict(_stats["load_times"]))
+        out["loaded"] = list(_encoders.keys())
+        return out
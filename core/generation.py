@@ -1,6 +1,10 @@
-import os, json, re
-from typing import Dict, Any
-from pydantic import BaseModel, Field
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from pydantic import BaseModel, Field, ValidationError
+from .jsonrepair import parse_object
+from .metrics import timed
+from .prompts import build_repair_prompt
+from .llm import get_client
+from .llmcache import response_key, get_response, get_parsed, put_response, put_parsed
 
 
 class Profile(BaseModel):
@@ -16,6 +20,7 @@ class Profile(BaseModel):
     confidence: float = 0.7
 
 
+@timed()
 def template_fallback(character: str, char_chunks: list, psych_chunks: list, language: str = "pt") -> Dict[str, Any]:
     """
     Geração determinística de emergência (sem LLM), usando os chunks recuperados.
@@ -49,120 +54,158 @@ def template_fallback(character: str, char_chunks: list, psych_chunks: list, lan
     return {"json": base, "markdown": md}
 
 
-def hf_infer(prompt: str, model: str, temperature: float = 0.2, max_new_tokens: int = 800) -> str:
+@timed()
+def hf_infer(prompt: str, model: str, temperature: float = 0.2, max_new_tokens: int = 800,
+             top_p: float = 0.95, use_cache: bool = True) -> str:
     """
-    Usa o SDK oficial da Hugging Face.
+    Usa o SDK oficial da Hugging Face através do cliente partilhado de core.llm
+    (um InferenceClient por modelo, com limite de concorrência, rate limiting e retries).
     Para Llama 3 (alguns providers), a tarefa suportada é 'conversational' → chat_completion().
     Se chat não estiver disponível noutro modelo, faz fallback para text_generation().
+    Com PSYCHE_LLM_BACKEND=http usa um endpoint compatível com OpenAI (PSYCHE_LLM_BASE_URL).
+    Respostas repetidas (mesmo prompt, modelo e parâmetros) vêm da cache em disco (core.llmcache).
     """
-    from huggingface_hub import InferenceClient
-    from huggingface_hub.errors import HfHubHTTPError
-
-    token = os.getenv("HF_API_TOKEN", "").strip()
-    if not token:
-        raise RuntimeError("HF_API_TOKEN not set")
-
-    client = InferenceClient(model=model, token=token)
-
-    # 1) Tentar chat (compatível com Llama 3 via providers que exigem 'conversational')
-    try:
-        resp = client.chat_completion(
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an expert psychologist. Follow the instructions precisely. "
-                        "Return output in TWO parts: "
-                        "(1) a valid JSON strictly following the provided schema; "
-                        "(2) then the line --- on its own line; "
-                        "(3) then a concise Markdown summary with citations (chunk_id)."
-                    )
-                },
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=max_new_tokens,    # parâmetro esperado pelo chat_completion
-            temperature=temperature,
-            top_p=0.95,
-            stream=False,
-        )
-        # Extrair conteúdo de forma robusta (diferentes providers = diferentes estruturas)
-        choice = resp.choices[0]
-        content = ""
-        if hasattr(choice, "message") and isinstance(choice.message, dict):
-            content = choice.message.get("content", "")
-        elif hasattr(choice, "message") and hasattr(choice.message, "content"):
-            content = choice.message.content
-        elif isinstance(choice, dict) and "message" in choice:
-            msg = choice["message"]
-            content = msg.get("content", "") if isinstance(msg, dict) else str(msg)
-        else:
-            content = str(choice)
-
-        if isinstance(content, list):  # alguns providers devolvem lista de partes
-            return "".join([part.get("text", "") if isinstance(part, dict) else str(part) for part in content])
-        return content
-    except HfHubHTTPError as e_chat:
-        # 2) Fallback para text_generation (ex.: Mistral, Zephyr, etc.)
-        try:
-            return client.text_generation(
-                prompt,
-                max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                top_p=0.95,
-                stream=False,
-            )
-        except HfHubHTTPError as e_txt:
-            raise RuntimeError(f"Hugging Face inference error (chat/text): {e_chat} / {e_txt}") from e_txt
-
-
-def _clean_json_str(j_text: str) -> str:
-    """
-    Limpa ruído comum em respostas LLM antes de json.loads:
-    - remove comentários tipo //...
-    - remove vírgulas a mais antes de } ou ]
-    - extrai conteúdo de blocos ```json ... ```
-    """
-    # remove comentários linha
-    j_text = re.sub(r'//.*', '', j_text)
-    # remove vírgula à esquerda de } ou ]
-    j_text = re.sub(r',(\s*[}\]])', r'\1', j_text)
-    # extrai bloco json dentro de ``` ```
-    m = re.search(r'```(?:json)?\s*(\{.*\})\s*```', j_text, re.DOTALL)
-    if m:
-        j_text = m.group(1)
-    return j_text.strip()
+    key = response_key(prompt, model, temperature, max_new_tokens, top_p)
+    cached = get_response(key) if use_cache else None
+    if cached is not None:
+        return cached
+    text = get_client(model).complete(prompt, temperature=temperature, max_new_tokens=max_new_tokens, top_p=top_p)
+    put_response(key, model, text)
+    return text
 
 
-def extract_json_then_md(text: str) -> Dict[str, Any]:
+@timed()
+def hf_infer_stream(prompt: str, model: str, temperature: float = 0.2, max_new_tokens: int = 800,
+                    top_p: float = 0.95, use_cache: bool = True) -> Iterator[str]:
     """
-    Extrai JSON (primeira estrutura {...}) e depois tenta obter Markdown do resto.
-    Se o prompt tiver imposto o separador '---', também é suportado.
+    Como hf_infer(), mas devolve os fragmentos de texto à medida que são gerados
+    (chat_completion(stream=True)); para usar com core.jsonstream.ProfileStream.
+    Uma resposta em cache é devolvida num só fragmento; só respostas completas são guardadas.
     """
-    if "\n---\n" in text:
-        json_part, md_part = text.split("\n---\n", 1)
-    else:
-        json_part, md_part = text, ""
+    key = response_key(prompt, model, temperature, max_new_tokens, top_p)
+    cached = get_response(key) if use_cache else None
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    for delta in get_client(model).stream(prompt, temperature=temperature, max_new_tokens=max_new_tokens, top_p=top_p):
+        parts.append(delta)
+        yield delta
+    put_response(key, model, "".join(parts))
+
+
+REPAIR_MAX_TOKENS = 400
+
+
+def cached_profile(prompt: str, model: str, temperature: float = 0.2, max_new_tokens: int = 800,
+                   top_p: float = 0.95) -> Optional[Dict[str, Any]]:
+    """Perfil já extraído e validado ({"json", "markdown", ...}) para este pedido, se estiver em cache."""
+    return get_parsed(response_key(prompt, model, temperature, max_new_tokens, top_p))
+
+
+def validate_profile(data: Dict[str, Any], character: str = "") -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Valida `data` contra Profile. Devolve (perfil válido, campos em falta ou inválidos);
+    os campos problemáticos ficam com o valor por omissão do schema.
+    """
+    fields = list(Profile.model_fields)
+    clean = {k: v for k, v in data.items() if k in fields}
+    bad = [f for f in fields if f not in clean and f != "character"]
+    if not clean.get("character"):
+        clean["character"] = character
+    while True:
+        try:
+            return Profile.model_validate(clean).model_dump(), bad
+        except ValidationError as e:
+            invalid = {err["loc"][0] for err in e.errors() if err["loc"]}
+            if not invalid & set(clean):
+                raise
+            for f in invalid:
+                clean.pop(f, None)
+                if f == "character":
+                    clean[f] = str(character)
+                elif f not in bad:
+                    bad.append(f)
+
 
-    start = json_part.find("{")
-    end = json_part.rfind("}")
-    j = {}
-    if start >= 0 and end > start:
-        j_text = _clean_json_str(json_part[start:end + 1])
+@timed()
+def parse_response(text: str, prompt: str, model: str, character: str = "", language: str = "pt",
+                   repair: bool = True, use_cache: bool = True, temperature: float = 0.2,
+                   max_new_tokens: int = 800, top_p: float = 0.95) -> Dict[str, Any]:
+    """
+    extract_json_then_md(text) validado contra Profile. Campos em falta ou inválidos são
+    pedidos de novo ao modelo (só esses, com `repair`), em vez de regenerar o perfil inteiro.
+    Devolve {"json", "markdown", "repaired": [...], "invalid": [...]} e guarda-o em cache
+    junto da resposta original (exceto se a reparação falhar, para ser tentada de novo).
+    """
+    parsed = extract_json_then_md(text)
+    if not parsed["json"]:
+        return dict(parsed, repaired=[], invalid=[])
+    profile, bad = validate_profile(parsed["json"], character)
+    repaired = []
+    if bad and repair:
+        keep = {k: v for k, v in profile.items() if k not in bad}
         try:
-            j = json.loads(j_text)
+            fix = extract_json_then_md(hf_infer(build_repair_prompt(prompt, keep, bad, language), model=model,
+                                                max_new_tokens=REPAIR_MAX_TOKENS, use_cache=use_cache))["json"]
+            profile, still = validate_profile(dict(keep, **{k: fix[k] for k in bad if k in fix}), character)
+            repaired, bad = [f for f in bad if f not in still], still
         except Exception:
-            # tenta novamente procurando bloco de código explícito
-            code_block = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', json_part, re.DOTALL)
-            if code_block:
-                j_text = _clean_json_str(code_block.group(1))
-                try:
-                    j = json.loads(j_text)
-                except Exception:
-                    j = {}
-
-    if not md_part:
-        md_part = json_part[end + 1:].strip() if end > start else ""
-    return {"json": j, "markdown": md_part}
+            # Fica o perfil parcial, com valores por omissão nos campos em falta, mas
+            # fora da cache: o próximo pedido volta a tentar a reparação
+            return {"json": profile, "markdown": parsed["markdown"], "repaired": [], "invalid": bad}
+    out = {"json": profile, "markdown": parsed["markdown"], "repaired": repaired, "invalid": bad}
+    put_parsed(response_key(prompt, model, temperature, max_new_tokens, top_p), out, model=model, text=text)
+    return out
+
+
+@timed()
+def generate_profile(prompt: str, character: str, char_chunks: list, psych_chunks: list,
+                     model: str = None, language: str = "pt", use_cache: bool = True) -> Dict[str, Any]:
+    """
+    Perfil completo para um prompt já construído: LLM (se `model`) → JSON + Markdown,
+    com reparação dos campos inválidos e fallback determinístico se a API falhar ou
+    não houver JSON aproveitável.
+    Devolve {"json", "markdown", "mode": "llm" | "template", "repaired"?, "invalid"?, "error"?}.
+    """
+    if model:
+        try:
+            parsed = cached_profile(prompt, model) if use_cache else None
+            if parsed is None:
+                parsed = parse_response(hf_infer(prompt, model=model, use_cache=use_cache), prompt, model,
+                                        character=character, language=language, use_cache=use_cache)
+            if parsed["json"]:
+                md = parsed["markdown"] if parsed["markdown"].strip() else json_profile_to_markdown(parsed["json"])
+                return {"json": parsed["json"], "markdown": md, "mode": "llm",
+                        "repaired": parsed.get("repaired", []), "invalid": parsed.get("invalid", [])}
+            error = "invalid JSON"
+        except Exception as e:
+            error = str(e)
+        out = template_fallback(character, char_chunks, psych_chunks, language=language)
+        return dict(out, mode="template", error=error)
+    return dict(template_fallback(character, char_chunks, psych_chunks, language=language), mode="template")
+
+
+@timed()
+def extract_json_then_md(text: str) -> Dict[str, Any]:
+    """
+    Extrai o primeiro objeto JSON numa só passagem tolerante (core.jsonrepair: blocos ```,
+    comentários, vírgulas a mais ou em falta, aspas simples, resposta cortada, ...)
+    e usa o resto como Markdown, depois do separador '---' se existir.
+    """
+    j, end = parse_object(text)
+    if end < 0:
+        return {"json": {}, "markdown": ""}
+    rest = text[end:]
+    sep = rest.find("\n---\n")
+    if sep >= 0 and not rest[:sep].strip(" \n`"):
+        md_part = rest[sep + 5:]
+    else:
+        md_part = rest.lstrip()
+        if md_part.startswith("```"):
+            md_part = md_part[3:]
+        md_part = md_part.lstrip("-")
+    return {"json": j if isinstance(j, dict) else {}, "markdown": md_part.strip()}
 
 
 def json_profile_to_markdown(profile: Dict[str, Any]) -> str:
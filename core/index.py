@@ -1,40 +1,532 @@
-import os, json
+import os, sqlite3, threading
 import numpy as np
-from typing import List, Dict
-from sentence_transformers import SentenceTransformer
-import faiss
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+from .encoders import get_encoder
+from .embcache import encode_cached
+from .embedding import workers as _emb_workers
+from .ann import COMPRESSED_KINDS, build_index, search_params, index_kind as _kind_of
+from . import bm25 as _bm25
+from .utils import file_lock
+from .metrics import count, timed
 
+# Created on first write, not at import: read-only use never touches the disk.
+# faiss is imported where it's used, so importing this module stays cheap.
 STORAGE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage")
-os.makedirs(STORAGE, exist_ok=True)
-
-def build_faiss(docs: List[Dict], index_name: str, emb_model: str) -> str:
-    texts = [d["text"] for d in docs]
-    ids = [d["id"] for d in docs]
-    model = SentenceTransformer(emb_model)
-    embeds = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
-    dim = embeds.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(embeds)
-    path = os.path.join(STORAGE, f"{index_name}.index")
-    faiss.write_index(index, path)
-    meta = {"ids": ids, "texts": texts}
-    with open(os.path.join(STORAGE, f"{index_name}.meta.json"), "w", encoding="utf-8") as f:
-        json.dump(meta, f)
+
+# Memory-map indices on read instead of copying them into RAM (set to 0 to disable)
+USE_MMAP = os.getenv("PSYCHE_INDEX_MMAP", "1") != "0"
+# Compressed indices (core.ann.COMPRESSED_KINDS) fetch RESCORE x top_k candidates and
+# re-rank them by exact float32 scores (0/1 = use the approximate scores as they are)
+RESCORE = int(os.getenv("PSYCHE_INDEX_RESCORE", "4"))
+# Vectors a new index is trained on (IVF centroids, PQ/SQ codebooks), sampled from the whole corpus
+TRAIN_SAMPLE = int(os.getenv("PSYCHE_INDEX_TRAIN_SAMPLE", "50000"))
+
+# Opened (index, metadata db) handles keyed by index name, shared across
+# threads/sessions and invalidated when either file changes on disk.
+_handles: Dict[str, Dict] = {}
+_handles_lock = threading.Lock()
+# One lock per index name serializes its writers (add/remove/compact/swap) in this
+# process; writers to different indices run in parallel. Other processes are kept
+# out by the <name>.lock file (see below) and core.storage's build locks.
+_write_locks: Dict[str, threading.Lock] = {}
+_building = set()   # staging names of the build_faiss() calls in progress
+
+
+def _write_lock(index_name: str) -> threading.Lock:
+    with _handles_lock:
+        return _write_locks.setdefault(index_name, threading.Lock())
+
+# Layout per index name:
+#   <name>.index        faiss IndexIDMap2 over a flat/HNSW/IVF/IVF-PQ/scalar-quantized index (core.ann);
+#                       int64 ids are the `row` keys below
+#   <name>.meta.sqlite  one row per chunk: (row, id, source, ord, start, end, text);
+#                       search fetches only the top-k rows, never the whole corpus
+#   <name>.bm25.npz     sparse BM25 postings over the same rows (core.bm25)
+#   <name>.vectors.f32  compressed kinds only: the exact float32 vectors, row r at
+#                       position r - 1, memory-mapped and read only for re-scoring
+#                       (every new index spools its vectors here while it is built)
+#   <name>.lock         taken shared while a reader opens the files above and exclusive
+#                       while they are replaced, so a reader never pairs an old index
+#                       with new metadata (its mtime also records the last use)
+# Files are replaced atomically (written under a temporary name, then renamed), and
+# build_faiss() builds under a staging name and swaps the finished files in, so
+# searches keep using the previous version until the new one is complete.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    row INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE NOT NULL,
+    source TEXT NOT NULL DEFAULT '',
+    ord INTEGER,
+    start INTEGER,
+    end INTEGER,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks(source);
+"""
+_COLS = ("row", "id", "source", "ord", "start", "end", "text")
+
+
+def _paths(index_name: str):
+    return (os.path.join(STORAGE, f"{index_name}.index"),
+            os.path.join(STORAGE, f"{index_name}.meta.sqlite"))
+
+
+def _read_index(path: str, mmap: bool = USE_MMAP):
+    import faiss
+    if mmap:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            pass  # index type without mmap support
+    return faiss.read_index(path)
+
+
+def _vectors_path(index_name: str) -> str:
+    return os.path.join(STORAGE, f"{index_name}.vectors.f32")
+
+
+def _open_vectors(index_name: str, dim: int, max_row: int):
+    # None when there is no sidecar or it lacks rows (an index built before it existed)
+    path = _vectors_path(index_name)
+    try:
+        n = os.path.getsize(path) // (4 * dim)
+    except (FileNotFoundError, ZeroDivisionError):
+        return None
+    if not n or n < max_row:
+        return None
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(n, dim))
+
+
+def _write_vectors(f, start_row: int, vecs: np.ndarray) -> None:
+    # Rows are handed out consecutively, so this appends (gaps would read as zeros)
+    f.seek((start_row - 1) * vecs.shape[1] * 4)
+    f.write(np.ascontiguousarray(vecs, dtype=np.float32).tobytes())
+
+
+def _lock_path(index_name: str) -> str:
+    return os.path.join(STORAGE, f"{index_name}.lock")
+
+
+def _write_index(index, path: str) -> None:
+    import faiss
+    tmp = path + ".tmp"
+    faiss.write_index(index, tmp)
+    with file_lock(path[:-len(".index")] + ".lock"):
+        os.replace(tmp, path)
+
+
+def _file_sig(path: str):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _connect(meta_path: str, readonly: bool = False) -> sqlite3.Connection:
+    if readonly:
+        return sqlite3.connect(f"file:{meta_path}?mode=ro", uri=True, check_same_thread=False)
+    db = sqlite3.connect(meta_path)
+    db.executescript(_SCHEMA)
+    return db
+
+
+def open_index(index_name: str):
+    """Return the cached {"index", "db"} handle for `index_name`, or None if not built."""
+    idx_path, meta_path = _paths(index_name)
+    try:
+        sig = (_file_sig(idx_path), _file_sig(meta_path))
+    except FileNotFoundError:
+        return None
+    with _handles_lock:
+        h = _handles.get(index_name)
+        if h is not None and h["sig"] == sig:
+            return h
+        # A superseded handle is not closed here: searches already holding it finish on
+        # the old (renamed-over) files, and its connection closes when the last one drops it
+        with file_lock(_lock_path(index_name), shared=True):
+            try:
+                sig = (_file_sig(idx_path), _file_sig(meta_path))
+            except FileNotFoundError:   # dropped meanwhile
+                _handles.pop(index_name, None)
+                return None
+            db = _connect(meta_path, readonly=True)
+            index = _read_index(idx_path)
+            live, max_row = db.execute("SELECT COUNT(*), COALESCE(MAX(row), 0) FROM chunks").fetchone()
+            vectors = _open_vectors(index_name, index.d, max_row) if _kind_of(index) in COMPRESSED_KINDS else None
+            h = {"index": index, "db": db, "lock": threading.Lock(), "sig": sig, "live": live,
+                 "vectors": vectors}
+            os.utime(_lock_path(index_name))
+        _handles[index_name] = h
+        return h
+
+
+def close_index(index_name: str = None) -> None:
+    with _handles_lock:
+        for name in ([index_name] if index_name else list(_handles)):
+            h = _handles.pop(name, None)
+            if h is not None:
+                h["db"].close()
+
+
+def drop_index(index_name: str) -> None:
+    """Close `index_name` and delete every file stored under it (index, metadata, BM25, mentions...)."""
+    close_index(index_name)
+    _bm25.close(index_name)
+    with _write_lock(index_name):
+        if not os.path.isdir(STORAGE):
+            return
+        for n in os.listdir(STORAGE):
+            if n.startswith(index_name + "."):
+                if f"{index_name}.{n[len(index_name) + 1:].split('.')[0]}" in _building:
+                    continue   # a build of this index is still writing there
+                os.remove(os.path.join(STORAGE, n))
+
+
+def fetch_chunks(h: Dict, rows: List[int]) -> Dict[int, Dict]:
+    """Metadata + text for the given faiss ids only (missing/deleted rows are omitted)."""
+    if not rows:
+        return {}
+    q = f"SELECT {', '.join(_COLS)} FROM chunks WHERE row IN ({','.join('?' * len(rows))})"
+    with h["lock"]:
+        recs = h["db"].execute(q, [int(r) for r in rows]).fetchall()
+    return {r[0]: dict(zip(_COLS, r)) for r in recs}
+
+
+def iter_chunks(index_name: str, batch: int = 1000) -> Iterator[Dict]:
+    """Every live chunk of `index_name` in insertion (corpus) order, read `batch` rows at a time."""
+    h = open_index(index_name)
+    if h is None:
+        return
+    last = -1
+    while True:
+        with h["lock"]:
+            recs = h["db"].execute(f"SELECT {', '.join(_COLS)} FROM chunks WHERE row > ? ORDER BY row LIMIT ?",
+                                   (last, batch)).fetchall()
+        if not recs:
+            return
+        for r in recs:
+            yield dict(zip(_COLS, r))
+        last = recs[-1][0]
+
+
+def _load_for_write(index_name: str):
+    idx_path, meta_path = _paths(index_name)
+    if os.path.exists(idx_path) and os.path.exists(meta_path):
+        return _read_index(idx_path, mmap=False), _connect(meta_path)
+    return None, None
+
+
+def _index_from_spool(index_name: str, db: sqlite3.Connection, dim: int, block: int = 16384, **index_opts):
+    """
+    Create the index for a new `index_name` once all its vectors are spooled: the kind is
+    chosen from the real chunk count and trained on a sample of the whole corpus.
+    """
+    rows = np.array([r for (r,) in db.execute("SELECT row FROM chunks ORDER BY row")], dtype=np.int64)
+    path = _vectors_path(index_name)
+    if not len(rows):
+        return None
+    vectors = np.memmap(path, dtype=np.float32, mode="r", shape=(os.path.getsize(path) // (4 * dim), dim))
+    sample = rows
+    if len(rows) > TRAIN_SAMPLE:
+        sample = np.sort(np.random.default_rng(0).choice(rows, TRAIN_SAMPLE, replace=False))
+    index = build_index(np.ascontiguousarray(vectors[sample - 1]), n=len(rows), **index_opts)
+    for i in range(0, len(rows), block):
+        r = rows[i:i + block]
+        index.add_with_ids(np.ascontiguousarray(vectors[r - 1]), r)
+    del vectors
+    if _kind_of(index) not in COMPRESSED_KINDS:
+        os.remove(path)   # the index holds the float32 vectors itself
+    return index
+
+
+def _remove_rows(index, rows: List[int]) -> None:
+    if rows:
+        try:
+            index.remove_ids(np.array(rows, dtype=np.int64))
+        except RuntimeError:
+            pass  # HNSW can't delete: the vectors stay but their rows no longer resolve in search
+
+
+def _next_row(db: sqlite3.Connection) -> int:
+    # AUTOINCREMENT never hands out a row id twice, even after deletes
+    r = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'chunks'").fetchone()
+    return (r[0] if r else 0) + 1
+
+
+def _batches(chunks: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    batch = []
+    for c in chunks:
+        batch.append(c)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@timed()
+def add_stream(chunks: Iterable[Dict], index_name: str, emb_model: str, batch_size: int = 256,
+               index_kind: str = None, mem_budget_mb: float = None,
+               progress: Callable[[int], None] = None) -> int:
+    """
+    Upsert an iterable of chunks batch by batch: each batch is embedded, its metadata
+    committed and its vectors appended, so memory stays bounded by `batch_size`
+    whatever the corpus size. A new index spools its vectors to disk and is created
+    at the end (see _index_from_spool), so its kind and training see the whole corpus.
+    `progress(n_done)` is called after every batch. Returns the number of chunks written.
+    """
+    idx_path, meta_path = _paths(index_name)
+    total = dim = 0
+    index = db = vec_file = None
+    postings, replaced = _bm25.Postings(), []
+    with _write_lock(index_name):
+        try:
+            for batch in _batches(chunks, max(batch_size, 1)):
+                batch = list({d["id"]: d for d in batch}.values())
+                embeds = encode_cached(emb_model, [d["text"] for d in batch])
+                dim = embeds.shape[1]
+                if db is None:
+                    index, db = _load_for_write(index_name)
+                    if db is None:
+                        os.makedirs(STORAGE, exist_ok=True)
+                        db = _connect(meta_path)
+                        vec_file = open(_vectors_path(index_name), "wb")
+                    elif _kind_of(index) in COMPRESSED_KINDS and os.path.exists(_vectors_path(index_name)):
+                        # Exact vectors for re-scoring, unless the index was built without them
+                        vec_file = open(_vectors_path(index_name), "r+b")
+                with db:
+                    stale = []
+                    for d in batch:
+                        r = db.execute("SELECT row FROM chunks WHERE id = ?", (d["id"],)).fetchone()
+                        if r:
+                            stale.append(r[0])
+                    db.executemany("DELETE FROM chunks WHERE row = ?", [(r,) for r in stale])
+                    replaced.extend(stale)
+                    start = _next_row(db)
+                    db.executemany(
+                        "INSERT INTO chunks (row, id, source, ord, start, end, text) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(start + i, d["id"], d.get("source", ""), d.get("ord"), d.get("start"), d.get("end"), d["text"])
+                         for i, d in enumerate(batch)])
+                    if index is not None:
+                        _remove_rows(index, stale)
+                        index.add_with_ids(embeds, np.arange(start, start + len(batch), dtype=np.int64))
+                    if vec_file is not None:
+                        _write_vectors(vec_file, start, embeds)
+                postings.add((start + i, d["text"]) for i, d in enumerate(batch))
+                total += len(batch)
+                if progress:
+                    progress(total)
+            if vec_file is not None:
+                vec_file.close()   # before the index: readers never see rows it lacks
+                vec_file = None
+            # A chunk id repeated later in the stream replaced rows this stream wrote itself
+            postings = postings.without(replaced)
+            if index is None and db is not None:
+                index = _index_from_spool(index_name, db, dim, kind=index_kind, mem_budget_mb=mem_budget_mb)
+                _bm25.build_bm25(postings, index_name)
+            elif index is not None:
+                _bm25.update_bm25(index_name, postings, replaced)   # only this stream's rows
+            if index is not None:
+                _write_index(index, idx_path)
+        finally:
+            if vec_file is not None:
+                vec_file.close()
+            if db is not None:
+                db.close()
+    close_index(index_name)
+    count("chunks_indexed", total)
+    return total
+
+
+def add_documents(docs: List[Dict], index_name: str, emb_model: str,
+                  index_kind: str = None, mem_budget_mb: float = None) -> int:
+    """
+    Upsert chunks into `index_name`: only `docs` are embedded, and a chunk whose id
+    (e.g. "source#chunk0003") is already indexed replaces the previous version.
+    `index_kind` ("flat", "hnsw", "ivf", "ivfpq", "sq8", "fp16" or "auto") only applies when the
+    index is created. Returns the number of chunks written.
+    """
+    return add_stream(docs, index_name, emb_model, batch_size=len(docs),
+                      index_kind=index_kind, mem_budget_mb=mem_budget_mb)
+
+
+def remove_source(index_name: str, source: str) -> int:
+    """Delete every chunk that came from `source`; returns the number removed."""
+    idx_path, _ = _paths(index_name)
+    with _write_lock(index_name):
+        index, db = _load_for_write(index_name)
+        if index is None:
+            return 0
+        try:
+            with db:
+                rows = [r[0] for r in db.execute("SELECT row FROM chunks WHERE source = ?", (source,))]
+                if not rows:
+                    return 0
+                db.execute("DELETE FROM chunks WHERE source = ?", (source,))
+                _remove_rows(index, rows)
+                _write_index(index, idx_path)
+                _bm25.update_bm25(index_name, _bm25.Postings(), rows)
+        finally:
+            db.close()
+    close_index(index_name)
+    return len(rows)
+
+
+def compact(index_name: str, emb_model: str = None) -> None:
+    """
+    Reclaim space left by deleted chunks in the metadata store. With `emb_model`, the
+    vector index is also rebuilt from the live chunks (drops vectors an HNSW index
+    could not delete); embeddings come from the embedding cache.
+    """
+    idx_path, meta_path = _paths(index_name)
+    with _write_lock(index_name):
+        if not os.path.exists(meta_path):
+            return
+        db = _connect(meta_path)
+        try:
+            if emb_model and os.path.exists(idx_path):
+                recs = db.execute("SELECT row, text FROM chunks ORDER BY row").fetchall()
+                old = _read_index(idx_path, mmap=False)
+                if recs and old.ntotal > len(recs):
+                    vecs = encode_cached(emb_model, [t for _, t in recs])
+                    index = build_index(vecs, kind=_kind_of(old))
+                    index.add_with_ids(vecs, np.array([r for r, _ in recs], dtype=np.int64))
+                    _write_index(index, idx_path)
+            db.execute("VACUUM")
+        finally:
+            db.close()
+    close_index(index_name)
+
+
+def build_faiss(docs: Iterable[Dict], index_name: str, emb_model: str,
+                index_kind: str = None, mem_budget_mb: float = None,
+                batch_size: int = None, progress: Callable[[int], None] = None) -> str:
+    """
+    Full rebuild of `index_name` from `docs` (see add_documents for incremental updates).
+    The backend is picked from the corpus size unless `index_kind` is given. `docs`
+    may be a generator (e.g. core.preprocess.iter_chunks), consumed `batch_size` at a time.
+    """
+    path, _ = _paths(index_name)
+    staging = f"{index_name}.staging-{os.getpid()}-{threading.get_ident()}"
+    drop_index(staging)
+    with _handles_lock:
+        _building.add(staging)
+    if batch_size is None:
+        # Enough chunks per batch to keep every embedding worker busy (core.embedding)
+        batch_size = len(docs) if isinstance(docs, list) else 256 * _emb_workers()
+    try:
+        add_stream(docs, staging, emb_model, batch_size=batch_size,
+                   index_kind=index_kind, mem_budget_mb=mem_budget_mb, progress=progress)
+        _swap(staging, index_name)
+    finally:
+        with _handles_lock:
+            _building.discard(staging)
+        drop_index(staging)
+        with _handles_lock:
+            _write_locks.pop(staging, None)
     return path
 
-def search(query: str, index_name: str, emb_model: str, top_k: int = 5):
-    idx_path = os.path.join(STORAGE, f"{index_name}.index")
-    meta_path = os.path.join(STORAGE, f"{index_name}.meta.json")
-    if not (os.path.exists(idx_path) and os.path.exists(meta_path)):
+
+def _swap(staging: str, index_name: str) -> None:
+    # Readers hold the lock shared while opening, so they see all old or all new files
+    src = _paths(staging) + (_bm25.bm25_path(staging), _vectors_path(staging))
+    dst = _paths(index_name) + (_bm25.bm25_path(index_name), _vectors_path(index_name))
+    close_index(staging)
+    os.makedirs(STORAGE, exist_ok=True)
+    with _write_lock(index_name), file_lock(_lock_path(index_name)):
+        for a, b in zip(src, dst):
+            if os.path.exists(a):
+                os.replace(a, b)
+            elif os.path.exists(b):
+                os.remove(b)   # an empty build leaves no index behind, as before
+    with _handles_lock:
+        _handles.pop(index_name, None)   # next open_index() loads the new files; see there
+
+
+def encode_query(query: str, emb_model: str) -> np.ndarray:
+    return encode_queries([query], emb_model)
+
+
+@timed()
+def encode_queries(queries: List[str], emb_model: str) -> np.ndarray:
+    """Encode several queries in one batch -> (n, dim) normalized float32."""
+    model = get_encoder(emb_model)
+    return model.encode(list(queries), convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
+
+
+def _rescore(vectors: np.ndarray, Q: np.ndarray, idxs: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact inner products of each query with its candidate rows; the best `k` per query, best first."""
+    scores = np.full((len(Q), k), -np.inf, dtype=np.float32)
+    rows = np.full((len(Q), k), -1, dtype=np.int64)
+    for qi, (q, cand) in enumerate(zip(Q, idxs)):
+        cand = cand[(cand > 0) & (cand <= len(vectors))]
+        if not len(cand):
+            continue
+        uniq, inv = np.unique(cand, return_inverse=True)   # sorted reads from the memmap
+        exact = (vectors[uniq - 1] @ q)[inv]
+        best = np.argsort(-exact, kind="stable")[:k]
+        scores[qi, :len(best)], rows[qi, :len(best)] = exact[best], cand[best]
+    return scores, rows
+
+
+@timed()
+def search_rows_batch(Q: np.ndarray, index_name: str, top_k: int = 5, nprobe: int = None,
+                      ef_search: int = None, rescore: int = None) -> List[List[Tuple[int, float]]]:
+    """
+    (faiss row, score) of the top-k live chunks for each row of an encoded (n, dim) query
+    matrix. Compressed indices over-fetch `rescore` (default RESCORE) x k candidates and
+    return them re-ranked by their exact float32 scores.
+    """
+    h = open_index(index_name)
+    Q = np.asarray(Q, dtype=np.float32).reshape(-1, np.asarray(Q).shape[-1])
+    if h is None:
+        return [[] for _ in range(len(Q))]
+    index = h["index"]
+    params = search_params(index, nprobe=nprobe, ef_search=ef_search)
+    # Over-fetch by the number of orphaned vectors (deleted rows an HNSW index still holds)
+    k = top_k + max(0, index.ntotal - h["live"])
+    factor = RESCORE if rescore is None else rescore
+    if h["vectors"] is not None and factor > 1:
+        scores, idxs = index.search(Q, min(k * factor, max(index.ntotal, 1)), params=params)
+        scores, idxs = _rescore(h["vectors"], Q, idxs, k)
+        count("rescored_queries", len(Q))
+    else:
+        scores, idxs = index.search(Q, k, params=params)
+    return [[(int(i), float(s)) for s, i in zip(srow, irow) if i >= 0] for srow, irow in zip(scores, idxs)]
+
+
+@timed()
+def search_rows(q: np.ndarray, index_name: str, top_k: int = 5, nprobe: int = None,
+                ef_search: int = None, rescore: int = None) -> List[Tuple[int, float]]:
+    """(faiss row, score) of the top-k live chunks for an encoded (1, dim) query."""
+    return search_rows_batch(q, index_name, top_k, nprobe=nprobe, ef_search=ef_search, rescore=rescore)[0]
+
+
+@timed()
+def hits_for_rows(index_name: str, scored: List[Tuple[int, float]], top_k: int = None) -> List[Dict]:
+    """Hit dicts (id, text, score, source, ord, start, end) for (row, score) pairs, in order."""
+    h = open_index(index_name)
+    if h is None:
         return []
-    with open(meta_path, "r", encoding="utf-8") as f:
-        meta = json.load(f)
-    model = SentenceTransformer(emb_model)
-    q = model.encode([query], convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
-    index = faiss.read_index(idx_path)
-    scores, idxs = index.search(q, top_k)
+    meta = fetch_chunks(h, [r for r, _ in scored])
     out = []
-    for score, i in zip(scores[0], idxs[0]):
-        if i < 0: continue
-        out.append({"id": meta["ids"][i], "text": meta["texts"][i], "score": float(score)})
+    for i, score in scored:
+        if i not in meta or (top_k is not None and len(out) >= top_k): continue
+        m = meta[i]
+        out.append({"id": m["id"], "text": m["text"], "score": score, "source": m["source"],
+                    "ord": m["ord"], "start": m["start"], "end": m["end"]})
     return out
+
+
+def search_vector(q: np.ndarray, index_name: str, top_k: int = 5,
+                  nprobe: int = None, ef_search: int = None):
+    """Search with an already-encoded (1, dim) query vector."""
+    scored = search_rows(q, index_name, top_k, nprobe=nprobe, ef_search=ef_search)
+    return hits_for_rows(index_name, scored, top_k)
+
+
+def search(query: str, index_name: str, emb_model: str, top_k: int = 5,
+           nprobe: int = None, ef_search: int = None):
+    """Top-k chunks for `query`; `nprobe`/`ef_search` tune IVF/HNSW indices (ignored for flat)."""
+    if open_index(index_name) is None:
+        return []
+    return search_vector(encode_query(query, emb_model), index_name, top_k,
+                         nprobe=nprobe, ef_search=ef_search)
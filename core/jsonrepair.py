@@ -0,0 +1,195 @@
+import re
+from typing import Any, Dict, Optional, Tuple
+
+# Tolerant JSON reader for LLM answers, in one left-to-right scan. Besides strict
+# JSON it accepts what models commonly get wrong: prose or ``` fences around the
+# object, // and /* */ comments, trailing or missing commas, single-quoted
+# strings, unquoted keys, raw newlines and unescaped quotes inside strings,
+# Python literals (True/False/None) and output cut off before the closing braces.
+_NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_BARE = re.compile(r"[^\s,:{}\[\]\"']+")
+_LITERALS = {"true": True, "false": False, "null": None, "none": None, "nan": None}
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "/": "/", "\\": "\\", '"': '"', "'": "'"}
+_MISSING = object()
+# After a closing quote: the next member's `"key":` (a missing comma, even on the same line)
+_NEXT_KEY = re.compile(r"""\s*(["'])[^"'\n]*\1\s*[:=]""")
+
+
+class _Reader:
+    def __init__(self, text: str, pos: int = 0):
+        self.s, self.i, self.n = text, pos, len(text)
+
+    def ws(self) -> None:
+        s, n = self.s, self.n
+        while self.i < n:
+            c = s[self.i]
+            if c.isspace():
+                self.i += 1
+            elif s.startswith("//", self.i):
+                nl = s.find("\n", self.i)
+                self.i = n if nl < 0 else nl + 1
+            elif s.startswith("/*", self.i):
+                end = s.find("*/", self.i + 2)
+                self.i = n if end < 0 else end + 2
+            else:
+                return
+
+    def value(self) -> Any:
+        self.ws()
+        if self.i >= self.n:
+            return _MISSING
+        c = self.s[self.i]
+        if c == "{":
+            return self.obj()
+        if c == "[":
+            return self.arr()
+        if c in "\"'":
+            return self.string(c)
+        m = _NUMBER.match(self.s, self.i)
+        if m and (m.end() >= self.n or not (self.s[m.end()].isalnum() or self.s[m.end()] == "_")):
+            self.i = m.end()
+            text = m.group(0).lstrip("+")
+            return float(text) if any(ch in text for ch in ".eE") else int(text)
+        m = _BARE.match(self.s, self.i)
+        if not m:
+            self.i += 1  # stray delimiter
+            return _MISSING
+        self.i = m.end()
+        word = m.group(0)
+        if word.lower() in _LITERALS:
+            return _LITERALS[word.lower()]
+        return self._bare_tail(word)
+
+    def _bare_tail(self, word: str) -> str:
+        # Unquoted text value: extend over spaces up to the next structural character
+        s, start = self.s, self.i - len(word)
+        while self.i < self.n and s[self.i] not in ",}]\n":
+            self.i += 1
+        return s[start:self.i].strip()
+
+    def string(self, quote: str) -> str:
+        s, n = self.s, self.n
+        self.i += 1
+        out = []
+        while self.i < n:
+            c = s[self.i]
+            if c == "\\" and self.i + 1 < n:
+                e = s[self.i + 1]
+                if e == "u" and self.i + 6 <= n:
+                    try:
+                        code = int(s[self.i + 2:self.i + 6], 16)
+                    except ValueError:
+                        code = None
+                    if code is not None:
+                        self.i += 6
+                        out.append(self._surrogate(code) if 0xD800 <= code <= 0xDFFF else chr(code))
+                        continue
+                out.append(_ESCAPES.get(e, e))
+                self.i += 2
+                continue
+            if c == quote:
+                # A quote only closes the string if what follows is structural;
+                # otherwise it is an unescaped quote inside the text
+                j = self.i + 1
+                while j < n and s[j] in " \t\r":
+                    j += 1
+                if j >= n or s[j] in ",:}]\n" or _NEXT_KEY.match(s, self.i + 1):
+                    self.i += 1
+                    return "".join(out)
+            out.append(c)
+            self.i += 1
+        return "".join(out)   # cut off inside the string
+
+    def _surrogate(self, code: int) -> str:
+        # \ud83e\udd8a is one character (an emoji as UTF-16): join a high surrogate with the
+        # low one escaped right after it; unpaired halves can't be encoded, so they become U+FFFD
+        s = self.s
+        if code <= 0xDBFF and s.startswith("\\u", self.i) and self.i + 6 <= self.n:
+            try:
+                low = int(s[self.i + 2:self.i + 6], 16)
+            except ValueError:
+                low = 0
+            if 0xDC00 <= low <= 0xDFFF:
+                self.i += 6
+                return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00))
+        return "\ufffd"
+
+    def boundary(self) -> bool:
+        # A fence or --- line where a member was expected: the object was never closed
+        return self.s.startswith(("```", "---"), self.i)
+
+    def key(self) -> Optional[str]:
+        c = self.s[self.i]
+        if c in "\"'":
+            return self.string(c)
+        j = self.i
+        while j < self.n and self.s[j] not in ":,{}[]\n":
+            j += 1
+        k = self.s[self.i:j].strip()
+        self.i = j
+        return k or None
+
+    def obj(self) -> Dict:
+        self.i += 1
+        out: Dict = {}
+        while True:
+            self.ws()
+            if self.i >= self.n:
+                return out
+            c = self.s[self.i]
+            if c == "}":
+                self.i += 1
+                return out
+            if c == ",":
+                self.i += 1
+                continue
+            if c == "]":
+                self.i += 1   # mismatched bracket
+                return out
+            if self.boundary():
+                return out
+            k = self.key()
+            self.ws()
+            if self.i < self.n and self.s[self.i] in ":=":
+                self.i += 1
+            v = self.value()
+            if k is not None and v is not _MISSING:
+                out[k] = v
+
+    def arr(self) -> list:
+        self.i += 1
+        out = []
+        while True:
+            self.ws()
+            if self.i >= self.n:
+                return out
+            c = self.s[self.i]
+            if c == "]":
+                self.i += 1
+                return out
+            if c == ",":
+                self.i += 1
+                continue
+            if c == "}":
+                self.i += 1
+                return out
+            if self.boundary():
+                return out
+            v = self.value()
+            if v is not _MISSING:
+                out.append(v)
+
+
+def loads(text: str) -> Any:
+    """Tolerant json.loads(): the first JSON value in `text`, repaired; None if there is none."""
+    v = _Reader(text).value()
+    return None if v is _MISSING else v
+
+
+def parse_object(text: str) -> Tuple[Dict, int]:
+    """(first {...} object in `text`, offset just past it); ({}, -1) without an object."""
+    start = text.find("{")
+    if start < 0:
+        return {}, -1
+    r = _Reader(text, start)
+    return r.obj(), r.i
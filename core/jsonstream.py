@@ -0,0 +1,98 @@
+from typing import Any, Dict, List, Tuple
+from .jsonrepair import loads
+
+# Incremental parser for streamed "JSON, ---, Markdown" answers. Token deltas are
+# scanned once; each top-level JSON field is decoded as soon as the comma or brace
+# closing it arrives, and everything after the object is streamed as Markdown.
+
+
+def _decode_field(segment: str) -> Dict[str, Any]:
+    """Decode one `"key": value` member with the tolerant reader (core.jsonrepair)."""
+    out = loads("{" + segment + "}")
+    return out if isinstance(out, dict) else {}
+
+
+class ProfileStream:
+    """
+    Feed text deltas with feed(); it returns the (key, value) pairs of the top-level
+    JSON fields completed by that delta. `fields` holds every field so far, `markdown`
+    the Markdown received after the object (and the --- separator), and `text` the
+    raw answer for a final extract_json_then_md() pass.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.markdown = ""
+        self.phase = "pre"        # pre -> json -> post -> md
+        self._pos = 0             # next unscanned offset in text
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._member = 0          # start of the current top-level member
+        self._line = 0            # start of the current line after the object
+
+    @property
+    def json_done(self) -> bool:
+        return self.phase in ("post", "md")
+
+    def feed(self, delta: str) -> List[Tuple[str, Any]]:
+        self.text += delta
+        done: List[Tuple[str, Any]] = []
+        text, i = self.text, self._pos
+        while i < len(text) and self.phase in ("pre", "json"):
+            c = text[i]
+            if self.phase == "pre":
+                if c == "{":
+                    self.phase, self._depth, self._member = "json", 1, i + 1
+            elif self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+            elif c == '"':
+                self._in_str = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    done += self._close_member(text[self._member:i])
+                    self.phase, self._line = "post", i + 1
+            elif c == "," and self._depth == 1:
+                done += self._close_member(text[self._member:i])
+                self._member = i + 1
+            i += 1
+        self._pos = i
+        if self.phase == "post":
+            self._skip_separator()
+        if self.phase == "md":
+            self.markdown = text[self._line:].lstrip("\n")
+        return done
+
+    def _close_member(self, segment: str) -> List[Tuple[str, Any]]:
+        if not segment.strip():
+            return []
+        new = _decode_field(segment)
+        self.fields.update(new)
+        return list(new.items())
+
+    def _skip_separator(self) -> None:
+        # Between the object and the Markdown: blank lines, closing ``` fences and the
+        # --- separator are skipped a whole line at a time; the first other line starts
+        # the Markdown (also when the model leaves out the separator)
+        text = self.text
+        while True:
+            nl = text.find("\n", self._line)
+            line = text[self._line:] if nl < 0 else text[self._line:nl]
+            if line.strip() in ("", "---", "```"):
+                if nl < 0:
+                    return
+                self._line = nl + 1
+                continue
+            if nl < 0 and len(line.strip()) < 3 and set(line.strip()) <= set("-`"):
+                return  # could still become a separator or fence
+            self.phase = "md"
+            return
@@ -0,0 +1,367 @@
+import json, os, random, threading, time
+from typing import Dict, Iterator, List
+from .metrics import count
+
+# Long-lived LLM clients: one per (backend, model, endpoint) per process, with
+# pooled connections, a concurrency cap, token-bucket rate limiting and
+# exponential-backoff retries. Backends are pluggable: "hf" (Hugging Face
+# InferenceClient) or "http" (any OpenAI-compatible /v1/chat/completions server,
+# e.g. TGI, vLLM or bench/llm_stub.py). Backend SDKs and asyncio are imported
+# on first use.
+BACKEND = os.getenv("PSYCHE_LLM_BACKEND", "hf")
+BASE_URL = os.getenv("PSYCHE_LLM_BASE_URL", "")
+CONCURRENCY = int(os.getenv("PSYCHE_LLM_CONCURRENCY", "4"))
+RATE_PER_SEC = float(os.getenv("PSYCHE_LLM_RPS", "0"))   # 0 = unlimited
+MAX_RETRIES = int(os.getenv("PSYCHE_LLM_RETRIES", "4"))
+TIMEOUT = float(os.getenv("PSYCHE_LLM_TIMEOUT", "120"))
+
+SYSTEM_PROMPT = (
+    "You are an expert psychologist. Follow the instructions precisely. "
+    "Return output in TWO parts: "
+    "(1) a valid JSON strictly following the provided schema; "
+    "(2) then the line --- on its own line; "
+    "(3) then a concise Markdown summary with citations (chunk_id)."
+)
+
+
+class RetryableError(RuntimeError):
+    """Transient failure (rate limited, 5xx, timeout, connection reset): worth retrying."""
+
+
+def _messages(prompt: str):
+    return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+
+
+def _content(choice) -> str:
+    # Different providers return different structures
+    if hasattr(choice, "message") and isinstance(choice.message, dict):
+        content = choice.message.get("content", "")
+    elif hasattr(choice, "message") and hasattr(choice.message, "content"):
+        content = choice.message.content
+    elif isinstance(choice, dict) and "message" in choice:
+        msg = choice["message"]
+        content = msg.get("content", "") if isinstance(msg, dict) else str(msg)
+    else:
+        content = str(choice)
+    if isinstance(content, list):  # some providers return a list of parts
+        return "".join([part.get("text", "") if isinstance(part, dict) else str(part) for part in content])
+    return content or ""
+
+
+def _delta(chunk) -> str:
+    # Streamed chat chunk -> text delta (object or dict, depending on the provider)
+    choice = chunk["choices"][0] if isinstance(chunk, dict) else chunk.choices[0]
+    delta = choice["delta"] if isinstance(choice, dict) else choice.delta
+    content = delta.get("content") if isinstance(delta, dict) else getattr(delta, "content", None)
+    return content or ""
+
+
+class Backend:
+    """Interface for LLM backends: one blocking completion per call."""
+    name = "base"
+
+    def complete(self, prompt: str, temperature: float = 0.2, max_new_tokens: int = 800, top_p: float = 0.95) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, temperature: float = 0.2, max_new_tokens: int = 800,
+               top_p: float = 0.95) -> Iterator[str]:
+        """Text deltas as they are generated; backends without streaming yield one delta."""
+        yield self.complete(prompt, temperature=temperature, max_new_tokens=max_new_tokens, top_p=top_p)
+
+
+class HFBackend(Backend):
+    """Hugging Face InferenceClient: chat_completion(), falling back to text_generation()."""
+    name = "hf"
+
+    def __init__(self, model: str, token: str = None):
+        from huggingface_hub import InferenceClient
+        token = (token or os.getenv("HF_API_TOKEN", "")).strip()
+        if not token:
+            raise RuntimeError("HF_API_TOKEN not set")
+        self.model = model
+        self.client = InferenceClient(model=model, token=token, timeout=TIMEOUT)
+
+    @staticmethod
+    def _retryable(e: Exception) -> bool:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+        return status in (408, 429) or (status is not None and status >= 500)
+
+    def complete(self, prompt, temperature=0.2, max_new_tokens=800, top_p=0.95):
+        from huggingface_hub.errors import HfHubHTTPError
+        import requests
+        try:
+            try:
+                resp = self.client.chat_completion(messages=_messages(prompt), max_tokens=max_new_tokens,
+                                                   temperature=temperature, top_p=top_p, stream=False)
+                return _content(resp.choices[0])
+            except HfHubHTTPError as e_chat:
+                if self._retryable(e_chat):
+                    raise
+                # Models without the 'conversational' task (e.g. Mistral, Zephyr)
+                try:
+                    return self.client.text_generation(prompt, max_new_tokens=max_new_tokens,
+                                                       temperature=temperature, top_p=top_p, stream=False)
+                except HfHubHTTPError as e_txt:
+                    if self._retryable(e_txt):
+                        raise
+                    raise RuntimeError(f"Hugging Face inference error (chat/text): {e_chat} / {e_txt}") from e_txt
+        except HfHubHTTPError as e:
+            raise RetryableError(str(e)) from e
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise RetryableError(str(e)) from e
+
+    def stream(self, prompt, temperature=0.2, max_new_tokens=800, top_p=0.95):
+        from huggingface_hub.errors import HfHubHTTPError
+        import requests
+        try:
+            try:
+                parts = self.client.chat_completion(messages=_messages(prompt), max_tokens=max_new_tokens,
+                                                    temperature=temperature, top_p=top_p, stream=True)
+                first = next(parts, None)
+            except HfHubHTTPError as e_chat:
+                if self._retryable(e_chat):
+                    raise
+                parts = self.client.text_generation(prompt, max_new_tokens=max_new_tokens,
+                                                    temperature=temperature, top_p=top_p, stream=True)
+                first = None
+        except HfHubHTTPError as e:
+            raise RetryableError(str(e)) from e
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise RetryableError(str(e)) from e
+        if first is not None:
+            yield _delta(first)
+        for part in parts:
+            yield part if isinstance(part, str) else _delta(part)
+
+
+class HTTPBackend(Backend):
+    """OpenAI-compatible chat endpoint over a pooled requests.Session."""
+    name = "http"
+
+    def __init__(self, model: str, base_url: str, token: str = None, pool_size: int = CONCURRENCY):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.model = model
+        self.url = base_url.rstrip("/") + "/v1/chat/completions"
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1)))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1)))
+        token = token or os.getenv("HF_API_TOKEN", "")
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token.strip()}"
+
+    def complete(self, prompt, temperature=0.2, max_new_tokens=800, top_p=0.95):
+        import requests
+        body = {"model": self.model, "messages": _messages(prompt), "max_tokens": max_new_tokens,
+                "temperature": temperature, "top_p": top_p, "stream": False}
+        try:
+            r = self.session.post(self.url, json=body, timeout=TIMEOUT)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise RetryableError(str(e)) from e
+        if r.status_code in (408, 429) or r.status_code >= 500:
+            raise RetryableError(f"HTTP {r.status_code}: {r.text[:200]}")
+        if r.status_code >= 400:
+            raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+        return _content(r.json()["choices"][0])
+
+    def stream(self, prompt, temperature=0.2, max_new_tokens=800, top_p=0.95):
+        import requests
+        body = {"model": self.model, "messages": _messages(prompt), "max_tokens": max_new_tokens,
+                "temperature": temperature, "top_p": top_p, "stream": True}
+        try:
+            r = self.session.post(self.url, json=body, timeout=TIMEOUT, stream=True)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise RetryableError(str(e)) from e
+        with r:
+            if r.status_code in (408, 429) or r.status_code >= 500:
+                raise RetryableError(f"HTTP {r.status_code}: {r.text[:200]}")
+            if r.status_code >= 400:
+                raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+            # Server-sent events: "data: {chunk}" lines, terminated by "data: [DONE]"
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                yield _delta(json.loads(data))
+
+
+BACKENDS = {"hf": HFBackend, "http": HTTPBackend}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests/second with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Take a token if available; otherwise return the seconds to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> None:
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self) -> None:
+        import asyncio
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class LLMClient:
+    """Concurrency-capped, rate-limited, retrying front end for a Backend (sync and asyncio)."""
+
+    def __init__(self, backend: Backend, max_concurrency: int = CONCURRENCY, rate_per_sec: float = RATE_PER_SEC,
+                 max_retries: int = MAX_RETRIES, backoff_base: float = 0.5, backoff_max: float = 8.0):
+        self.backend = backend
+        self.max_concurrency = max(max_concurrency, 1)
+        self.bucket = TokenBucket(rate_per_sec) if rate_per_sec > 0 else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._sem = threading.BoundedSemaphore(self.max_concurrency)
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "seconds": 0.0}
+
+    def _backoff(self, attempt: int) -> float:
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _count(self, key: str, value=1) -> None:
+        with self._stats_lock:
+            self.stats[key] += value
+        count(f"llm_{key}", value)
+
+    def complete(self, prompt: str, **params) -> str:
+        for attempt in range(self.max_retries + 1):
+            if self.bucket:
+                self.bucket.acquire()
+            t0 = time.perf_counter()
+            try:
+                with self._sem:
+                    self._count("requests")
+                    return self.backend.complete(prompt, **params)
+            except RetryableError:
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                time.sleep(self._backoff(attempt))
+            except Exception:
+                self._count("failures")
+                raise
+            finally:
+                self._count("seconds", time.perf_counter() - t0)
+
+    async def acomplete(self, prompt: str, **params) -> str:
+        """asyncio variant; shares the concurrency cap and rate limit with complete()."""
+        import asyncio
+        for attempt in range(self.max_retries + 1):
+            if self.bucket:
+                await self.bucket.aacquire()
+            t0 = time.perf_counter()
+            try:
+                # Blocking backends run in worker threads; the semaphore is taken there
+                # so sync and async callers share one concurrency cap
+                return await asyncio.to_thread(self._once, prompt, params)
+            except RetryableError:
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                await asyncio.sleep(self._backoff(attempt))
+            except Exception:
+                self._count("failures")
+                raise
+            finally:
+                self._count("seconds", time.perf_counter() - t0)
+
+    def stream(self, prompt: str, **params) -> Iterator[str]:
+        """
+        Text deltas from the backend. Failures before the first delta are retried like
+        complete(); once text has been yielded, errors propagate to the caller.
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.bucket:
+                self.bucket.acquire()
+            t0 = time.perf_counter()
+            started = False
+            try:
+                with self._sem:
+                    self._count("requests")
+                    for delta in self.backend.stream(prompt, **params):
+                        started = True
+                        yield delta
+                return
+            except RetryableError:
+                if started or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                time.sleep(self._backoff(attempt))
+            except GeneratorExit:
+                raise
+            except Exception:
+                self._count("failures")
+                raise
+            finally:
+                self._count("seconds", time.perf_counter() - t0)
+
+    def _once(self, prompt: str, params: Dict) -> str:
+        with self._sem:
+            self._count("requests")
+            return self.backend.complete(prompt, **params)
+
+    async def acomplete_many(self, prompts: List[str], return_exceptions: bool = False, **params) -> List:
+        import asyncio
+        return await asyncio.gather(*(self.acomplete(p, **params) for p in prompts),
+                                    return_exceptions=return_exceptions)
+
+    def complete_many(self, prompts: List[str], return_exceptions: bool = False, **params) -> List:
+        """Dispatch `prompts` concurrently (bounded by max_concurrency) from synchronous code."""
+        import asyncio
+        return asyncio.run(self.acomplete_many(prompts, return_exceptions=return_exceptions, **params))
+
+
+_clients: Dict[tuple, LLMClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(model: str, backend: str = None, base_url: str = None, **client_opts) -> LLMClient:
+    """Shared client for (backend, model, endpoint); created on first use and reused afterwards."""
+    backend = backend or BACKEND
+    base_url = base_url or BASE_URL
+    key = (backend, model, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            if backend not in BACKENDS:
+                raise ValueError(f"Unknown LLM backend: {backend} (expected one of {sorted(BACKENDS)})")
+            impl = HTTPBackend(model, base_url) if backend == "http" else BACKENDS[backend](model)
+            client = LLMClient(impl, **client_opts)
+            _clients[key] = client
+        return client
+
+
+def llm_stats() -> Dict[str, Dict]:
+    with _clients_lock:
+        return {f"{b}:{m}": dict(c.stats) for (b, m, _), c in _clients.items()}
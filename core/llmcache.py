@@ -0,0 +1,154 @@
+import os, json, hashlib, sqlite3, threading, time
+from typing import Dict, Optional
+from .metrics import count
+
+# Persistent LLM response cache: one SQLite row per request, keyed by a hash of
+# (prompt, model, temperature, max_new_tokens, top_p), holding the raw answer and,
+# once parsed, its {"json", "markdown"} so a repeated request skips both inference
+# and parsing. Entries expire after TTL seconds; past MAX_MB the least recently
+# used are dropped.
+CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage", "llmcache.sqlite")
+ENABLED = os.getenv("PSYCHE_LLM_CACHE", "1") != "0"
+TTL = float(os.getenv("PSYCHE_LLM_CACHE_TTL", str(7 * 24 * 3600)))   # 0 = never expire
+MAX_MB = float(os.getenv("PSYCHE_LLM_CACHE_MAX_MB", "64"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    text TEXT NOT NULL,
+    parsed TEXT,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed);
+"""
+
+_lock = threading.Lock()
+_db: Dict[str, sqlite3.Connection] = {}
+_stats = {"hits": 0, "misses": 0, "parsed_hits": 0, "expired": 0, "evictions": 0, "writes": 0}
+
+
+def response_key(prompt: str, model: str, temperature: float = 0.2, max_new_tokens: int = 800,
+                 top_p: float = 0.95) -> str:
+    payload = json.dumps([prompt, model, float(temperature), int(max_new_tokens), float(top_p)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _conn() -> sqlite3.Connection:
+    # Called with _lock held; reopened if CACHE_PATH is redirected
+    con = _db.get(CACHE_PATH)
+    if con is None:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        con = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.executescript(_SCHEMA)
+        _db.clear()
+        _db[CACHE_PATH] = con
+    return con
+
+
+def _get(key: str) -> Optional[tuple]:
+    con = _conn()
+    rec = con.execute("SELECT text, parsed, created FROM responses WHERE key = ?", (key,)).fetchone()
+    if rec is None:
+        return None
+    if TTL and time.time() - rec[2] > TTL:
+        con.execute("DELETE FROM responses WHERE key = ?", (key,))
+        con.commit()
+        _stats["expired"] += 1
+        return None
+    con.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+    con.commit()
+    return rec
+
+
+def get_response(key: str) -> Optional[str]:
+    """Cached raw answer for `key`, or None (also when disabled or expired)."""
+    if not ENABLED:
+        return None
+    with _lock:
+        rec = _get(key)
+        _stats["hits" if rec else "misses"] += 1
+        count("llm_cache_hits" if rec else "llm_cache_misses")
+        return rec[0] if rec else None
+
+
+def get_parsed(key: str) -> Optional[Dict]:
+    """Cached {"json", "markdown"} for `key`, or None."""
+    if not ENABLED:
+        return None
+    with _lock:
+        rec = _get(key)
+        if rec is None or rec[1] is None:
+            return None
+        _stats["parsed_hits"] += 1
+        return json.loads(rec[1])
+
+
+def put_response(key: str, model: str, text: str) -> None:
+    if not ENABLED:
+        return
+    now = time.time()
+    with _lock:
+        con = _conn()
+        con.execute("INSERT OR REPLACE INTO responses (key, model, text, parsed, size, created, accessed) "
+                    "VALUES (?, ?, ?, NULL, ?, ?, ?)", (key, model, text, len(text.encode("utf-8")), now, now))
+        _stats["writes"] += 1
+        _evict(con)
+        con.commit()
+
+
+def put_parsed(key: str, parsed: Dict, model: str = None, text: str = None) -> None:
+    """Attach the parsed profile to a cached answer (stored first from `model`/`text` if absent)."""
+    if not ENABLED:
+        return
+    data = json.dumps(parsed, ensure_ascii=False)
+    now = time.time()
+    with _lock:
+        con = _conn()
+        if text is not None:
+            con.execute("INSERT OR IGNORE INTO responses (key, model, text, parsed, size, created, accessed) "
+                        "VALUES (?, ?, ?, NULL, ?, ?, ?)", (key, model or "", text, len(text.encode("utf-8")), now, now))
+        con.execute("UPDATE responses SET parsed = ?, size = length(CAST(text AS BLOB)) + ? WHERE key = ?",
+                    (data, len(data.encode("utf-8")), key))
+        _evict(con)
+        con.commit()
+
+
+def _evict(con: sqlite3.Connection) -> None:
+    if TTL:
+        cur = con.execute("DELETE FROM responses WHERE created < ?", (time.time() - TTL,))
+        _stats["expired"] += cur.rowcount
+    limit = int(MAX_MB * 1024 * 1024)
+    total = con.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total <= limit:
+        return
+    # Drop least recently used entries down to 80% of the budget
+    drop, freed = [], 0
+    for key, size in con.execute("SELECT key, size FROM responses ORDER BY accessed"):
+        if total - freed <= limit * 0.8:
+            break
+        drop.append((key,))
+        freed += size
+    con.executemany("DELETE FROM responses WHERE key = ?", drop)
+    _stats["evictions"] += len(drop)
+
+
+def clear() -> None:
+    with _lock:
+        con = _conn()
+        con.execute("DELETE FROM responses")
+        con.commit()
+        con.execute("VACUUM")
+
+
+def cache_stats() -> Dict:
+    with _lock:
+        entries, size = (0, 0)
+        if ENABLED:
+            entries, size = _conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        total = _stats["hits"] + _stats["misses"]
+        return dict(_stats, entries=entries, bytes=size, enabled=ENABLED,
+                    hit_rate=round(_stats["hits"] / total, 4) if total else 0.0)
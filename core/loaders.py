@@ -1,7 +1,11 @@
-import os
-from typing import List, Dict
+import codecs, os
+from typing import Callable, Iterator, List, Dict
 from .utils import normalize_text
+from .metrics import timed
 
+BLOCK_SIZE = 1 << 16
+
+@timed()
 def load_text_files(paths: List[str]) -> List[Dict]:
     docs = []
     for path in paths:
@@ -11,3 +15,29 @@ def load_text_files(paths: List[str]) -> List[Dict]:
             text = f.read()
         docs.append({"source": os.path.basename(path), "text": normalize_text(text)})
     return docs
+
+@timed()
+def iter_text(src, block_size: int = BLOCK_SIZE, progress: Callable[[int], None] = None) -> Iterator[str]:
+    """
+    Decode a file (path or binary file object, read from the start) block by block,
+    so only `block_size` bytes are held at once. `progress(bytes_read)` is called per block.
+    """
+    f = open(src, "rb") if isinstance(src, (str, os.PathLike)) else src
+    try:
+        if hasattr(f, "seek"):
+            f.seek(0)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        done = 0
+        while True:
+            raw = f.read(block_size)
+            done += len(raw)
+            text = decoder.decode(raw, final=not raw)
+            if text:
+                yield text
+            if progress:
+                progress(done)
+            if not raw:
+                break
+    finally:
+        if f is not src:
+            f.close()
@@ -0,0 +1,265 @@
+import json, os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+from . import index as _index
+from .generation import generate_profile, json_profile_to_markdown, template_fallback, validate_profile
+from .index import iter_chunks
+from .metrics import count, timed
+from .packing import prompt_token_counter
+from .prompts import build_prompt, partition_context
+from .utils import fingerprint
+
+# Map-reduce profiling for corpora larger than one prompt. The entity's evidence
+# (every indexed chunk that mentions it, in corpus order) is cut into partitions of
+# about one prompt's worth of tokens: per source file ("section") or as consecutive
+# windows over the whole corpus ("time"). Each partition gets its own partial
+# profile (map, on a bounded thread pool) and the partials are merged into one
+# profile (reduce_profiles). Finished partitions are checkpointed on disk under
+# <storage>/mapreduce/, so after a failure only the missing partitions are generated.
+WORKERS = int(os.getenv("PSYCHE_MR_WORKERS", "4"))
+PSYCH_SHARE = 0.3        # of each map prompt's budget, as in build_prompt()
+MAX_ITEMS = 12           # per list field of the merged profile
+MAX_QUOTES = 12
+
+
+def partition_evidence(chunks: Iterable[Dict], max_tokens: int, count_tokens: Callable[[Sequence[str]], Sequence[int]],
+                       by: str = "section") -> List[Dict]:
+    """
+    Consecutive runs of `chunks` of at most `max_tokens` each (a longer chunk gets a run
+    of its own): [{"label", "chunks", "tokens", "digest"}] in corpus order. With
+    by="section" a partition never spans two sources; with by="time" it may.
+    """
+    if by not in ("section", "time"):
+        raise ValueError(f"unknown partitioning {by!r} (section, time)")
+    chunks = list(chunks)
+    counts = count_tokens([c["text"] for c in chunks]) if chunks else []
+    parts, cur, used = [], [], 0
+
+    def close():
+        if cur:
+            parts.append({"label": _label(cur), "chunks": list(cur), "tokens": used,
+                          "digest": fingerprint([(c["id"], c["text"]) for c in cur])})
+
+    for c, n in zip(chunks, counts):
+        n = int(n)
+        if cur and (used + n > max_tokens or (by == "section" and c["source"] != cur[-1]["source"])):
+            close()
+            cur, used = [], 0
+        cur.append(c)
+        used += n
+    close()
+    return parts
+
+
+def _label(chunks: List[Dict]) -> str:
+    a, b = chunks[0], chunks[-1]
+    if a["source"] == b["source"] and a.get("ord") is not None and b.get("ord") is not None:
+        return f"{a['source']} #{a['ord']}–{b['ord']}"
+    return f"{a['id']} – {b['id']}"
+
+
+def _checkpoint_path(key: str) -> str:
+    return os.path.join(_index.STORAGE, "mapreduce", f"{key}.json")
+
+
+def load_checkpoint(key: str) -> Dict[str, Dict]:
+    """Partition digest -> finished partial result for run `key` ({} if none)."""
+    try:
+        with open(_checkpoint_path(key), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_checkpoint(key: str, done: Dict[str, Dict]) -> None:
+    path = _checkpoint_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(done, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _norm(s) -> str:
+    return " ".join(str(s).split()).casefold()
+
+
+def _score(x) -> Optional[float]:
+    try:
+        x = float(x)
+    except (TypeError, ValueError):
+        return None
+    return x if 0.0 <= x <= 1.0 else None
+
+
+def _weighted_mean(pairs) -> Optional[float]:
+    pairs = [(v, w) for v, w in pairs if v is not None]
+    total = sum(w for _, w in pairs)
+    return round(sum(v * w for v, w in pairs) / total, 3) if total else None
+
+
+def _ranked_union(partials: List[Dict], field: str, limit: int = MAX_ITEMS) -> list:
+    # Items in every partial, deduplicated case-insensitively, by total evidence weight
+    # (ties keep the order they first appear in the corpus)
+    weight, first = {}, {}
+    for p in partials:
+        for item in p["json"].get(field) or []:
+            if isinstance(item, str) and item.strip():
+                k = _norm(item)
+                weight[k] = weight.get(k, 0.0) + p["weight"]
+                first.setdefault(k, item.strip())
+    return [first[k] for k in sorted(weight, key=lambda k: -weight[k])[:limit]]
+
+
+def _quotes(partials: List[Dict], limit: int = MAX_QUOTES) -> list:
+    # Round-robin over the partitions so every part of the corpus is cited, then back in corpus order
+    queues, seen, picked = [], set(), []
+    for i, p in enumerate(partials):
+        qs = [q for q in p["json"].get("supporting_quotes") or [] if isinstance(q, dict) and q.get("text")]
+        queues.append([(i, j, q) for j, q in enumerate(qs)])
+    while len(picked) < limit and any(queues):
+        for qs in queues:
+            while qs and len(picked) < limit:
+                i, j, q = qs.pop(0)
+                k = q.get("chunk_id") or _norm(q["text"])
+                if k not in seen:
+                    seen.add(k)
+                    picked.append((i, j, q))
+                    break
+    return [q for _, _, q in sorted(picked, key=lambda t: t[:2])]
+
+
+def reduce_profiles(entity: str, partials: List[Dict], total: int = None, language: str = "pt") -> Dict:
+    """
+    Merge partial profiles ({"label", "json", "weight"}, in corpus order) into one:
+    Big Five and confidence averaged by evidence weight (tokens of evidence behind each
+    partial), attachment style by weighted vote, list fields unioned and ranked by
+    weight, quotes spread over all partitions, and the emotional arc as the partitions'
+    arcs in chronological order. Confidence is scaled by the share of partitions merged.
+    """
+    total = total or len(partials)
+    big_five = {}
+    for trait in ("O", "C", "E", "A", "N"):
+        v = _weighted_mean((_score((p["json"].get("big_five") or {}).get(trait)), p["weight"]) for p in partials)
+        if v is not None:
+            big_five[trait] = v
+
+    votes, first = {}, {}
+    for p in partials:
+        style = p["json"].get("attachment_style")
+        if isinstance(style, str) and style.strip():
+            votes[_norm(style)] = votes.get(_norm(style), 0.0) + p["weight"]
+            first.setdefault(_norm(style), style.strip())
+
+    arcs = []
+    for p in partials:
+        a = p["json"].get("emotional_arc")
+        if isinstance(a, str) and a.strip() and (not arcs or _norm(a) != _norm(arcs[-1][1])):
+            arcs.append((p["label"], a.strip()))   # consecutive repeats are said once
+    arc = " → ".join(f"({label}) {a}" for label, a in arcs)
+    limitations = _ranked_union(partials, "limitations")
+    if len(partials) < total:
+        limitations.append(f"{total - len(partials)} de {total} partes do corpus sem perfil parcial"
+                           if language.lower().startswith("pt") else
+                           f"{total - len(partials)} of {total} corpus partitions could not be profiled")
+    confidence = _weighted_mean((_score(p["json"].get("confidence")), p["weight"]) for p in partials)
+
+    merged = {
+        "character": entity,
+        "big_five": big_five,
+        "attachment_style": first[max(votes, key=votes.get)] if votes else "",
+        "core_traits": _ranked_union(partials, "core_traits"),
+        "coping_strategies": _ranked_union(partials, "coping_strategies"),
+        "emotional_arc": arc,
+        "clinical_patterns": _ranked_union(partials, "clinical_patterns"),
+        "supporting_quotes": _quotes(partials),
+        "limitations": limitations,
+    }
+    if confidence is not None:
+        merged["confidence"] = round(confidence * len(partials) / total, 3)
+    return validate_profile(merged, entity)[0]
+
+
+def _map(part: Dict, i: int, total: int, entity: str, psych_hits: list, model: Optional[str], language: str,
+         user_context: str, budget_tokens: int, use_cache: bool) -> Dict:
+    packing = {}
+    try:
+        prompt = build_prompt(entity, part["chunks"], psych_hits, language=language,
+                              user_context=partition_context(i + 1, total, part["label"], language, user_context),
+                              budget_tokens=budget_tokens, model=model, psych_share=PSYCH_SHARE, report=packing)
+        out = generate_profile(prompt, entity, part["chunks"], psych_hits, model=model, language=language,
+                               use_cache=use_cache)
+    except Exception as e:
+        out = {"json": {}, "mode": "template", "error": str(e)}
+    # With a model, a template answer means the call failed (or returned no usable JSON)
+    error = out.get("error") or ("no usable JSON" if model and out["mode"] != "llm" else None)
+    return {"label": part["label"], "chunks": len(part["chunks"]), "weight": packing.get("evidence", {}).get("tokens")
+            or part["tokens"], "mode": out["mode"], "error": error, "json": out["json"]}
+
+
+@timed()
+def map_reduce_profile(entity: str, index_name: str, psych_hits: list, model: str = None, language: str = "pt",
+                       user_context: str = "", budget_tokens: int = 3000, partition_by: str = "section",
+                       partition_tokens: int = None, mentions: Dict = None, workers: int = WORKERS,
+                       retries: int = 1, use_cache: bool = True, checkpoint: bool = True,
+                       progress: Callable[[int, int], None] = None) -> Dict:
+    """
+    Profile `entity` from all of its evidence in `index_name` (restricted to the chunks in
+    mentions[entity] when given), one partial profile per partition of about
+    `partition_tokens` (default: the evidence share of `budget_tokens`) on `workers`
+    threads, merged with reduce_profiles(). Failed partitions are retried alone up to
+    `retries` times; with a model, finished ones are checkpointed. `progress(done, total)`
+    is called as partitions finish.
+    Returns {"json", "markdown", "mode": "map-reduce", "partitions": [...], "failed": [labels]}.
+    """
+    count_tokens, _ = prompt_token_counter(model)
+    chunks = iter_chunks(index_name)
+    allowed = (mentions or {}).get(entity)
+    if allowed:
+        chunks = (c for c in chunks if c["id"] in allowed)
+    parts = partition_evidence(chunks, partition_tokens or int(budget_tokens * (1 - PSYCH_SHARE)), count_tokens,
+                               by=partition_by)
+    if not parts:
+        out = template_fallback(entity, [], psych_hits, language=language)
+        return dict(out, mode="template", partitions=[], failed=[])
+
+    # Only model answers are worth keeping; template partials are instant to redo
+    keep = checkpoint and bool(model)
+    key = fingerprint([(h["id"], "") for h in psych_hits], entity=entity, model=model, language=language,
+                      user_context=user_context, budget=budget_tokens, partition_by=partition_by)
+    done = load_checkpoint(key) if keep else {}
+    results: List[Optional[Dict]] = [dict(done[p["digest"]], cached=True) if p["digest"] in done else None
+                                     for p in parts]
+    todo = [i for i, r in enumerate(results) if r is None]
+    count("mr_partitions", len(parts))
+    count("mr_checkpointed", len(parts) - len(todo))
+
+    for attempt in range(max(retries, 0) + 1):
+        if not todo:
+            break
+        # A retry must reach the model: the cache would hand back the answer that just failed
+        cached = use_cache and attempt == 0
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo)))) as ex:
+            futures = {ex.submit(_map, parts[i], i, len(parts), entity, psych_hits, model, language,
+                                 user_context, budget_tokens, cached): i for i in todo}
+            for fut in as_completed(futures):
+                i = futures[fut]
+                results[i] = r = fut.result()
+                if keep and r["error"] is None:
+                    done[parts[i]["digest"]] = r
+                    save_checkpoint(key, done)
+                if progress:
+                    progress(sum(1 for r in results if r is not None and r["error"] is None), len(parts))
+        todo = [i for i in todo if results[i]["error"] is not None]
+        if todo and attempt < retries:
+            count("mr_retries", len(todo))
+
+    ok = [r for r in results if r["error"] is None]
+    failed = [r["label"] for r in results if r["error"] is not None]
+    partitions = [{k: v for k, v in r.items() if k != "json"} for r in results]
+    if not ok:
+        out = template_fallback(entity, parts[0]["chunks"], psych_hits, language=language)
+        return dict(out, mode="template", error=results[0]["error"], partitions=partitions, failed=failed)
+    merged = reduce_profiles(entity, ok, total=len(parts), language=language)
+    return {"json": merged, "markdown": json_profile_to_markdown(merged), "mode": "map-reduce",
+            "partitions": partitions, "failed": failed}
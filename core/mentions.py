@@ -0,0 +1,208 @@
+import json, os, re, unicodedata
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+from . import index as _index
+from .metrics import timed
+from .preprocess import make_aliases
+
+# Entity mention detection over chunks: one Aho-Corasick automaton for every alias
+# of every entity, matched in a single pass over case- and accent-folded text
+# ("João" == "joao"), and only on word boundaries ("Ana" does not match "banana").
+
+
+def _fold_char(ch: str) -> str:
+    if ch.isspace():
+        return " "
+    return "".join(c for c in unicodedata.normalize("NFKD", ch.casefold()) if not unicodedata.combining(c))
+
+
+class _FoldTable(dict):
+    # str.translate() tables filled on first use, code point -> its folded form
+    # ("" for a combining mark, " " for any whitespace), or with `shifts`, -> "" unless
+    # it folds to 0 or 2+ chars ("ß" -> "ss"), which shifts the offsets after it
+    def __init__(self, shifts: bool = False):
+        super().__init__()
+        self.shifts = shifts
+
+    def __missing__(self, o: int) -> str:
+        v = _fold_char(chr(o))
+        if self.shifts:
+            v = "" if len(v) == 1 else "x"
+        self[o] = v
+        return v
+
+
+_FOLD, _SHIFTS = _FoldTable(), _FoldTable(shifts=True)
+_EXTRA_SPACE = re.compile(r"^ +|(?<= ) +")   # leading spaces, and all but the first of each run
+
+
+def fold_text(s: str) -> str:
+    """fold(s) without the offsets."""
+    return _EXTRA_SPACE.sub("", s.translate(_FOLD))
+
+
+def fold(s: str) -> Tuple[str, Sequence[int]]:
+    """
+    Case/accent-folded text with whitespace runs collapsed to one space, plus, for
+    each folded char, its index in `s` (so matches map back to the original text).
+    """
+    t = s.translate(_FOLD)
+    base = [i for i, ch in enumerate(s) for _ in _FOLD[ord(ch)]] if s.translate(_SHIFTS) else None
+    cuts = [m.span() for m in _EXTRA_SPACE.finditer(t)]
+    if not cuts:
+        return t, base if base is not None else range(len(t))
+    out, pos, last = [], [], 0
+    for a, b in cuts + [(len(t), len(t))]:
+        out.append(t[last:a])
+        pos.extend(base[last:a] if base is not None else range(last, a))
+        last = b
+    return "".join(out), pos
+
+
+class AliasMatcher:
+    """Multi-pattern matcher over (alias, label) pairs; the label is e.g. the entity name."""
+
+    def __init__(self, patterns: Iterable[Tuple[str, str]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Tuple[int, str]]] = [[]]   # (folded length, label)
+        self.keys: List[str] = []
+        for alias, label in patterns:
+            key = fold_text(alias).strip()
+            if not key:
+                continue
+            if key not in self.keys:
+                self.keys.append(key)
+            node = 0
+            for c in key:
+                nxt = self.goto[node].get(c)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][c] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            if (len(key), label) not in self.out[node]:
+                self.out[node].append((len(key), label))
+        # Breadth-first failure links; outputs of the fail state are inherited
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(c, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def finditer(self, text: str) -> Iterator[Tuple[str, int, int]]:
+        """(label, start, end) for every whole-word match, offsets into `text`."""
+        folded, pos = fold(text)
+        node = 0
+        for i, c in enumerate(folded):
+            while node and c not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(c, 0)
+            for length, label in self.out[node]:
+                start, end = i - length + 1, i + 1
+                if (start == 0 or not folded[start - 1].isalnum()) and \
+                        (end == len(folded) or not folded[end].isalnum()):
+                    yield label, pos[start], pos[i] + 1
+
+
+    def contains(self, text: str) -> bool:
+        """Whether any alias occurs in `text` as a whole word; stops at the first one."""
+        folded = fold_text(text)
+        n = len(folded)
+        for key in self.keys:
+            i = folded.find(key)
+            while i >= 0:
+                end = i + len(key)
+                if (i == 0 or not folded[i - 1].isalnum()) and (end == n or not folded[end].isalnum()):
+                    return True
+                i = folded.find(key, i + 1)
+        return False
+
+
+def entity_matcher(entities: Iterable[str]) -> AliasMatcher:
+    return AliasMatcher([(a, e) for e in entities for a in make_aliases(e)])
+
+
+def _longest(spans: List[List[int]]) -> List[List[int]]:
+    # "João Silva" also matches "joão" and "silva": keep only the outermost spans
+    out = []
+    for a, b in sorted(spans, key=lambda s: (s[0], -s[1])):
+        if not out or a >= out[-1][1]:
+            out.append([a, b])
+    return out
+
+
+def index_mentions(chunks: Iterable[Dict], entities: Iterable[str]) -> Dict[str, Dict[str, List[List[int]]]]:
+    """Inverted mention index: entity -> chunk id -> [[start, end], ...] (offsets in the chunk text)."""
+    entities = list(entities)
+    matcher = entity_matcher(entities)
+    mentions = {e: {} for e in entities}
+    for c in chunks:
+        for label, a, b in matcher.finditer(c["text"]):
+            mentions[label].setdefault(c["id"], []).append([a, b])
+    for per_chunk in mentions.values():
+        for cid, spans in per_chunk.items():
+            per_chunk[cid] = _longest(spans)
+    return mentions
+
+
+@timed()
+def filter_chunks(chunks: Iterable[Dict], character: str, mentions: Dict = None) -> Iterator[Dict]:
+    """
+    Yield only the chunks that mention `character`. If `mentions` is given, it is
+    filled as an inverted index (chunk id -> spans) along the way.
+    """
+    matcher = entity_matcher([character])
+    for c in chunks:
+        spans = _longest([[a, b] for _, a, b in matcher.finditer(c["text"])])
+        if spans:
+            if mentions is not None:
+                mentions[c["id"]] = spans
+            yield c
+
+
+@timed()
+def filter_entities(chunks: Iterable[Dict], entities: Iterable[str], mentions: Dict = None) -> Iterator[Dict]:
+    """
+    Yield the chunks that mention any of `entities` (one matcher pass per chunk);
+    `mentions`, if given, is filled as entity -> chunk id -> spans.
+    """
+    entities = list(entities)
+    matcher = entity_matcher(entities)
+    for c in chunks:
+        found: Dict[str, List[List[int]]] = {}
+        for label, a, b in matcher.finditer(c["text"]):
+            found.setdefault(label, []).append([a, b])
+        if found:
+            if mentions is not None:
+                for e, spans in found.items():
+                    mentions.setdefault(e, {})[c["id"]] = _longest(spans)
+            yield c
+
+
+def _mentions_path(index_name: str) -> str:
+    return os.path.join(_index.STORAGE, f"{index_name}.mentions.json")
+
+
+def save_mentions(index_name: str, mentions: Dict) -> None:
+    os.makedirs(_index.STORAGE, exist_ok=True)
+    tmp = _mentions_path(index_name) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(mentions, f, ensure_ascii=False)
+    os.replace(tmp, _mentions_path(index_name))
+
+
+def load_mentions(index_name: str) -> Dict:
+    try:
+        with open(_mentions_path(index_name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
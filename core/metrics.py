@@ -0,0 +1,265 @@
+import contextvars, functools, json, os, sys, threading, time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# Lightweight instrumentation for the pipeline: span timers (also for generators,
+# which are timed only while they run, not while the consumer does), counters and
+# peak-memory samples. Totals are kept per process; a Trace collects the spans of
+# one request (e.g. one Streamlit rerun) for a per-stage breakdown. Optional sinks:
+# one JSON line per span (PSYCHE_METRICS_LOG = file path or "stderr") and a
+# Prometheus text endpoint (serve_metrics, or PSYCHE_METRICS_PORT in the app).
+ENABLED = os.getenv("PSYCHE_METRICS", "1") != "0"
+LOG_PATH = os.getenv("PSYCHE_METRICS_LOG", "")
+
+_lock = threading.Lock()
+_spans: Dict[str, Dict] = {}          # name -> {"count", "seconds", "max"}
+_counters: Dict[str, float] = {}
+_current: contextvars.ContextVar = contextvars.ContextVar("psyche_trace", default=None)
+_log = None
+
+
+def _rss_bytes() -> int:
+    # Current resident set size; /proc on Linux, else the peak from getrusage
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    try:
+        import resource
+    except ImportError:   # Windows
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _write_log(rec: Dict) -> None:
+    global _log
+    if not LOG_PATH:
+        return
+    line = json.dumps(rec, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        if _log is None:
+            _log = sys.stderr if LOG_PATH == "stderr" else open(LOG_PATH, "a", encoding="utf-8")
+        _log.write(line)
+        _log.flush()
+
+
+class Trace:
+    """Spans recorded in one request; see start_trace()."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.t0 = time.perf_counter()
+        self.seconds: Optional[float] = None
+        self.spans: List[Dict] = []
+        self.counters: Dict[str, float] = {}
+        self.rss_start = _rss_bytes()
+        self.rss_max = self.rss_start
+        self._depth = 0
+        self._token = None
+
+    def stop(self) -> "Trace":
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.t0
+            if self._token is not None:
+                try:
+                    _current.reset(self._token)
+                except ValueError:   # stopped from another context
+                    pass
+            _write_log({"ts": time.time(), "trace": self.name, "ms": round(self.seconds * 1000, 2),
+                        "counters": self.counters, "rss_max_mb": round(self.rss_max / 2 ** 20, 1)})
+        return self
+
+    def breakdown(self) -> List[Dict]:
+        """Per-span-name totals, slowest first; `share` is the fraction of the whole request."""
+        total = self.seconds if self.seconds is not None else time.perf_counter() - self.t0
+        agg: Dict[str, Dict] = {}
+        for s in self.spans:
+            a = agg.setdefault(s["span"], {"span": s["span"], "calls": 0, "ms": 0.0, "rss_max_mb": 0.0})
+            a["calls"] += 1
+            a["ms"] += s["ms"]
+            a["rss_max_mb"] = max(a["rss_max_mb"], s["rss_mb"])
+        out = sorted(agg.values(), key=lambda a: a["ms"], reverse=True)
+        for a in out:
+            a["ms"] = round(a["ms"], 2)
+            a["share"] = round(a["ms"] / 1000 / total, 3) if total else 0.0
+        return out
+
+
+def start_trace(name: str = "request") -> Trace:
+    """Collect the spans of this thread/task into a new Trace until its stop()."""
+    t = Trace(name)
+    t._token = _current.set(t)
+    return t
+
+
+@contextmanager
+def trace(name: str = "request"):
+    t = start_trace(name)
+    try:
+        yield t
+    finally:
+        t.stop()
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def count(name: str, n: float = 1) -> None:
+    """Add `n` to counter `name` (process totals and the current trace)."""
+    if not ENABLED or not n:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+    t = _current.get()
+    if t is not None:
+        t.counters[name] = t.counters.get(name, 0) + n
+
+
+def _record(name: str, seconds: float, depth: int, attrs: Dict) -> None:
+    with _lock:
+        s = _spans.setdefault(name, {"count": 0, "seconds": 0.0, "max": 0.0})
+        s["count"] += 1
+        s["seconds"] += seconds
+        s["max"] = max(s["max"], seconds)
+    rss = _rss_bytes()
+    rec = {"span": name, "ms": round(seconds * 1000, 3), "depth": depth, "rss_mb": round(rss / 2 ** 20, 1)}
+    if attrs:
+        rec["attrs"] = attrs
+    t = _current.get()
+    if t is not None:
+        t.spans.append(rec)
+        t.rss_max = max(t.rss_max, rss)
+    _write_log(dict(rec, ts=time.time(), trace=t.name if t is not None else None))
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time the enclosed block as span `name`; `attrs` go to the log record."""
+    if not ENABLED:
+        yield attrs
+        return
+    t = _current.get()
+    depth = t._depth if t is not None else 0
+    if t is not None:
+        t._depth += 1
+    t0 = time.perf_counter()
+    try:
+        yield attrs       # callers may add attributes (e.g. sizes) before the block ends
+    finally:
+        if t is not None:
+            t._depth -= 1
+        _record(name, time.perf_counter() - t0, depth, attrs)
+
+
+def _timed_gen(name: str, gen):
+    # Only the time spent producing items counts; the span ends when the generator does
+    busy, n = 0.0, 0
+    t = _current.get()
+    depth = t._depth if t is not None else 0
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(gen)
+            except StopIteration:
+                busy += time.perf_counter() - t0
+                return
+            busy += time.perf_counter() - t0
+            n += 1
+            yield item
+    finally:
+        gen.close()
+        _record(name, busy, depth, {"items": n})
+
+
+def timed(name: str = None) -> Callable:
+    """Decorator: record each call (or each generator's run) as span `name` (default: module.function)."""
+    def deco(fn):
+        label = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+        if fn.__code__.co_flags & 0x20:   # CO_GENERATOR
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                if not ENABLED:
+                    return fn(*args, **kwargs)
+                return _timed_gen(label, fn(*args, **kwargs))
+            return gen_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def metrics_snapshot() -> Dict:
+    with _lock:
+        spans = {k: dict(v, seconds=round(v["seconds"], 6), max=round(v["max"], 6)) for k, v in _spans.items()}
+        counters = dict(_counters)
+    return {"spans": spans, "counters": counters, "rss_bytes": _rss_bytes(), "peak_rss_bytes": peak_rss_bytes()}
+
+
+def reset() -> None:
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def _metric_name(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_text() -> str:
+    """Process totals in the Prometheus text exposition format."""
+    snap = metrics_snapshot()
+    lines = ["# TYPE psyche_span_seconds summary"]
+    for name, s in sorted(snap["spans"].items()):
+        lines.append(f'psyche_span_seconds_count{{span="{name}"}} {s["count"]}')
+        lines.append(f'psyche_span_seconds_sum{{span="{name}"}} {s["seconds"]}')
+    lines.append("# TYPE psyche_span_seconds_max gauge")
+    for name, s in sorted(snap["spans"].items()):
+        lines.append(f'psyche_span_seconds_max{{span="{name}"}} {s["max"]}')
+    for name, v in sorted(snap["counters"].items()):
+        metric = f"psyche_{_metric_name(name)}_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {v}"]
+    lines += ["# TYPE psyche_rss_bytes gauge", f"psyche_rss_bytes {snap['rss_bytes']}",
+              "# TYPE psyche_peak_rss_bytes gauge", f"psyche_peak_rss_bytes {snap['peak_rss_bytes']}"]
+    return "\n".join(lines) + "\n"
+
+
+_server = None
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1"):
+    """Serve prometheus_text() at http://host:port/metrics from a background thread (once per process)."""
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
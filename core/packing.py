@@ -0,0 +1,149 @@
+import os, re, threading
+from typing import Callable, Dict, List, Optional, Sequence
+from .metrics import count, timed
+
+# Token-budgeted prompt context. Retrieved hits from the same source whose
+# character spans overlap or touch are merged into one passage (overlapping
+# chunk windows repeat text otherwise), then passages are added in score order
+# until the budget is spent, counting tokens with the generation model's
+# tokenizer when it can be loaded.
+MIN_PIECE_TOKENS = 48     # don't truncate a passage to less than this
+ADJACENT_CHARS = 1        # spans this close are merged as adjacent (one joining space)
+LEGACY_CHARS = 800        # per-chunk cut of the unbudgeted prompt, for the savings report
+
+_counters: Dict[str, tuple] = {}
+_lock = threading.Lock()                        # guards _loading only
+_loading: Dict[str, threading.Lock] = {}        # one lock per model while its tokenizer loads
+_APPROX = re.compile(r"\w+|[^\w\s]")
+
+
+def approx_count(texts: Sequence[str]) -> List[int]:
+    # Words + punctuation: close to subword counts for European languages, slightly low
+    return [len(_APPROX.findall(t)) for t in texts]
+
+
+def prompt_token_counter(model: Optional[str]):
+    """(count(texts) -> token counts, label) for the generation model; regex approximation as fallback."""
+    key = model or ""
+    found = _counters.get(key)
+    if found is not None:
+        return found
+    with _lock:
+        loading = _loading.setdefault(key, threading.Lock())
+    # Loading a tokenizer can take seconds (download): only callers of the same model wait
+    with loading:
+        if key not in _counters:
+            counter = (approx_count, "approx(words+punctuation)")
+            if model:
+                try:
+                    from transformers import AutoTokenizer
+                    tok = AutoTokenizer.from_pretrained(model, token=os.getenv("HF_API_TOKEN") or None)
+
+                    def count(texts):
+                        if not texts:
+                            return []
+                        return [len(ids) for ids in tok(list(texts), add_special_tokens=False)["input_ids"]]
+                    counter = (count, f"tokenizer:{model}")
+                except Exception:
+                    pass  # no transformers, gated/offline model: keep the approximation
+            _counters[key] = counter
+        return _counters[key]
+
+
+def _merge_text(a: Dict, b: Dict) -> str:
+    """Text of a followed by the part of b past a's end (b starts inside or right after a)."""
+    if len(a["text"]) == a["end"] - a["start"] and len(b["text"]) == b["end"] - b["start"]:
+        # Chunk text is the exact normalized slice: cut by offsets
+        tail = b["text"][max(a["end"] - b["start"], 0):]
+    else:
+        # Words re-joined from raw text: find b's leading words at the end of a
+        aw, bw = a["text"].split(), b["text"].split()
+        k = next((len(aw) - i for i in range(max(len(aw) - len(bw), 0), len(aw))
+                  if aw[i:] == bw[:len(aw) - i]), 0)
+        tail = " ".join(bw[k:])
+    tail = tail.lstrip()
+    return a["text"] + " " + tail if tail else a["text"]
+
+
+def merge_hits(hits: List[Dict]) -> List[Dict]:
+    """
+    Merge hits (in score order) whose spans in the same source overlap or touch.
+    Returns passages {"id", "ids", "text", "source", "start", "end", "score", "rank"}
+    in score order, where "rank" is the best rank among the merged hits.
+    """
+    passages: List[Dict] = []
+    for rank, h in enumerate(hits):
+        p = {"id": h["id"], "ids": [h["id"]], "text": h["text"], "source": h.get("source"),
+             "start": h.get("start"), "end": h.get("end"), "score": h.get("score", 0.0), "rank": rank}
+        if p["start"] is None or p["end"] is None or not p["source"]:
+            passages.append(p)
+            continue
+        while True:
+            other = next((q for q in passages if q["source"] == p["source"] and q["start"] is not None
+                          and q["start"] <= p["end"] + ADJACENT_CHARS
+                          and p["start"] <= q["end"] + ADJACENT_CHARS), None)
+            if other is None:
+                break
+            passages.remove(other)
+            first, second = (other, p) if other["start"] <= p["start"] else (p, other)
+            text = first["text"] if second["end"] <= first["end"] else _merge_text(first, second)
+            p = {"id": other["id"] if other["rank"] < p["rank"] else p["id"],
+                 "ids": first["ids"] + [i for i in second["ids"] if i not in first["ids"]],
+                 "text": text, "source": p["source"],
+                 "start": first["start"], "end": max(first["end"], second["end"]),
+                 "score": max(other["score"], p["score"]), "rank": min(other["rank"], p["rank"])}
+        passages.append(p)
+    return sorted(passages, key=lambda q: q["rank"])
+
+
+def _truncate(text: str, n: int, limit: int, count: Callable) -> tuple:
+    # Cut at a word boundary to at most `limit` tokens, scaling by token density
+    words = text.split(" ")
+    keep = max(1, int(len(words) * limit / max(n, 1)))
+    while keep > 1:
+        piece = " ".join(words[:keep]) + " …"
+        k = int(count([piece])[0])
+        if k <= limit:
+            return piece, k
+        keep = int(keep * 0.9)
+    return "", 0
+
+
+def _total(counts) -> int:
+    return sum(int(n) for n in counts)
+
+
+@timed()
+def pack_context(hits: List[Dict], budget_tokens: int, count_tokens: Callable[[Sequence[str]], Sequence[int]],
+                 report: Dict = None) -> List[Dict]:
+    """
+    Passages (see merge_hits) that fit in `budget_tokens`, in score order; the last one
+    that doesn't fit is truncated when at least MIN_PIECE_TOKENS remain. Each passage
+    gets "n_tokens". If `report` is given it is filled with token counts and savings.
+    """
+    passages = merge_hits(hits)
+    counts = count_tokens([p["text"] for p in passages]) if passages else []
+    out, used, truncated = [], 0, 0
+    for p, n in zip(passages, counts):
+        n = int(n)
+        left = budget_tokens - used
+        if n <= left:
+            out.append(dict(p, n_tokens=n))
+            used += n
+        elif left >= MIN_PIECE_TOKENS:
+            text, k = _truncate(p["text"], n, left, count_tokens)
+            if k:
+                out.append(dict(p, text=text, n_tokens=k))
+                used += k
+                truncated += 1
+    if report is not None:
+        raw = count_tokens([h["text"] for h in hits]) if hits else []
+        legacy = count_tokens([h["text"][:LEGACY_CHARS] for h in hits]) if hits else []
+        report.update({"hits": len(hits), "passages": len(passages), "packed": len(out),
+                       "merged": len(hits) - len(passages), "truncated": truncated,
+                       "dropped": len(passages) - len(out), "tokens": used,
+                       "tokens_duplicate": _total(raw) - _total(counts),
+                       "tokens_unbudgeted": _total(legacy),
+                       "tokens_saved": _total(legacy) - used})
+    count("prompt_tokens", used)
+    return out
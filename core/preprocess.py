@@ -1,5 +1,8 @@
-from typing import List, Dict
-from .utils import normalize_text, contains_any
+import re
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+from .utils import iter_normalized
+from .metrics import timed
 
 def make_aliases(name: str) -> List[str]:
     name_low = name.lower().strip()
@@ -10,26 +13,178 @@ def make_aliases(name: str) -> List[str]:
         aliases.add(parts[-1])
     return sorted(aliases)
 
+@timed()
 def character_filter(docs: List[Dict], character: str) -> List[Dict]:
-    aliases = make_aliases(character)
-    out = []
-    for d in docs:
-        if contains_any(d["text"], aliases):
-            out.append(d)
-    return out
+    # Document-level check; prefer core.mentions.filter_chunks, which keeps only the
+    # chunks that mention the entity instead of whole documents
+    from .mentions import entity_matcher
+    matcher = entity_matcher([character])
+    return [d for d in docs if matcher.contains(d["text"])]
 
+@timed()
 def chunk_text(doc: Dict, chunk_size: int = 900, overlap: int = 200) -> List[Dict]:
-    words = doc["text"].split()
+    # Word spans (not just words) so each chunk records its character offsets in doc["text"]
+    spans = [(m.start(), m.end()) for m in re.finditer(r"\S+", doc["text"])]
     chunks = []
     i = 0
     idx = 0
-    while i < len(words):
-        piece = " ".join(words[i:i+chunk_size])
+    while i < len(spans):
+        window = spans[i:i+chunk_size]
+        piece = " ".join(doc["text"][a:b] for a, b in window)
         chunks.append({
             "id": f'{doc["source"]}#chunk{idx:04d}',
             "source": doc["source"],
-            "text": piece
+            "text": piece,
+            "ord": idx,
+            "start": window[0][0],
+            "end": window[-1][1]
         })
         i += (chunk_size - overlap)
         idx += 1
     return chunks
+
+def iter_chunks(source: str, words: Iterable[Tuple[str, int, int]], chunk_size: int = 900, overlap: int = 200) -> Iterator[Dict]:
+    """
+    Streaming chunk_text() over (word, start, end) tuples (see core.utils.iter_words):
+    same windows and ids, with at most `chunk_size` words held in memory.
+    """
+    step = chunk_size - overlap
+    window = deque()
+    idx = 0
+
+    def emit():
+        return {
+            "id": f"{source}#chunk{idx:04d}",
+            "source": source,
+            "text": " ".join(w for w, _, _ in window),
+            "ord": idx,
+            "start": window[0][1],
+            "end": window[-1][2]
+        }
+
+    for w in words:
+        window.append(w)
+        if len(window) == chunk_size:
+            yield emit()
+            idx += 1
+            for _ in range(step):
+                window.popleft()
+    # Trailing (shorter) windows, exactly as chunk_text() produces them
+    while window:
+        yield emit()
+        idx += 1
+        if len(window) <= step:
+            break
+        for _ in range(step):
+            window.popleft()
+
+
+# --- Token-aware chunking -------------------------------------------------------
+# Chunks are bounded by the encoder's max sequence length (tokens past it are never
+# embedded) and aligned to sentence boundaries. Token counts come from one batched
+# tokenizer call per group of sentences and are summed, never re-tokenized.
+
+_SENT_END = re.compile(r"[.!?…]+[\"'»”’)\]]*(?=\s)")
+MAX_SENTENCE_CHARS = 2000
+
+def iter_sentences(blocks: Iterable[str]) -> Iterator[Tuple[str, int, int]]:
+    """(sentence, start, end) over a stream of text blocks; offsets into the normalized text."""
+    buf, base = "", 0
+    for piece in iter_normalized(blocks):
+        buf += piece
+        cut = 0
+        for m in _SENT_END.finditer(buf):
+            yield from _sentence(buf, cut, m.end(), base)
+            cut = m.end()
+        # No boundary in sight: force a cut at the last space to keep the buffer bounded
+        if len(buf) - cut > MAX_SENTENCE_CHARS:
+            sp = buf.rfind(" ", cut, len(buf) - 1)
+            if sp > cut:
+                yield from _sentence(buf, cut, sp, base)
+                cut = sp
+        base += cut
+        buf = buf[cut:]
+    yield from _sentence(buf, 0, len(buf), base)
+
+def _sentence(buf: str, a: int, b: int, base: int):
+    while a < b and buf[a] == " ":
+        a += 1
+    while b > a and buf[b - 1] == " ":
+        b -= 1
+    if a < b:
+        yield buf[a:b], base + a, base + b
+
+def _split_long(sent: Tuple[str, int, int], n: int, max_tokens: int,
+                count_tokens: Callable[[Sequence[str]], Sequence[int]]):
+    # A single sentence over the limit: cut it into word runs sized by its token density
+    text, a, _ = sent
+    words = [(m.start(), m.end()) for m in re.finditer(r"\S+", text)]
+    per = max(1, int(len(words) * max_tokens / n * 0.9))
+    parts = [(text[w[0][0]:w[-1][1]], a + w[0][0], a + w[-1][1])
+             for w in (words[i:i + per] for i in range(0, len(words), per))]
+    for part, k in zip(parts, count_tokens([p[0] for p in parts])):
+        if k > max_tokens and per > 1:
+            yield from _split_long(part, int(k), max_tokens, count_tokens)
+        else:
+            yield part, int(k)
+
+@timed()
+def iter_token_chunks(source: str, sentences: Iterable[Tuple[str, int, int]],
+                      count_tokens: Callable[[Sequence[str]], Sequence[int]],
+                      max_tokens: int = 510, overlap_tokens: int = 32, batch: int = 256) -> Iterator[Dict]:
+    """
+    Pack sentences into chunks of at most `max_tokens` tokens, repeating up to
+    `overlap_tokens` worth of trailing sentences at the start of the next chunk.
+    `count_tokens(texts)` returns one token count per text (see core.encoders.token_counter).
+    """
+    window = deque()   # (text, start, end, n_tokens)
+    total = 0
+    idx = 0
+
+    def emit():
+        return {
+            "id": f"{source}#chunk{idx:04d}",
+            "source": source,
+            "text": " ".join(s[0] for s in window),
+            "ord": idx,
+            "start": window[0][1],
+            "end": window[-1][2],
+            "n_tokens": total
+        }
+
+    for sents in _groups(sentences, batch):
+        for sent, n in zip(sents, count_tokens([s[0] for s in sents])):
+            n = int(n)
+            pieces = _split_long(sent, n, max_tokens, count_tokens) if n > max_tokens else [(sent, n)]
+            for (text, a, b), k in pieces:
+                if window and total + k > max_tokens:
+                    yield emit()
+                    idx += 1
+                    keep, t = deque(), 0
+                    while window and t + window[-1][3] <= overlap_tokens:
+                        keep.appendleft(window.pop())
+                        t += keep[0][3]
+                    while keep and t + k > max_tokens:
+                        t -= keep.popleft()[3]
+                    window, total = keep, t
+                window.append((text, a, b, k))
+                total += k
+    if window:
+        yield emit()
+
+def _groups(items: Iterable, size: int) -> Iterator[List]:
+    group = []
+    for it in items:
+        group.append(it)
+        if len(group) >= size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+@timed()
+def chunk_tokens(doc: Dict, count_tokens: Callable[[Sequence[str]], Sequence[int]],
+                 max_tokens: int = 510, overlap_tokens: int = 32) -> List[Dict]:
+    """Token-bounded, sentence-aligned counterpart of chunk_text() (offsets into the normalized text)."""
+    return list(iter_token_chunks(doc["source"], iter_sentences([doc["text"]]), count_tokens,
+                                  max_tokens=max_tokens, overlap_tokens=overlap_tokens))
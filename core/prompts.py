@@ -1,3 +1,7 @@
+import json
+from .packing import pack_context, prompt_token_counter
+from .metrics import timed
+
 PROFILE_JSON_SCHEMA = {
   "character": "string",
   "big_five": {"O": "0-1", "C": "0-1", "E": "0-1", "A": "0-1", "N": "0-1"},
@@ -11,9 +15,28 @@ PROFILE_JSON_SCHEMA = {
   "confidence": "0-1"
 }
 
-def build_prompt(character: str, char_chunks: list, psych_chunks: list, language: str = "pt", user_context: str = "") -> str:
-    char_ctx = "\n\n".join([f"[{c['id']}] {c['text'][:800]}" for c in char_chunks])
-    psy_ctx = "\n\n".join([f"[{c['id']}] {c['text'][:800]}" for c in psych_chunks])
+def _context(passages: list) -> str:
+    return "\n\n".join([f"[{', '.join(p['ids'])}] {p['text']}" for p in passages])
+
+@timed()
+def build_prompt(character: str, char_chunks: list, psych_chunks: list, language: str = "pt", user_context: str = "",
+                 budget_tokens: int = None, model: str = None, psych_share: float = 0.3, report: dict = None) -> str:
+    # With budget_tokens, the context is packed (core.packing): overlapping hits merged,
+    # theory first up to psych_share of the budget, evidence in score order with the rest;
+    # `report` (if given) receives the token accounting.
+    if budget_tokens:
+        count, counter = prompt_token_counter(model)
+        rep_psych, rep_char = {}, {}
+        psych = pack_context(psych_chunks, int(budget_tokens * psych_share), count, rep_psych)
+        char = pack_context(char_chunks, budget_tokens - rep_psych["tokens"], count, rep_char)
+        char_ctx, psy_ctx = _context(char), _context(psych)
+        if report is not None:
+            report.update({"counter": counter, "budget": budget_tokens, "evidence": rep_char, "theory": rep_psych,
+                           "tokens": rep_char["tokens"] + rep_psych["tokens"],
+                           "tokens_saved": rep_char["tokens_saved"] + rep_psych["tokens_saved"]})
+    else:
+        char_ctx = "\n\n".join([f"[{c['id']}] {c['text'][:800]}" for c in char_chunks])
+        psy_ctx = "\n\n".join([f"[{c['id']}] {c['text'][:800]}" for c in psych_chunks])
 
     # User context section (if provided)
     if user_context and user_context.strip():
@@ -98,3 +121,38 @@ RESPONSE FORMAT:
 Start with the JSON now:
 """
     return instr_pt if language.lower().startswith("pt") else instr_en
+
+@timed()
+def build_repair_prompt(prompt: str, partial: dict, fields: list, language: str = "pt") -> str:
+    # Follow-up to `prompt` asking only for the fields that were missing or invalid
+    done = json.dumps(partial, ensure_ascii=False, indent=2)
+    keys = ", ".join(fields)
+    if language.lower().startswith("pt"):
+        return f"""{prompt}
+
+A tua resposta anterior já tem estes campos válidos:
+{done}
+
+Faltam ou são inválidos os campos: {keys}.
+Devolve APENAS um objeto JSON com exatamente estas chaves ({keys}), no formato do JSON_SCHEMA, sem Markdown:
+"""
+    return f"""{prompt}
+
+Your previous answer already has these valid fields:
+{done}
+
+These fields are missing or invalid: {keys}.
+Return ONLY a JSON object with exactly these keys ({keys}), following the JSON_SCHEMA, with no Markdown:
+"""
+
+def partition_context(index: int, total: int, label: str, language: str = "pt", user_context: str = "") -> str:
+    # Extra instructions for one map step of core.mapreduce (appended to the user's own)
+    if language.lower().startswith("pt"):
+        note = (f"As EVIDÊNCIAS são apenas a parte {index} de {total} do corpus ({label}), por ordem cronológica. "
+                f"Analisa só esta parte: as partes são combinadas depois. Em emotional_arc descreve a evolução "
+                f"dentro desta parte; em confidence indica quão bem esta parte sustenta o perfil.")
+    else:
+        note = (f"The EVIDENCE is only part {index} of {total} of the corpus ({label}), in chronological order. "
+                f"Analyze this part only: the parts are combined afterwards. In emotional_arc describe the "
+                f"development within this part; in confidence state how well this part supports the profile.")
+    return f"{user_context.strip()}\n\n{note}" if user_context and user_context.strip() else note
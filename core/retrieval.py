@@ -1,6 +1,48 @@
-from .index import search
+from typing import Dict, List, Tuple
+from .index import encode_query, hits_for_rows, search, search_rows, search_vector
+from .bm25 import bm25_search
+from .metrics import timed
+from .theory import THEORY_INDEX, theory_query_vector
 
-def ensemble_retrieve(character_query: str, theory_query: str, emb_model: str, k_char: int = 8, k_psych: int = 6):
-    char_hits = search(character_query, "character", emb_model, top_k=k_char)
-    psych_hits = search(theory_query, "psych", emb_model, top_k=k_psych)
+RRF_K = 60
+
+
+def character_query(character: str) -> str:
+    return f"{character} behaviour emotions relationships motivations internal conflict key scenes quotes descriptions"
+
+
+def rrf_fuse(rankings: List[List[Tuple[int, float]]], k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Reciprocal-rank fusion of several (row, score) rankings -> (row, fused score), best first."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (row, _) in enumerate(ranking):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
+
+
+@timed()
+def hybrid_search(query: str, index_name: str, emb_model: str, top_k: int = 5, rrf_k: int = RRF_K,
+                  nprobe: int = None, ef_search: int = None):
+    """Dense + BM25 retrieval fused with RRF; `score` in the hits is the fused score."""
+    depth = max(top_k * 3, 20)
+    dense = search_rows(encode_query(query, emb_model), index_name, depth, nprobe=nprobe, ef_search=ef_search)
+    sparse = bm25_search(query, index_name, depth)
+    return hits_for_rows(index_name, rrf_fuse([dense, sparse], k=rrf_k), top_k)
+
+
+@timed()
+def ensemble_retrieve(character_query: str, theory_query: str, emb_model: str, k_char: int = 8, k_psych: int = 6,
+                      nprobe: int = None, ef_search: int = None, hybrid: bool = False,
+                      index_name: str = "character"):
+    knobs = {"nprobe": nprobe, "ef_search": ef_search}
+    if hybrid:
+        char_hits = hybrid_search(character_query, index_name, emb_model, top_k=k_char, **knobs)
+    else:
+        char_hits = search(character_query, index_name, emb_model, top_k=k_char, **knobs)
+    # Standard theory queries are pre-encoded when the theory index is built
+    q = theory_query_vector(theory_query)
+    if q is not None:
+        psych_hits = search_vector(q, THEORY_INDEX, top_k=k_psych, **knobs)
+    else:
+        psych_hits = search(theory_query, THEORY_INDEX, emb_model, top_k=k_psych, **knobs)
     return char_hits, psych_hits
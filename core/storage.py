@@ -0,0 +1,124 @@
+import hashlib, json, os, time
+from typing import Callable, Dict, Iterable, List
+from . import index as _index
+from .index import drop_index, open_index
+from .utils import file_lock
+
+# Shared index namespaces. A corpus index is named after its corpus fingerprint,
+# entity and embedding model, so identical uploads from different sessions (or
+# processes) resolve to the same name and reuse one build, and different corpora
+# never overwrite each other. ensure() builds a namespace at most once at a time
+# (others wait on its build lock and then reuse the result), and enforce_quota()
+# deletes the least recently used namespaces beyond MAX_INDEXES / QUOTA_MB.
+PREFIX = "corpus-"
+MAX_INDEXES = int(os.getenv("PSYCHE_MAX_CORPUS_INDEXES", "8"))
+QUOTA_MB = float(os.getenv("PSYCHE_STORAGE_QUOTA_MB", "1024"))
+
+
+def namespace(corpus_key: str, entity: str = "", emb_model: str = "") -> str:
+    """Index name for a corpus fingerprint (core.utils.fingerprint), entity and embedding model."""
+    payload = json.dumps([corpus_key, " ".join(entity.split()).casefold(), emb_model], ensure_ascii=False)
+    return PREFIX + hashlib.blake2b(payload.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def _build_lock_path(name: str) -> str:
+    return os.path.join(_index.STORAGE, f"{name}.build.lock")
+
+
+def build_lock(name: str, blocking: bool = True):
+    """Cross-process lock held while `name` is (re)built; see core.utils.file_lock."""
+    os.makedirs(_index.STORAGE, exist_ok=True)
+    return file_lock(_build_lock_path(name), blocking=blocking)
+
+
+def touch(name: str) -> None:
+    """Mark `name` as used now (the LRU order of enforce_quota)."""
+    try:
+        os.utime(os.path.join(_index.STORAGE, f"{name}.lock"))
+    except FileNotFoundError:
+        pass
+
+
+def lookup(name: str) -> bool:
+    """True if `name` is built (and marks it used)."""
+    if open_index(name) is None:
+        return False
+    touch(name)
+    return True
+
+
+def ensure(name: str, build: Callable[[], None]) -> bool:
+    """
+    Build `name` with `build()` unless it exists. Concurrent callers for the same name
+    wait for the first build and reuse it. Returns True if this call built it.
+    """
+    if lookup(name):
+        return False
+    with build_lock(name):
+        if lookup(name):
+            return False
+        build()
+        touch(name)
+        return True
+
+
+def namespaces() -> List[Dict]:
+    """Corpus namespaces on disk: {"name", "bytes", "last_used"}, least recently used first."""
+    if not os.path.isdir(_index.STORAGE):
+        return []
+    files = os.listdir(_index.STORAGE)
+    out = []
+    for n in files:
+        if not (n.startswith(PREFIX) and n.endswith(".index")) or ".staging-" in n:
+            continue
+        name = n[:-len(".index")]
+        stats = {}
+        for f in files:
+            if f.startswith(name + "."):
+                try:
+                    stats[f] = os.stat(os.path.join(_index.STORAGE, f))
+                except FileNotFoundError:
+                    continue
+        if n not in stats:
+            continue
+        used = stats.get(name + ".lock", stats[n]).st_mtime
+        out.append({"name": name, "bytes": sum(st.st_size for st in stats.values()), "last_used": used})
+    return sorted(out, key=lambda e: e["last_used"])
+
+
+def _drop_if_idle(name: str) -> bool:
+    # Never delete a namespace that is being built right now
+    with build_lock(name, blocking=False) as got:
+        if got:
+            drop_index(name)
+        return got
+
+
+def enforce_quota(keep: Iterable[str] = (), max_indexes: int = None, quota_mb: float = None) -> List[str]:
+    """Delete least recently used namespaces (except `keep`) until within the limits; returns their names."""
+    max_indexes = MAX_INDEXES if max_indexes is None else max_indexes
+    limit = int((QUOTA_MB if quota_mb is None else quota_mb) * 1024 * 1024)
+    keep = set(keep)
+    entries = namespaces()
+    total, n, dropped = sum(e["bytes"] for e in entries), len(entries), []
+    for e in entries:
+        if n <= max_indexes and total <= limit:
+            break
+        if e["name"] in keep or not _drop_if_idle(e["name"]):
+            continue
+        total -= e["bytes"]
+        n -= 1
+        dropped.append(e["name"])
+    return dropped
+
+
+def clear() -> List[str]:
+    """Delete every idle corpus namespace."""
+    return [e["name"] for e in namespaces() if _drop_if_idle(e["name"])]
+
+
+def storage_stats() -> Dict:
+    entries = namespaces()
+    return {"namespaces": len(entries), "bytes": sum(e["bytes"] for e in entries),
+            "max_indexes": MAX_INDEXES, "quota_mb": QUOTA_MB,
+            "oldest_age_s": round(time.time() - entries[0]["last_used"], 1) if entries else 0.0}
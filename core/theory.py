@@ -0,0 +1,117 @@
+import os, json, hashlib, threading
+import numpy as np
+from typing import Dict, Optional
+from . import index as _index
+from .index import build_faiss, encode_query, open_index
+from .encoders import max_tokens, token_counter
+from .preprocess import chunk_tokens
+from .storage import build_lock
+
+# The psychology knowledge base is static, so its index is built once and reused
+# until the files under knowledge/psychology/ (or the embedding model) change.
+PSYCH_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "knowledge", "psychology")
+THEORY_INDEX = "psych"
+THEORY_VERSION = 2   # 2: token-aware chunking
+
+# Standard theory queries; their embeddings are precomputed with the index
+THEORY_QUERIES = {
+    "default": "big five traits attachment styles coping mechanisms defense mechanisms psychological profiling glossary examples",
+}
+
+_lock = threading.Lock()
+_query_vecs: Dict = {}
+
+
+def _manifest_path() -> str:
+    return os.path.join(_index.STORAGE, f"{THEORY_INDEX}.manifest.json")
+
+
+def _queries_path() -> str:
+    return os.path.join(_index.STORAGE, f"{THEORY_INDEX}.queries.npz")
+
+
+def _md_files(psych_dir: str):
+    return sorted(n for n in os.listdir(psych_dir) if n.endswith(".md")) if os.path.isdir(psych_dir) else []
+
+
+def _stat_sig(psych_dir: str) -> Dict:
+    out = {}
+    for n in _md_files(psych_dir):
+        st = os.stat(os.path.join(psych_dir, n))
+        out[n] = [st.st_size, st.st_mtime_ns]
+    return out
+
+
+def knowledge_signature(psych_dir: str = PSYCH_DIR) -> str:
+    """Cheap change key for knowledge/ (file names, sizes and mtimes; no reads)."""
+    return json.dumps(_stat_sig(psych_dir), sort_keys=True)
+
+
+def knowledge_manifest(psych_dir: str, emb_model: str) -> Dict:
+    files = {}
+    for n in _md_files(psych_dir):
+        with open(os.path.join(psych_dir, n), "rb") as f:
+            files[n] = hashlib.sha256(f.read()).hexdigest()
+    return {"version": THEORY_VERSION, "emb_model": emb_model, "files": files,
+            "stat": _stat_sig(psych_dir), "queries": THEORY_QUERIES}
+
+
+def _read_manifest() -> Dict:
+    try:
+        with open(_manifest_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _same(a: Dict, b: Dict) -> bool:
+    keys = ("version", "emb_model", "files", "queries")
+    return all(a.get(k) == b.get(k) for k in keys)
+
+
+def ensure_theory_index(emb_model: str, psych_dir: str = PSYCH_DIR) -> bool:
+    """Build the theory index if knowledge/ changed since the last build. Returns True if rebuilt."""
+    # Other processes (app sessions, CLI runs) wait on the build lock and then see the new manifest
+    with _lock, build_lock(THEORY_INDEX):
+        old = _read_manifest()
+        built = open_index(THEORY_INDEX) is not None and os.path.exists(_queries_path())
+        # Fast path: unchanged file sizes/mtimes means unchanged content, no hashing needed
+        if built and old.get("emb_model") == emb_model and old.get("version") == THEORY_VERSION \
+                and old.get("queries") == THEORY_QUERIES and old.get("stat") == _stat_sig(psych_dir):
+            return False
+        new = knowledge_manifest(psych_dir, emb_model)
+        if built and _same(old, new):
+            _write_manifest(new)
+            return False
+
+        chunks = []
+        count, limit = token_counter(emb_model), max_tokens(emb_model)
+        for n in new["files"]:
+            with open(os.path.join(psych_dir, n), "r", encoding="utf-8") as f:
+                chunks.extend(chunk_tokens({"source": n, "text": f.read()}, count, max_tokens=limit))
+        build_faiss(chunks, THEORY_INDEX, emb_model)
+        names = sorted(THEORY_QUERIES)
+        vecs = np.vstack([encode_query(THEORY_QUERIES[k], emb_model) for k in names])
+        os.makedirs(_index.STORAGE, exist_ok=True)   # no chunks: build_faiss wrote nothing
+        np.savez(_queries_path(), names=np.array(names), vecs=vecs)
+        _query_vecs.clear()
+        _write_manifest(new)
+        return True
+
+
+def _write_manifest(manifest: Dict) -> None:
+    tmp = _manifest_path() + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, _manifest_path())
+
+
+def theory_query_vector(query: str) -> Optional[np.ndarray]:
+    """Precomputed embedding for one of THEORY_QUERIES, or None for any other query."""
+    if not _query_vecs:
+        with _lock:
+            if not _query_vecs and os.path.exists(_queries_path()):
+                data = np.load(_queries_path())
+                for name, vec in zip(data["names"], data["vecs"]):
+                    _query_vecs[THEORY_QUERIES.get(str(name), "")] = vec
+    return _query_vecs.get(query)
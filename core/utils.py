@@ -1,4 +1,6 @@
-import re
+import hashlib, json, os, re
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Tuple
 
 def normalize_text(s: str) -> str:
     return re.sub(r"\s+", " ", (s or "")).strip()
@@ -6,3 +8,74 @@ def normalize_text(s: str) -> str:
 def contains_any(s: str, keywords):
     s_low = (s or "").lower()
     return any(k.lower() in s_low for k in keywords)
+
+def iter_normalized(blocks: Iterable[str]) -> Iterator[str]:
+    """Streaming normalize_text(): same output, split into pieces, one block in memory at a time."""
+    started = pending_space = False
+    for b in blocks:
+        out = []
+        for i, part in enumerate(re.split(r"\s+", b)):
+            if i > 0:
+                pending_space = True
+            if part:
+                if pending_space and started:
+                    out.append(" ")
+                out.append(part)
+                started, pending_space = True, False
+        if out:
+            yield "".join(out)
+
+def iter_words(blocks: Iterable[str]) -> Iterator[Tuple[str, int, int]]:
+    """(word, start, end) for each word, offsets into the normalized text; words may span blocks."""
+    pos, partial = 0, ""
+    for piece in iter_normalized(blocks):
+        words = (partial + piece).split(" ")
+        partial = words.pop()
+        for w in words:
+            if w:
+                yield w, pos, pos + len(w)
+            pos += len(w) + 1
+    if partial:
+        yield partial, pos, pos + len(partial)
+
+def file_digest(f, block_size: int = 1 << 20) -> str:
+    """Content hash of a binary file object (read from the start, position restored)."""
+    h = hashlib.blake2b(digest_size=16)
+    pos = f.tell()
+    f.seek(0)
+    for raw in iter(lambda: f.read(block_size), b""):
+        h.update(raw)
+    f.seek(pos)
+    return h.hexdigest()
+
+def fingerprint(parts: Iterable[Tuple[str, str]], **settings) -> str:
+    """Stable key for (name, digest) parts plus settings: same inputs, same key, in any session."""
+    payload = json.dumps([sorted(parts), settings], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+@contextmanager
+def file_lock(path: str, shared: bool = False, blocking: bool = True):
+    """
+    Advisory lock on `path` (created if missing) shared between processes and threads;
+    yields False instead of waiting when `blocking` is off and the lock is taken.
+    Without fcntl (Windows) it yields True without locking.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield True
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        flags = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(fd, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)